@@ -1,6 +1,30 @@
 from google.adk.agents import Agent
+from google.adk.agents.callback_context import CallbackContext
 from google.adk.tools import google_search
-from .tools import get_bicimad_stations, visualize_bicimad_stations
+from .tools import (
+    start_bicimad_services,
+    get_bicimad_station_history,
+    get_bicimad_stations_async,
+    get_bicimad_station_poi_async,
+    get_bicimad_nearest_stations_async,
+    get_bicimad_stations_near_points_async,
+    query_bicimad_stations_async,
+    find_bicimad_station_async,
+    get_bicimad_stations_near_place_async,
+    plan_bicimad_trip_async,
+    get_bicimad_rebalancing_async,
+    get_bicimad_changes_async,
+    get_bicimad_station_trend_async,
+    forecast_bicimad_availability_async,
+    visualize_bicimad_stations_async,
+    get_bicimad_heatmap_async,
+)
+
+
+def start_background_services(callback_context: CallbackContext) -> None:
+    """Start the EMT login and the optional station poller on the first turn."""
+    start_bicimad_services()
+
 
 root_agent = Agent(
     name="api_assistant",
@@ -12,12 +36,42 @@ You have access to:
 2. BiciMAD API - for real-time information about bike-sharing stations in Madrid
 
 When asked about BiciMAD or bike stations in Madrid:
-- Use get_bicimad_stations to fetch all stations or a specific station by ID
-- Use visualize_bicimad_stations to generate an interactive HTML visualization showing all stations with their occupancy status, IDs, and availability
+- Use get_bicimad_stations_async to fetch all stations or a specific station by ID. For network-wide questions use summary=True; otherwise ask only for the fields you need (fields=[...]) and use sort_by/limit (e.g. sort_by="-dock_bikes", limit=10) instead of reading the whole list
+- Use find_bicimad_station_async when the user names a station ("Sol", "Atocha", "glorieta de bilbao") to get its ID, then query that ID; accents, case and small typos do not matter
+- Use get_bicimad_stations_near_place_async when the user gives a Madrid place instead of coordinates ("cerca del Retiro", "metro Bilbao", "Malasaña"): it resolves landmarks, metro stations and barrios offline and returns the nearest stations in one call. Only search the web for coordinates if it reports an unknown place
+- Use get_bicimad_station_poi_async to find stations within a radius of a latitude/longitude
+- Use get_bicimad_nearest_stations_async to find the N stations closest to a latitude/longitude
+- Use plan_bicimad_trip_async for "how do I go by bike from A to B" questions: origin and destination can be Madrid places, station names or "latitude,longitude"; it returns the best pickup and drop-off stations with walking and riding times in one call
+- Use get_bicimad_stations_near_points_async when several points matter at once (origin, destination, waypoints): it returns the nearest stations with bikes or free docks for every point in a single call
+- Use query_bicimad_stations_async for filtered lists, e.g. "active stations with at least 5 bikes in this area ordered by free docks": combine min_bikes/max_bikes, min_docks/max_docks, active, bbox=[south, west, north, east], sort_by and limit instead of reading the whole list
+- Use get_bicimad_changes_async for "what changed" or monitoring questions: it returns only the stations whose bikes, docks or activation changed. Pass the returned current_version as `since` next time
+- Use get_bicimad_station_history to show how bikes and docks at a station evolved over the last minutes (e.g. "how has station 25 changed in the last hour")
+- Use get_bicimad_station_trend_async for longer-term patterns over hours or days (mean bikes per time bucket, how often the station is empty or full)
+- Use forecast_bicimad_availability_async for questions about the future, e.g. "will there be bikes at station X at 8am?" (pass `when` as HH:MM or an ISO datetime); mention the typical range and the probability of finding a bike
+- Use get_bicimad_rebalancing_async when operations staff ask which stations to move bikes between: it returns truck moves (from, to, bikes, distance) that even out full and empty stations. Use max_distance_km to keep moves local
+- Use visualize_bicimad_stations_async to generate an interactive HTML visualization showing all stations with their occupancy status, IDs, and availability. Pass live=True when the user wants a map that keeps updating itself
+- Use get_bicimad_heatmap_async for city-wide questions such as "where in Madrid are bikes scarce right now?": it reports the areas with the lowest availability and their nearest station, and writes a heatmap image for a map overlay
 
-When the user asks for the status of all stations or wants to visualize the stations, ALWAYS use visualize_bicimad_stations.
+When the user asks for the status of all stations or wants to visualize the stations, ALWAYS use visualize_bicimad_stations_async.
 
 Provide clear and helpful responses based on the API data.""",
     description="An assistant that can search the web and query EMT Madrid's BiciMAD API for bike station information.",
-    tools=[get_bicimad_stations, visualize_bicimad_stations]
+    before_agent_callback=start_background_services,
+    tools=[
+        get_bicimad_stations_async,
+        get_bicimad_station_poi_async,
+        get_bicimad_nearest_stations_async,
+        get_bicimad_stations_near_points_async,
+        query_bicimad_stations_async,
+        find_bicimad_station_async,
+        get_bicimad_stations_near_place_async,
+        plan_bicimad_trip_async,
+        get_bicimad_rebalancing_async,
+        get_bicimad_changes_async,
+        get_bicimad_station_history,
+        get_bicimad_station_trend_async,
+        forecast_bicimad_availability_async,
+        visualize_bicimad_stations_async,
+        get_bicimad_heatmap_async,
+    ]
 )
\ No newline at end of file
@@ -1,5 +1,71 @@
 """Tools for API agent."""
 
-from .emt_madrid import get_bicimad_stations, visualize_bicimad_stations
+from .emt_madrid import (
+    get_bicimad_stations,
+    get_bicimad_station_poi,
+    get_bicimad_nearest_stations,
+    get_bicimad_stations_near_points,
+    query_bicimad_stations,
+    find_bicimad_station,
+    get_bicimad_stations_near_place,
+    plan_bicimad_trip,
+    get_bicimad_rebalancing,
+    get_bicimad_changes,
+    get_bicimad_station_history,
+    get_bicimad_station_trend,
+    forecast_bicimad_availability,
+    start_bicimad_poller,
+    start_bicimad_services,
+    visualize_bicimad_stations,
+    get_bicimad_heatmap,
+    get_bicimad_stations_async,
+    get_bicimad_station_poi_async,
+    get_bicimad_nearest_stations_async,
+    get_bicimad_stations_near_points_async,
+    query_bicimad_stations_async,
+    find_bicimad_station_async,
+    get_bicimad_stations_near_place_async,
+    plan_bicimad_trip_async,
+    get_bicimad_rebalancing_async,
+    get_bicimad_changes_async,
+    get_bicimad_station_trend_async,
+    forecast_bicimad_availability_async,
+    visualize_bicimad_stations_async,
+    get_bicimad_heatmap_async,
+)
 
-__all__ = ["get_bicimad_stations", "visualize_bicimad_stations"]
+__all__ = [
+    # Synchronous tools (scripts, tests)
+    "get_bicimad_stations",
+    "get_bicimad_station_poi",
+    "get_bicimad_nearest_stations",
+    "get_bicimad_stations_near_points",
+    "query_bicimad_stations",
+    "find_bicimad_station",
+    "get_bicimad_stations_near_place",
+    "plan_bicimad_trip",
+    "get_bicimad_rebalancing",
+    "get_bicimad_changes",
+    "get_bicimad_station_history",
+    "get_bicimad_station_trend",
+    "forecast_bicimad_availability",
+    "start_bicimad_poller",
+    "start_bicimad_services",
+    "visualize_bicimad_stations",
+    "get_bicimad_heatmap",
+    # Async tools (registered in the agent, never block the event loop)
+    "get_bicimad_stations_async",
+    "get_bicimad_station_poi_async",
+    "get_bicimad_nearest_stations_async",
+    "get_bicimad_stations_near_points_async",
+    "query_bicimad_stations_async",
+    "find_bicimad_station_async",
+    "get_bicimad_stations_near_place_async",
+    "plan_bicimad_trip_async",
+    "get_bicimad_rebalancing_async",
+    "get_bicimad_changes_async",
+    "get_bicimad_station_trend_async",
+    "forecast_bicimad_availability_async",
+    "visualize_bicimad_stations_async",
+    "get_bicimad_heatmap_async",
+]
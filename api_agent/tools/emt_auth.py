@@ -0,0 +1,275 @@
+"""Access token management for the EMT Madrid OpenAPI.
+
+The token manager keeps one access token for the whole process:
+
+- The expiry comes from the login response (tokenSecExpiration) instead of
+  a guessed lifetime.
+- Logins are single-flight: when the token is missing or expired, one caller
+  logs in and every concurrent caller waits for that same result.
+- A background timer renews the token before it expires, so user requests
+  normally find a valid token and never pay for the login round trip.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from .emt_client import EMTHTTPError, get_emt_client
+
+logger = logging.getLogger(__name__)
+
+_LOGIN_PATH = "/v1/mobilitylabs/user/login/"
+
+# Used only when the login response does not say when the token expires
+_DEFAULT_TOKEN_LIFETIME = 24 * 3600
+
+
+def _token_lifetime(token_data: dict) -> float:
+    """
+    Read the token lifetime (in seconds) from a login response entry.
+
+    Args:
+        token_data: First element of the "data" list of the login response
+
+    Returns:
+        float: Seconds until the token expires
+    """
+    seconds = token_data.get("tokenSecExpiration")
+    if isinstance(seconds, (int, float)) and seconds > 0:
+        return float(seconds)
+
+    # Some responses only carry the absolute expiry as {"$date": epoch_ms}
+    expiration = token_data.get("tokenDteExpiration")
+    if isinstance(expiration, dict) and isinstance(expiration.get("$date"), (int, float)):
+        remaining = expiration["$date"] / 1000.0 - time.time()
+        if remaining > 0:
+            return remaining
+
+    return float(_DEFAULT_TOKEN_LIFETIME)
+
+
+class EMTTokenManager:
+    """
+    Thread-safe, single-flight holder of the EMT access token.
+    """
+
+    def __init__(self, refresh_margin: float = 0.1, min_refresh_margin: float = 300.0,
+                 retry_delay: float = 30.0):
+        """
+        Initialize the token manager without logging in.
+
+        Args:
+            refresh_margin: Fraction of the token lifetime left when the
+                background refresh starts
+            min_refresh_margin: Minimum seconds before expiry to refresh
+            retry_delay: Seconds between background retries after a failed refresh
+        """
+        self.refresh_margin = refresh_margin
+        self.min_refresh_margin = min_refresh_margin
+        self.retry_delay = retry_delay
+
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._login_done = threading.Condition(self._lock)
+        self._login_in_progress = False
+        self._timer: Optional[threading.Timer] = None
+        self._stats = {"logins": 0, "failed_logins": 0, "waits": 0, "background_refreshes": 0}
+
+    def _valid_token(self) -> Optional[str]:
+        if self._token and time.monotonic() < self._expires_at:
+            return self._token
+        return None
+
+    def cached_token(self) -> Optional[str]:
+        """
+        Return the current token without ever logging in.
+
+        Returns:
+            Optional[str]: The access token if it is still valid, None otherwise
+        """
+        return self._valid_token()
+
+    def get_token(self) -> Optional[str]:
+        """
+        Return a valid access token, logging in only if necessary.
+
+        When several threads find the token missing at the same time, only
+        one of them performs the login; the rest wait for its result.
+
+        Returns:
+            Optional[str]: The access token, or None if the login failed
+        """
+        token = self._valid_token()
+        if token:
+            return token
+
+        with self._lock:
+            token = self._valid_token()
+            if token:
+                return token
+
+            if self._login_in_progress:
+                self._stats["waits"] += 1
+                while self._login_in_progress:
+                    self._login_done.wait()
+                return self._valid_token()
+
+            self._login_in_progress = True
+
+        return self._run_login()
+
+    def _run_login(self) -> Optional[str]:
+        """Log in (caller owns the in-progress flag) and wake up the waiters."""
+        token, lifetime = None, 0.0
+        try:
+            token, lifetime = self._login()
+        finally:
+            with self._lock:
+                if token:
+                    self._token = token
+                    self._expires_at = time.monotonic() + lifetime
+                    self._stats["logins"] += 1
+                else:
+                    self._stats["failed_logins"] += 1
+                self._login_in_progress = False
+                self._login_done.notify_all()
+
+        if token:
+            self._schedule_refresh(self._refresh_delay(lifetime))
+        return token
+
+    def _refresh_delay(self, lifetime: float) -> float:
+        """
+        Seconds until the background refresh of a token with this lifetime.
+
+        Never less than retry_delay: a short-lived token (or the same token
+        handed back close to its expiry) must not trigger back-to-back logins.
+        Never more than the lifetime either, so a token shorter than
+        retry_delay is still renewed when it expires rather than after.
+        """
+        margin = max(lifetime * self.refresh_margin, self.min_refresh_margin)
+        return min(max(lifetime - margin, self.retry_delay), lifetime)
+
+    def _login(self):
+        """
+        Perform the login request against the EMT API.
+
+        Returns:
+            tuple: (access token or None, lifetime in seconds)
+        """
+        email = os.getenv("EMT_EMAIL")
+        password = os.getenv("EMT_PASSWORD")
+
+        if not email or not password:
+            logger.error("EMT API credentials not found in environment variables")
+            return None, 0.0
+
+        logger.info("Logging in to EMT Madrid API...")
+
+        try:
+            # Credentials travel in the request headers
+            response = get_emt_client().request(
+                "GET", _LOGIN_PATH, headers={"email": email, "password": password}
+            )
+            data = response.json()
+        except EMTHTTPError as err:
+            logger.error("Login failed with HTTP Error %d: %s", err.code, err.reason)
+            if err.body:
+                logger.error("Error response: %s", err.body)
+            return None, 0.0
+        except Exception as err:
+            logger.error("Unexpected error during login: %s", str(err))
+            return None, 0.0
+
+        if not isinstance(data, dict):
+            logger.error("Unexpected login response: %r", data)
+            return None, 0.0
+
+        entries = data.get("data")
+        if data.get("code") == "01" and isinstance(entries, list) and entries \
+                and isinstance(entries[0], dict):
+            token_data = entries[0]
+            access_token = token_data.get("accessToken")
+            if access_token:
+                lifetime = _token_lifetime(token_data)
+                logger.info("Successfully obtained access token (expires in %ds)", lifetime)
+                return access_token, lifetime
+
+        logger.error("Failed to extract access token from login response")
+        logger.debug("Login response: %s", data)
+        return None, 0.0
+
+    def _schedule_refresh(self, delay: float) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(delay, self._background_refresh)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _background_refresh(self) -> None:
+        """Renew the token ahead of expiry while requests keep using the old one."""
+        with self._lock:
+            if self._login_in_progress:
+                return
+            self._login_in_progress = True
+            self._stats["background_refreshes"] += 1
+
+        logger.debug("Refreshing EMT access token in the background")
+        if not self._run_login():
+            with self._lock:
+                still_valid = self._valid_token() is not None
+            if still_valid:
+                self._schedule_refresh(self.retry_delay)
+
+    def prefetch(self) -> None:
+        """
+        Log in from a background thread if there is no valid token yet.
+
+        Lets the first user request find a token already in place.
+        """
+        if self._valid_token() or not (os.getenv("EMT_EMAIL") and os.getenv("EMT_PASSWORD")):
+            return
+        threading.Thread(target=self.get_token, name="emt-token-prefetch", daemon=True).start()
+
+    def invalidate(self, token: Optional[str] = None) -> None:
+        """
+        Drop the cached token, e.g. after the API rejected it with a 401.
+
+        Args:
+            token: Only invalidate if the cached token is still this one, so a
+                token refreshed meanwhile by another caller is kept
+        """
+        with self._lock:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = 0.0
+
+    def stats(self) -> dict:
+        """
+        Return login counters and the seconds left on the current token.
+
+        Returns:
+            dict: Token manager counters
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["expires_in"] = max(self._expires_at - time.monotonic(), 0.0) if self._token else 0.0
+        return stats
+
+
+# Global token manager shared by all tools
+_token_manager = EMTTokenManager()
+
+
+def get_token_manager() -> EMTTokenManager:
+    """
+    Get the global EMT token manager instance.
+
+    Returns:
+        EMTTokenManager: The shared token manager
+    """
+    return _token_manager
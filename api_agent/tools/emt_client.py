@@ -0,0 +1,647 @@
+"""Pooled keep-alive HTTP clients for the EMT Madrid OpenAPI.
+
+All EMT tools share a single EMTClient instance so that TCP and TLS
+handshakes are paid once per pooled connection instead of once per tool
+call. The pool is bounded, every request has its own connect/read
+timeouts and gzip-encoded responses are decompressed chunk by chunk while
+they are read; a caller may also hand in a sink that receives the decoded
+chunks instead of a buffered body. A 304 Not Modified answer to a conditional request is
+returned like a success, with an empty body.
+
+AsyncEMTClient offers the same interface on top of asyncio streams, so the
+async tools never block the event loop while waiting on the network.
+"""
+
+import asyncio
+import http.client
+import json
+import logging
+import queue
+import ssl
+import threading
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EMT_HOST = "openapi.emtmadrid.es"
+
+# Bytes read from the socket at a time while streaming a response body
+_READ_CHUNK = 64 * 1024
+
+# Errors that mean a pooled keep-alive connection was closed by the server
+# while it sat idle. The request is retried once on a fresh connection.
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class EMTHTTPError(Exception):
+    """Raised when the EMT API answers with a non-2xx status code."""
+
+    def __init__(self, code: int, reason: str, body: str = ""):
+        super().__init__(f"HTTP Error {code}: {reason}")
+        self.code = code
+        self.reason = reason
+        self.body = body
+
+
+class EMTConnectionError(Exception):
+    """Raised when the EMT API cannot be reached or times out."""
+
+
+class EMTResponse:
+    """Decoded response returned by EMTClient.request()."""
+
+    def __init__(self, status: int, reason: str, headers: Dict[str, str], body: bytes,
+                 wire_bytes: Optional[int] = None, decoded_bytes: Optional[int] = None):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        # Size of the body as received (before decompression) and once decoded,
+        # including what went to a body sink instead of `body`
+        self.wire_bytes = len(body) if wire_bytes is None else wire_bytes
+        self.decoded_bytes = len(body) if decoded_bytes is None else decoded_bytes
+
+    @property
+    def not_modified(self) -> bool:
+        """True for a 304 answer to a conditional request."""
+        return self.status == 304
+
+    def json(self):
+        """Parse the response body as JSON."""
+        return json.loads(self.body.decode("utf-8"))
+
+
+# Receives the decoded body chunk by chunk instead of a buffered body
+BodySink = Callable[[bytes], None]
+
+
+class _BodyDecoder:
+    """
+    Undo the Content-Encoding of a response body as its chunks arrive.
+
+    Decoded chunks are collected, or passed on to `sink` when one is given.
+    """
+
+    def __init__(self, headers: Dict[str, str], sink: Optional[BodySink] = None):
+        gzipped = headers.get("content-encoding", "").lower() == "gzip"
+        # wbits 16 + MAX_WBITS: expect a gzip header and trailer
+        self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+        self._parts: List[bytes] = []
+        self._sink = sink or self._parts.append
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+
+    def feed(self, chunk: bytes) -> None:
+        self.wire_bytes += len(chunk)
+        decoded = self._inflater.decompress(chunk) if self._inflater else chunk
+        if decoded:
+            self.decoded_bytes += len(decoded)
+            self._sink(decoded)
+
+    def finish(self) -> bytes:
+        if self._inflater is not None:
+            tail = self._inflater.flush()
+            if tail:
+                self.decoded_bytes += len(tail)
+                self._sink(tail)
+            if self.wire_bytes and not self._inflater.eof:
+                raise zlib.error("Truncated gzip body")
+        return b"".join(self._parts)
+
+    def response(self, status: int, reason: str, headers: Dict[str, str]) -> EMTResponse:
+        body = self.finish()
+        return EMTResponse(status, reason, headers, body, self.wire_bytes, self.decoded_bytes)
+
+
+class _SinkGuard:
+    """Wraps a body sink and remembers whether it received anything."""
+
+    def __init__(self, sink: Optional[BodySink]):
+        self.sink = sink
+        self.started = False
+
+    def __call__(self, chunk: bytes) -> None:
+        self.started = True
+        self.sink(chunk)
+
+    def for_status(self, status: int) -> Optional[BodySink]:
+        """Only successful bodies go to the sink; errors are buffered."""
+        return self if self.sink is not None and 200 <= status < 300 else None
+
+
+def _raise_for_status(response: EMTResponse) -> EMTResponse:
+    """Raise EMTHTTPError for non-2xx responses (304 Not Modified excepted)."""
+    if not (200 <= response.status < 300 or response.not_modified):
+        raise EMTHTTPError(
+            response.status,
+            response.reason,
+            response.body.decode("utf-8", errors="replace"),
+        )
+    return response
+
+
+class EMTClient:
+    """
+    Thread-safe HTTPS client with a bounded pool of keep-alive connections.
+
+    At most `pool_size` connections are in use at the same time; further
+    callers wait for a free slot. Idle connections are kept open and reused
+    by the next request.
+    """
+
+    def __init__(
+        self,
+        host: str = EMT_HOST,
+        pool_size: int = 8,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 15.0,
+    ):
+        """
+        Initialize the client without opening any connection.
+
+        Args:
+            host: EMT API host name
+            pool_size: Maximum number of simultaneous connections
+            connect_timeout: Default seconds allowed to establish a connection
+            read_timeout: Default seconds allowed between received bytes
+        """
+        self.host = host
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self._idle: "queue.LifoQueue[http.client.HTTPSConnection]" = queue.LifoQueue(maxsize=pool_size)
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "connections_opened": 0,
+            "connections_reused": 0,
+            "connections_discarded": 0,
+            "stale_retries": 0,
+            "not_modified": 0,
+            "bytes_received": 0,
+            "bytes_decoded": 0,
+        }
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _count_response(self, response: EMTResponse) -> None:
+        with self._stats_lock:
+            self._stats["not_modified"] += int(response.not_modified)
+            self._stats["bytes_received"] += response.wire_bytes
+            self._stats["bytes_decoded"] += response.decoded_bytes
+
+    def stats(self) -> dict:
+        """
+        Return the connection reuse counters.
+
+        Returns:
+            dict: Counters plus the number of currently idle connections
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["idle_connections"] = self._idle.qsize()
+        return stats
+
+    def _checkout(self, connect_timeout: float) -> Tuple[http.client.HTTPSConnection, bool]:
+        """Take an idle connection from the pool or open a new one."""
+        try:
+            conn = self._idle.get_nowait()
+            if conn.sock is not None:
+                self._count("connections_reused")
+                return conn, True
+        except queue.Empty:
+            pass
+
+        conn = http.client.HTTPSConnection(self.host, timeout=connect_timeout)
+        conn.connect()
+        self._count("connections_opened")
+        return conn, False
+
+    def _checkin(self, conn: http.client.HTTPSConnection, keep_alive: bool) -> None:
+        """Return a connection to the pool, or close it."""
+        if keep_alive and conn.sock is not None:
+            try:
+                self._idle.put_nowait(conn)
+                return
+            except queue.Full:
+                pass
+        conn.close()
+        self._count("connections_discarded")
+
+    def _send(
+        self,
+        conn: http.client.HTTPSConnection,
+        method: str,
+        path: str,
+        body: Optional[bytes],
+        headers: Dict[str, str],
+        read_timeout: float,
+        sink: _SinkGuard,
+    ) -> Tuple[EMTResponse, bool]:
+        conn.sock.settimeout(read_timeout)
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response_headers = {k.lower(): v for k, v in response.getheaders()}
+        decoder = _BodyDecoder(response_headers, sink.for_status(response.status))
+        while True:
+            chunk = response.read(_READ_CHUNK)
+            if not chunk:
+                break
+            decoder.feed(chunk)
+        keep_alive = not response.will_close
+        return decoder.response(response.status, response.reason, response_headers), keep_alive
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        headers: Optional[Dict[str, str]] = None,
+        body: Optional[bytes] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        body_sink: Optional[BodySink] = None,
+    ) -> EMTResponse:
+        """
+        Perform an HTTP request over a pooled connection.
+
+        Args:
+            method: HTTP method ("GET", "POST", ...)
+            path: Request path, e.g. "/v1/transport/bicimad/stations/"
+            headers: Extra request headers
+            body: Optional request body
+            connect_timeout: Override of the default connect timeout
+            read_timeout: Override of the default read timeout
+            body_sink: Function receiving the decoded body of a 2xx response
+                chunk by chunk; the returned response body is then empty
+
+        Returns:
+            EMTResponse: Response with the decoded body (empty for a 304)
+
+        Raises:
+            EMTHTTPError: If the server answers with a non-2xx, non-304 status
+            EMTConnectionError: If the server cannot be reached or times out
+        """
+        if connect_timeout is None:
+            connect_timeout = self.connect_timeout
+        if read_timeout is None:
+            read_timeout = self.read_timeout
+
+        request_headers = {"Accept-Encoding": "gzip", "Connection": "keep-alive"}
+        request_headers.update(headers or {})
+
+        sink = _SinkGuard(body_sink)
+        self._count("requests")
+        if not self._slots.acquire(timeout=connect_timeout):
+            raise EMTConnectionError("Timed out waiting for a free EMT connection")
+
+        try:
+            for attempt in range(2):
+                try:
+                    conn, reused = self._checkout(connect_timeout)
+                except (OSError, http.client.HTTPException) as err:
+                    raise EMTConnectionError(str(err)) from err
+
+                try:
+                    response, keep_alive = self._send(
+                        conn, method, path, body, request_headers, read_timeout, sink
+                    )
+                except _STALE_CONNECTION_ERRORS as err:
+                    conn.close()
+                    self._count("connections_discarded")
+                    # A sink that already received part of a body cannot be replayed
+                    if reused and attempt == 0 and not sink.started:
+                        logger.debug("Pooled EMT connection went stale, retrying")
+                        self._count("stale_retries")
+                        continue
+                    raise EMTConnectionError(str(err)) from err
+                except (OSError, http.client.HTTPException, zlib.error) as err:
+                    # zlib.error: corrupt or truncated gzip body
+                    conn.close()
+                    self._count("connections_discarded")
+                    raise EMTConnectionError(str(err)) from err
+
+                self._checkin(conn, keep_alive)
+                break
+        finally:
+            self._slots.release()
+
+        self._count_response(response)
+        return _raise_for_status(response)
+
+    def close(self) -> None:
+        """Close every idle connection in the pool."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class _AsyncConnection:
+    """A keep-alive HTTP/1.1 connection over asyncio streams."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    def is_usable(self) -> bool:
+        return not self.writer.is_closing() and not self.reader.at_eof()
+
+    def close(self) -> None:
+        self.writer.close()
+
+    async def _read_chunked(self, decoder: _BodyDecoder) -> None:
+        while True:
+            size_line = await self.reader.readline()
+            size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                # Skip optional trailers up to the terminating empty line
+                while (await self.reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            decoder.feed(await self.reader.readexactly(size))
+            await self.reader.readline()
+
+    async def _read_length(self, decoder: _BodyDecoder, length: int) -> None:
+        while length > 0:
+            chunk = await self.reader.readexactly(min(length, _READ_CHUNK))
+            decoder.feed(chunk)
+            length -= len(chunk)
+
+    async def _read_to_eof(self, decoder: _BodyDecoder) -> None:
+        while True:
+            chunk = await self.reader.read(_READ_CHUNK)
+            if not chunk:
+                return
+            decoder.feed(chunk)
+
+    async def roundtrip(
+        self,
+        method: str,
+        path: str,
+        host: str,
+        headers: Dict[str, str],
+        body: Optional[bytes],
+        sink: _SinkGuard,
+    ) -> Tuple[EMTResponse, bool]:
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {host}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        if body is not None or method in ("POST", "PUT"):
+            lines.append(f"Content-Length: {len(body or b'')}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b""))
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise http.client.RemoteDisconnected("Remote end closed connection without response")
+        parts = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise http.client.BadStatusLine(status_line.decode("latin-1", errors="replace"))
+        status = int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ""
+
+        response_headers: Dict[str, str] = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        keep_alive = response_headers.get("connection", "").lower() != "close"
+        decoder = _BodyDecoder(response_headers, sink.for_status(status))
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            pass
+        elif response_headers.get("transfer-encoding", "").lower() == "chunked":
+            await self._read_chunked(decoder)
+        elif "content-length" in response_headers:
+            await self._read_length(decoder, int(response_headers["content-length"]))
+        else:
+            await self._read_to_eof(decoder)
+            keep_alive = False
+
+        return decoder.response(status, reason, response_headers), keep_alive
+
+
+class AsyncEMTClient:
+    """
+    Non-blocking HTTPS client with a bounded pool of keep-alive connections.
+
+    Connections belong to the event loop that opened them; if the client is
+    used from a different loop the pool is reset transparently.
+    """
+
+    def __init__(
+        self,
+        host: str = EMT_HOST,
+        port: int = 443,
+        use_ssl: bool = True,
+        pool_size: int = 32,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 15.0,
+    ):
+        """
+        Initialize the client without opening any connection.
+
+        Args:
+            host: EMT API host name
+            port: TCP port of the API
+            use_ssl: Whether to wrap connections in TLS
+            pool_size: Maximum number of requests in flight at the same time
+            connect_timeout: Default seconds allowed to establish a connection
+            read_timeout: Default seconds allowed to receive a full response
+        """
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self._ssl_context = ssl.create_default_context() if use_ssl else None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._idle: List[_AsyncConnection] = []
+        self._stats = {
+            "requests": 0,
+            "in_flight": 0,
+            "max_in_flight": 0,
+            "connections_opened": 0,
+            "connections_reused": 0,
+            "connections_discarded": 0,
+            "stale_retries": 0,
+            "not_modified": 0,
+            "bytes_received": 0,
+            "bytes_decoded": 0,
+        }
+
+    def stats(self) -> dict:
+        """
+        Return the connection reuse and concurrency counters.
+
+        Returns:
+            dict: Counters plus the number of currently idle connections
+        """
+        stats = dict(self._stats)
+        stats["idle_connections"] = len(self._idle)
+        return stats
+
+    def _bind_loop(self) -> None:
+        """Reset the pool when called from a different event loop."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            for conn in self._idle:
+                conn.close()
+            self._idle = []
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.pool_size)
+
+    async def _checkout(self, connect_timeout: float) -> Tuple[_AsyncConnection, bool]:
+        while self._idle:
+            conn = self._idle.pop()
+            if conn.is_usable():
+                self._stats["connections_reused"] += 1
+                return conn, True
+            conn.close()
+            self._stats["connections_discarded"] += 1
+
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host,
+                self.port,
+                ssl=self._ssl_context,
+                server_hostname=self.host if self.use_ssl else None,
+            ),
+            timeout=connect_timeout,
+        )
+        self._stats["connections_opened"] += 1
+        return _AsyncConnection(reader, writer), False
+
+    def _checkin(self, conn: _AsyncConnection, keep_alive: bool) -> None:
+        if keep_alive and conn.is_usable() and len(self._idle) < self.pool_size:
+            self._idle.append(conn)
+            return
+        conn.close()
+        self._stats["connections_discarded"] += 1
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        headers: Optional[Dict[str, str]] = None,
+        body: Optional[bytes] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        body_sink: Optional[BodySink] = None,
+    ) -> EMTResponse:
+        """
+        Perform an HTTP request over a pooled connection without blocking.
+
+        Args:
+            method: HTTP method ("GET", "POST", ...)
+            path: Request path, e.g. "/v1/transport/bicimad/stations/"
+            headers: Extra request headers
+            body: Optional request body
+            connect_timeout: Override of the default connect timeout
+            read_timeout: Override of the default read timeout
+            body_sink: Function receiving the decoded body of a 2xx response
+                chunk by chunk; the returned response body is then empty
+
+        Returns:
+            EMTResponse: Response with the decoded body (empty for a 304)
+
+        Raises:
+            EMTHTTPError: If the server answers with a non-2xx, non-304 status
+            EMTConnectionError: If the server cannot be reached or times out
+        """
+        if connect_timeout is None:
+            connect_timeout = self.connect_timeout
+        if read_timeout is None:
+            read_timeout = self.read_timeout
+
+        request_headers = {"Accept-Encoding": "gzip", "Connection": "keep-alive"}
+        request_headers.update(headers or {})
+
+        sink = _SinkGuard(body_sink)
+        self._bind_loop()
+        self._stats["requests"] += 1
+
+        async with self._slots:
+            self._stats["in_flight"] += 1
+            self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._stats["in_flight"])
+            try:
+                for attempt in range(2):
+                    try:
+                        conn, reused = await self._checkout(connect_timeout)
+                    except (OSError, asyncio.TimeoutError) as err:
+                        raise EMTConnectionError(str(err) or "Connection timed out") from err
+
+                    try:
+                        response, keep_alive = await asyncio.wait_for(
+                            conn.roundtrip(method, path, self.host, request_headers, body, sink),
+                            timeout=read_timeout,
+                        )
+                    except (*_STALE_CONNECTION_ERRORS, asyncio.IncompleteReadError) as err:
+                        conn.close()
+                        self._stats["connections_discarded"] += 1
+                        if reused and attempt == 0 and not sink.started:
+                            logger.debug("Pooled async EMT connection went stale, retrying")
+                            self._stats["stale_retries"] += 1
+                            continue
+                        raise EMTConnectionError(str(err)) from err
+                    except (OSError, ValueError, http.client.HTTPException, asyncio.TimeoutError,
+                            zlib.error) as err:
+                        conn.close()
+                        self._stats["connections_discarded"] += 1
+                        raise EMTConnectionError(str(err) or "Read timed out") from err
+
+                    self._checkin(conn, keep_alive)
+                    break
+            finally:
+                self._stats["in_flight"] -= 1
+
+        self._stats["not_modified"] += int(response.not_modified)
+        self._stats["bytes_received"] += response.wire_bytes
+        self._stats["bytes_decoded"] += response.decoded_bytes
+        return _raise_for_status(response)
+
+    def close(self) -> None:
+        """Close every idle connection in the pool."""
+        for conn in self._idle:
+            conn.close()
+        self._idle = []
+
+
+# Global EMT clients shared by all tools
+_emt_client = EMTClient()
+_async_emt_client = AsyncEMTClient()
+
+
+def get_emt_client() -> EMTClient:
+    """
+    Get the global EMT client instance.
+
+    Returns:
+        EMTClient: The shared pooled client
+    """
+    return _emt_client
+
+
+def get_async_emt_client() -> AsyncEMTClient:
+    """
+    Get the global asyncio EMT client instance.
+
+    Returns:
+        AsyncEMTClient: The shared non-blocking pooled client
+    """
+    return _async_emt_client
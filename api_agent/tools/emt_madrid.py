@@ -1,269 +1,1828 @@
-"""EMT Madrid API integration tool for BiciMAD stations."""
+"""EMT Madrid API integration tool for BiciMAD stations.
 
+Every tool comes in two flavours: a synchronous function and an `_async`
+coroutine that ADK can await without blocking the event loop. Both share the
+request building and response handling below and only differ in the
+transport (EMTClient vs AsyncEMTClient).
+"""
+
+import asyncio
 import logging
-import os
-import urllib.request
 import json
-from typing import Optional
-from datetime import datetime, timedelta
+import math
+import os
+import threading
+import time
+import webbrowser
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .emt_auth import get_token_manager
+from .emt_client import (
+    EMTHTTPError,
+    EMTResponse,
+    EMTConnectionError,
+    get_emt_client,
+    get_async_emt_client,
+)
+from .forecast import MADRID_TZ, AvailabilityForecaster
+from .gazetteer import get_gazetteer
+from .heatmap import HEATMAP_LAYERS, get_heatmap, write_heatmap_png
+from .history_rollups import TieredHistory, rollup_summary
+from .history_store import HistoryStore
+from .occupancy import BicimadPoller, OccupancyRingBuffer
+from .rebalancing import DEFAULT_TRUCK_CAPACITY, plan_rebalancing
+from .spatial_index import get_spatial_index
+from .station_cache import (
+    SNAPSHOT_UNCHANGED,
+    StationSnapshot,
+    StationSnapshotCache,
+    SnapshotUnavailableError,
+)
+from .station_delta import diff_snapshots
+from .station_map import DEFAULT_MAX_BYTES, DEFAULT_MAX_FILES, default_output_dir, render_station_map
+from .map_server import MapServer
+from .station_stream import StationStreamParser
+from .station_projection import (
+    DEFAULT_FIELDS,
+    DEFAULT_MAX_RESPONSE_BYTES,
+    fit_lists_to_budget,
+    fit_to_budget,
+    order_positions,
+    parse_fields,
+    project_record,
+    project_stations,
+    summarize_stations,
+)
+from .station_query import get_query_index, parse_bbox
+from .station_search import get_search_index
+from .trip_planner import plan_trip
 
 logger = logging.getLogger(__name__)
 
-# Token cache to avoid repeated logins
-_token_cache = {
-    "access_token": None,
-    "expires_at": None
+_STATIONS_PATH = "/v1/transport/bicimad/stations/"
+_POI_PATH = "/v1/transport/bicimad/stations/poi/"
+
+# Upper bound of the JSON size of a station list handed to the model
+_MAX_RESPONSE_BYTES = int(os.getenv("BICIMAD_MAX_RESPONSE_BYTES", str(DEFAULT_MAX_RESPONSE_BYTES)))
+
+# Budget of the generated map pages kept on disk
+_MAP_MAX_FILES = int(os.getenv("BICIMAD_VISUALIZATION_MAX_FILES", str(DEFAULT_MAX_FILES)))
+_MAP_MAX_BYTES = int(float(os.getenv("BICIMAD_VISUALIZATION_MAX_MB", str(DEFAULT_MAX_BYTES / 2**20))) * 2**20)
+
+_AUTH_ERROR = {
+    "status": "ERROR",
+    "message": "Failed to authenticate with EMT Madrid API. Please check EMT_EMAIL and EMT_PASSWORD environment variables."
 }
 
 
 def _login() -> Optional[str]:
     """
-    Authenticates with EMT Madrid API and obtains an access token.
+    Returns a valid EMT access token, logging in only if necessary.
+
+    Returns:
+        Access token string if successful, None otherwise
+    """
+    return get_token_manager().get_token()
+
+
+async def _login_async() -> Optional[str]:
+    """
+    Async version of _login().
+
+    The token is normally refreshed ahead of expiry in the background, so
+    this returns immediately; otherwise the single-flight login runs in a
+    worker thread and the event loop keeps serving other requests.
 
     Returns:
         Access token string if successful, None otherwise
     """
-    # Check if we have a valid cached token
-    if _token_cache["access_token"] and _token_cache["expires_at"]:
-        if datetime.now() < _token_cache["expires_at"]:
-            logger.debug("Using cached access token")
-            return _token_cache["access_token"]
+    token = get_token_manager().cached_token()
+    if token:
+        return token
+    return await asyncio.to_thread(get_token_manager().get_token)
+
+
+def _error_result(err: Exception, what: str) -> dict:
+    """
+    Convert an exception raised while calling the EMT API into a tool result.
+
+    Args:
+        err: The exception raised by the EMT client or the JSON parser
+        what: Human description of the data being fetched, used in logs
+
+    Returns:
+        dict: An ERROR result with a descriptive message
+    """
+    if isinstance(err, EMTHTTPError):
+        error_msg = f"HTTP Error {err.code}: {err.reason}"
+        logger.error("Failed to fetch %s: %s", what, error_msg)
+
+        if err.body:
+            logger.error("Error response body: %s", err.body)
+            error_msg += f" - {err.body}"
+
+    elif isinstance(err, EMTConnectionError):
+        error_msg = f"Connection Error: {err}"
+        logger.error("Failed to connect to EMT Madrid API: %s", error_msg)
+
+    elif isinstance(err, json.JSONDecodeError):
+        error_msg = f"Failed to parse JSON response: {err}"
+        logger.error(error_msg)
+
+    else:
+        error_msg = f"Unexpected error: {str(err)}"
+        logger.error("Unexpected error fetching %s: %s", what, error_msg)
+
+    return {
+        "status": "ERROR",
+        "message": error_msg
+    }
+
+
+def _auth_headers(access_token: str, body: Optional[bytes]) -> dict:
+    """Build the headers of an authenticated EMT request."""
+    headers = {"accessToken": access_token}
+    if body is not None:
+        headers["Content-Type"] = "application/json"
+    return headers
+
+
+def _request_emt(method: str, path: str, body: Optional[bytes] = None,
+                 headers: Optional[dict] = None, body_sink=None) -> Optional[EMTResponse]:
+    """
+    Perform an authenticated EMT request, logging in again once on a 401.
+
+    `body_sink`, if given, receives the decoded body of the successful
+    response chunk by chunk (see EMTClient.request()).
+
+    Returns:
+        Optional[EMTResponse]: The response, or None if login failed
+
+    Raises:
+        EMTHTTPError, EMTConnectionError: As raised by the EMT client
+    """
+    access_token = _login()
+    if not access_token:
+        return None
 
-    # Get API credentials from environment variables
-    email = os.getenv("EMT_EMAIL")
-    password = os.getenv("EMT_PASSWORD")
+    request_headers = dict(_auth_headers(access_token, body), **(headers or {}))
+    try:
+        return get_emt_client().request(
+            method, path, headers=request_headers, body=body, body_sink=body_sink
+        )
+    except EMTHTTPError as err:
+        if err.code != 401:
+            raise
+    # Token revoked server-side: log in again and retry once
+    get_token_manager().invalidate(access_token)
+    access_token = _login()
+    if not access_token:
+        return None
+    request_headers.update(_auth_headers(access_token, body))
+    return get_emt_client().request(
+        method, path, headers=request_headers, body=body, body_sink=body_sink
+    )
+
+
+async def _request_emt_async(method: str, path: str, body: Optional[bytes] = None,
+                             headers: Optional[dict] = None, body_sink=None) -> Optional[EMTResponse]:
+    """Async version of _request_emt() using the non-blocking EMT client."""
+    access_token = await _login_async()
+    if not access_token:
+        return None
 
-    if not email or not password:
-        logger.error("EMT API credentials not found in environment variables")
+    request_headers = dict(_auth_headers(access_token, body), **(headers or {}))
+    try:
+        return await get_async_emt_client().request(
+            method, path, headers=request_headers, body=body, body_sink=body_sink
+        )
+    except EMTHTTPError as err:
+        if err.code != 401:
+            raise
+    get_token_manager().invalidate(access_token)
+    access_token = await _login_async()
+    if not access_token:
         return None
+    request_headers.update(_auth_headers(access_token, body))
+    return await get_async_emt_client().request(
+        method, path, headers=request_headers, body=body, body_sink=body_sink
+    )
+
+
+def _call_emt(method: str, path: str, what: str, body: Optional[bytes] = None) -> dict:
+    """Perform an authenticated EMT request and wrap the JSON result."""
+    try:
+        response = _request_emt(method, path, body)
+        if response is None:
+            return _AUTH_ERROR
+        data = response.json()
+    except Exception as err:
+        return _error_result(err, what)
+
+    logger.info("Successfully fetched %s", what)
+    return {
+        "status": "success",
+        "data": data
+    }
+
+
+async def _call_emt_async(method: str, path: str, what: str, body: Optional[bytes] = None) -> dict:
+    """Async version of _call_emt() using the non-blocking EMT client."""
+    try:
+        response = await _request_emt_async(method, path, body)
+        if response is None:
+            return _AUTH_ERROR
+        data = response.json()
+    except Exception as err:
+        return _error_result(err, what)
+
+    logger.info("Successfully fetched %s", what)
+    return {
+        "status": "success",
+        "data": data
+    }
+
+
+def _stations_path(station_id: Optional[str]) -> str:
+    """Return the stations endpoint, optionally for a single station."""
+    # For BiciMAD stations, the endpoint is /v1/transport/bicimad/stations/
+    if station_id:
+        return f"{_STATIONS_PATH}{station_id}/"
+    return _STATIONS_PATH
+
+
+def _poi_body(latitude: float, longitude: float, radius: int) -> bytes:
+    """Build the POST body of the POI endpoint."""
+    return json.dumps({
+        "latitude": latitude,
+        "longitude": longitude,
+        "radius": radius
+    }).encode('utf-8')
+
+
+# Top-level "code" of a successful EMT data response
+_EMT_SUCCESS_CODES = ("00", "01")
+
+# Validators of the last station list, for conditional downloads
+_stations_validators = {
+    "etag": None,
+    "last_modified": None,
+    "body_hash": None
+}
+
+
+def _conditional_headers() -> dict:
+    """If-None-Match / If-Modified-Since headers for the station list."""
+    headers = {}
+    # Only worth asking when there is a cached list to fall back on
+    if _station_cache.peek() is None:
+        return headers
+    if _stations_validators["etag"]:
+        headers["If-None-Match"] = _stations_validators["etag"]
+    if _stations_validators["last_modified"]:
+        headers["If-Modified-Since"] = _stations_validators["last_modified"]
+    return headers
+
+
+def _stations_parser() -> StationStreamParser:
+    """Streaming parser sized after the current snapshot."""
+    previous = _station_cache.peek()
+    return StationStreamParser(capacity=len(previous) + 64 if previous is not None else 1024)
+
+
+def _stations_payload(response: Optional[EMTResponse], parser: StationStreamParser):
+    """
+    Turn a streamed station list response into a snapshot cache payload.
+
+    Returns:
+        A StationSnapshot built from the streamed columns, or
+        SNAPSHOT_UNCHANGED for a 304 or a body identical to the previous one
+
+    Raises:
+        SnapshotUnavailableError: If login, the download or the parse failed,
+            or EMT answered with an error code
+    """
+    if response is None:
+        raise SnapshotUnavailableError(_AUTH_ERROR["message"])
+    if response.not_modified:
+        logger.info("BiciMAD stations not modified (304)")
+        return SNAPSHOT_UNCHANGED
+
+    # Validators are only kept for a body that is known to parse, so a
+    # broken download is fetched again in full instead of answered with a 304
+    validators = {
+        "etag": response.headers.get("etag"),
+        "last_modified": response.headers.get("last-modified"),
+        "body_hash": parser.digest(),
+    }
+    if validators["body_hash"] == _stations_validators["body_hash"] and _station_cache.peek() is not None:
+        # Same bytes as the installed list: keep its columns so snapshot
+        # consumers see the same store
+        _stations_validators.update(validators)
+        logger.info("BiciMAD stations body unchanged")
+        return SNAPSHOT_UNCHANGED
+
+    try:
+        meta, store = parser.finish()
+    except ValueError as err:
+        message = f"Failed to parse JSON response: {err}"
+        logger.error(message)
+        raise SnapshotUnavailableError(message) from err
+    if meta.get("code") not in _EMT_SUCCESS_CODES:
+        # EMT reports some failures (e.g. an expired token) with HTTP 200 and
+        # no data: not an empty network. Log in again on the next load.
+        message = f"EMT API error {meta.get('code')}: {meta.get('description') or 'no description'}"
+        logger.error(message)
+        get_token_manager().invalidate()
+        raise SnapshotUnavailableError(message)
+    _stations_validators.update(validators)
+    logger.info("Successfully fetched BiciMAD stations data (%d bytes)", parser.bytes_read)
+    return StationSnapshot(meta, store=store)
+
+
+def _load_stations():
+    """Download and parse the station list; used as the snapshot cache loader."""
+    parser = _stations_parser()
+    try:
+        response = _request_emt(
+            "GET", _STATIONS_PATH, headers=_conditional_headers(), body_sink=parser.feed
+        )
+    except (EMTHTTPError, EMTConnectionError) as err:
+        raise SnapshotUnavailableError(_error_result(err, "BiciMAD stations data")["message"]) from err
+    return _stations_payload(response, parser)
+
+
+async def _load_stations_async():
+    """Async version of _load_stations()."""
+    parser = _stations_parser()
+    try:
+        response = await _request_emt_async(
+            "GET", _STATIONS_PATH, headers=_conditional_headers(), body_sink=parser.feed
+        )
+    except (EMTHTTPError, EMTConnectionError) as err:
+        raise SnapshotUnavailableError(_error_result(err, "BiciMAD stations data")["message"]) from err
+    return _stations_payload(response, parser)
+
+
+# Station list cache shared by all tools (TTL in seconds, default 60)
+_station_cache = StationSnapshotCache(
+    _load_stations,
+    _load_stations_async,
+    ttl=float(os.getenv("BICIMAD_SNAPSHOT_TTL", "60")),
+)
+
+
+# Recent occupancy per station, recorded from every new snapshot
+_occupancy = OccupancyRingBuffer(capacity=int(os.getenv("BICIMAD_HISTORY_SAMPLES", "120")))
+_station_cache.subscribe(_occupancy.append)
+
+def _retention_days(spec: Optional[str]) -> dict:
+    """Parse BICIMAD_HISTORY_RETENTION, e.g. "raw:14,15min:180,1h:1825"."""
+    retention = {}
+    for item in (spec or "").split(","):
+        name, _, days = item.partition(":")
+        try:
+            retention[name.strip()] = float(days)
+        except ValueError:
+            continue
+    return retention
+
+
+# Persistent occupancy history, appended with every new snapshot, with its
+# 15-minute and hourly rollups (compacted in the background as snapshots
+# arrive) and the hour-of-week availability profiles fitted from them.
+# Opt-in: nothing is written to disk unless BICIMAD_HISTORY_DIR is set.
+_history_store: Optional[HistoryStore] = None
+_tiered_history: Optional[TieredHistory] = None
+_forecaster: Optional[AvailabilityForecaster] = None
+if os.getenv("BICIMAD_HISTORY_DIR"):
+    _history_store = HistoryStore(os.getenv("BICIMAD_HISTORY_DIR"))
+    _station_cache.subscribe(_history_store.append_snapshot)
+    _tiered_history = TieredHistory(
+        _history_store, _retention_days(os.getenv("BICIMAD_HISTORY_RETENTION"))
+    )
+    _station_cache.subscribe(_tiered_history.maybe_compact_in_background)
+    _forecaster = AvailabilityForecaster(
+        _tiered_history, lookback_days=float(os.getenv("BICIMAD_FORECAST_LOOKBACK_DAYS", "28"))
+    )
+    _station_cache.subscribe(_forecaster.maybe_refit_in_background)
+
+_HISTORY_OFF_MESSAGE = "Persistent history is off: set BICIMAD_HISTORY_DIR to record station history."
+
+# Occupancy heatmap rasters, sorted column indexes and the text index, built
+# as soon as a snapshot arrives (the text index only when names change)
+_station_cache.subscribe(get_heatmap)
+_station_cache.subscribe(get_query_index)
+_station_cache.subscribe(get_search_index)
+
+# Optional poller, started with start_bicimad_poller()
+_poller = BicimadPoller(_station_cache)
+
+# Set once start_bicimad_services() has run
+_services_started = False
+_services_lock = threading.Lock()
+
+# Live map server, started by the first live visualize_bicimad_stations() call
+_map_server = MapServer(_station_cache, port=int(os.getenv("BICIMAD_MAP_PORT", "0")))
+
+
+def get_station_cache() -> StationSnapshotCache:
+    """
+    Get the global BiciMAD station snapshot cache.
+
+    Returns:
+        StationSnapshotCache: The shared cache
+    """
+    return _station_cache
+
+
+def _parse_count(value, name: str, low: int, high: Optional[int] = None) -> int:
+    """
+    Read an integer tool argument and clamp it to [low, high].
+
+    Raises:
+        ValueError: If the value is not an integer
+    """
+    try:
+        count = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"Invalid {name}: {value}") from None
+    count = max(count, low)
+    return min(count, high) if high is not None else count
+
+
+def _stations_result(snapshot: StationSnapshot, station_id: Optional[str], fields: Optional[List[str]],
+                     limit: Optional[int], sort_by: Optional[str], summary: bool) -> Optional[dict]:
+    """
+    Build the (projected, ordered, budgeted) get_bicimad_stations result.
+
+    Args:
+        snapshot: The cached station snapshot
+        station_id: Optional station to extract
+        fields: Fields to keep per station (all if None)
+        limit: Maximum number of stations (top-N per list in summary mode)
+        sort_by: Column to sort by, "-" prefix for descending
+        summary: Return totals and top stations instead of the list
+
+    Returns:
+        Optional[dict]: The result, or None if station_id is not in the snapshot
+
+    Raises:
+        ValueError: If fields, limit or sort_by are invalid
+    """
+    fields = parse_fields(fields)
+    store = snapshot.store
+    result = {"status": "success", "snapshot_age_seconds": round(snapshot.age(), 1)}
+
+    if summary:
+        top = _parse_count(limit, "limit", 1, 50) if limit is not None else 5
+        result.update(summarize_stations(store, top=top, fields=fields))
+        highlights = result["top_stations"]
+        return fit_lists_to_budget(
+            result, [(highlights, key, items) for key, items in highlights.items()], _MAX_RESPONSE_BYTES
+        )
+
+    if limit is not None:
+        limit = _parse_count(limit, "limit", 0)
+
+    if station_id:
+        position = store.position_of(station_id)
+        if position is None:
+            return None
+        positions = np.array([position])
+    else:
+        positions = order_positions(store, None, sort_by, limit)
+
+    data = dict(snapshot.meta)
+    result["data"] = data
+    return fit_to_budget(result, data, "data", project_stations(store, positions, fields),
+                         _MAX_RESPONSE_BYTES)
+
+
+def _project_api_result(result: dict, fields: Optional[List[str]]) -> dict:
+    """Apply a fields selection to a station list fetched from the API."""
+    stations = (result.get("data") or {}).get("data") if result.get("status") == "success" else None
+    if isinstance(stations, list):
+        result["data"]["data"] = [project_record(station, parse_fields(fields)) for station in stations]
+    return result
+
+
+def get_bicimad_stations(station_id: Optional[str] = None, fields: Optional[List[str]] = None,
+                         limit: Optional[int] = None, sort_by: Optional[str] = None,
+                         summary: bool = False) -> dict:
+    """
+    Retrieves BiciMAD bike stations information from EMT Madrid API.
+
+    This tool fetches real-time data about BiciMAD bike-sharing stations in Madrid,
+    including availability of bikes and docks.
+
+    The full list is large: prefer `summary=True` for network-wide questions,
+    or `fields`/`sort_by`/`limit` to get just what is needed. Lists larger
+    than the response byte budget are truncated (with "truncated": true).
+
+    Args:
+        station_id: Optional station ID to get specific station info.
+                   If None, returns all stations.
+        fields: Fields to keep per station, e.g. ["id", "name", "dock_bikes"].
+                Available: id, number, name, address, dock_bikes, free_bases,
+                total_bases, reservations_count, activate, no_available,
+                light, latitude, longitude, geometry
+        limit: Maximum number of stations returned (top-N per list in summary mode)
+        sort_by: Field to sort by, prefixed with "-" for descending order
+                 (e.g. "-dock_bikes"); also accepts "occupancy"
+        summary: If True, return network totals plus the stations with most
+                 bikes/free docks and the empty/full ones
+
+    Returns:
+        A dictionary with station data including:
+        - Station locations
+        - Available bikes
+        - Available docks
+        - Station status
+
+    Example:
+        >>> get_bicimad_stations()
+        {'status': 'success', 'data': [...]}
+
+        >>> get_bicimad_stations(station_id='123')
+        {'status': 'success', 'data': {...}}
+
+        >>> get_bicimad_stations(fields=["id", "name", "dock_bikes"], sort_by="-dock_bikes", limit=10)
+        {'status': 'success', 'data': {'data': [...]}}
+
+        >>> get_bicimad_stations(summary=True)
+        {'status': 'success', 'totals': {...}, 'top_stations': {...}}
+    """
+    try:
+        snapshot = _station_cache.get()
+        result = _stations_result(snapshot, station_id, fields, limit, sort_by, summary)
+    except (SnapshotUnavailableError, ValueError) as err:
+        return {"status": "ERROR", "message": str(err)}
+
+    if result:
+        return result
+
+    # Station not in the snapshot (e.g. added since): ask the API directly
+    path = _stations_path(station_id)
+    logger.info("Fetching BiciMAD stations from EMT Madrid API: %s", path)
+    return _project_api_result(_call_emt("GET", path, "BiciMAD stations data"), fields)
+
+
+async def get_bicimad_stations_async(station_id: Optional[str] = None, fields: Optional[List[str]] = None,
+                                     limit: Optional[int] = None, sort_by: Optional[str] = None,
+                                     summary: bool = False) -> dict:
+    """
+    Retrieves BiciMAD bike stations information from EMT Madrid API.
+
+    Non-blocking version of get_bicimad_stations(): the network I/O runs on
+    the event loop, so many requests can be in flight at the same time.
+
+    The full list is large: prefer `summary=True` for network-wide questions,
+    or `fields`/`sort_by`/`limit` to get just what is needed.
+
+    Args:
+        station_id: Optional station ID to get specific station info.
+                   If None, returns all stations.
+        fields: Fields to keep per station, e.g. ["id", "name", "dock_bikes"]
+        limit: Maximum number of stations returned (top-N per list in summary mode)
+        sort_by: Field to sort by, prefixed with "-" for descending order
+        summary: If True, return network totals plus the most relevant stations
+
+    Returns:
+        A dictionary with station data (locations, available bikes and
+        docks, station status).
+    """
+    try:
+        snapshot = await _station_cache.aget()
+        result = _stations_result(snapshot, station_id, fields, limit, sort_by, summary)
+    except (SnapshotUnavailableError, ValueError) as err:
+        return {"status": "ERROR", "message": str(err)}
+
+    if result:
+        return result
+
+    path = _stations_path(station_id)
+    logger.info("Fetching BiciMAD stations from EMT Madrid API: %s", path)
+    return _project_api_result(await _call_emt_async("GET", path, "BiciMAD stations data"), fields)
+
+
+def _nearby_result(snapshot: StationSnapshot, positions, distances) -> dict:
+    """
+    Build a tool result from spatial index matches.
+
+    Args:
+        snapshot: Snapshot the index was built from
+        positions: Rows of the matching stations in snapshot.store
+        distances: Distance in meters to each matching station
+
+    Returns:
+        dict: Result shaped like the EMT POI endpoint response, each station
+        with an extra "distance" field in meters
+    """
+    stations = [
+        dict(snapshot.store.record(position), distance=round(float(distance)))
+        for position, distance in zip(positions, distances)
+    ]
+    data = {
+        "code": snapshot.meta.get("code"),
+        "description": "Computed locally from the cached station list",
+    }
+    result = {
+        "status": "success",
+        "data": data,
+        "source": "local_index",
+        "snapshot_age_seconds": round(snapshot.age(), 1)
+    }
+    # Nearest first, so a cut keeps the closest stations
+    return fit_to_budget(result, data, "data", stations, _MAX_RESPONSE_BYTES,
+                         hint="Use a smaller radius to get every station in range.")
 
-    login_url = "https://openapi.emtmadrid.es/v1/mobilitylabs/user/login/"
 
-    logger.info("Logging in to EMT Madrid API...")
+def _is_finite(*values) -> bool:
+    """True if every value is a finite number (NaN and infinity cannot be located)."""
+    try:
+        return all(math.isfinite(float(value)) for value in values)
+    except (TypeError, ValueError):
+        return False
+
+
+def _local_poi(snapshot: StationSnapshot, latitude: float, longitude: float, radius: int) -> dict:
+    if not _is_finite(latitude, longitude):
+        return {"status": "ERROR", "message": f"Invalid coordinates: {latitude}, {longitude}"}
+    if not _is_finite(radius):
+        return {"status": "ERROR", "message": f"Invalid radius: {radius}"}
+    positions, distances = get_spatial_index(snapshot).query_radius(
+        float(latitude), float(longitude), float(radius)
+    )
+    return _nearby_result(snapshot, positions, distances)
+
+
+# Most stations returned by get_bicimad_nearest_stations()
+_MAX_NEAREST = 50
+
+
+def _local_nearest(snapshot: StationSnapshot, latitude: float, longitude: float, count: int) -> dict:
+    if not _is_finite(latitude, longitude):
+        return {"status": "ERROR", "message": f"Invalid coordinates: {latitude}, {longitude}"}
+    try:
+        count = _parse_count(count, "count", 1, _MAX_NEAREST)
+    except ValueError as err:
+        return {"status": "ERROR", "message": str(err)}
+    positions, distances = get_spatial_index(snapshot).query_knn(float(latitude), float(longitude), count)
+    return _nearby_result(snapshot, positions, distances)
+
+
+def get_bicimad_station_poi(latitude: float, longitude: float, radius: int = 1000) -> dict:
+    """
+    Retrieves BiciMAD stations near a specific location (Point of Interest).
+
+    The search runs on the local spatial index of the cached station list;
+    the EMT POI endpoint is only used if no station list is available.
+
+    Args:
+        latitude: Latitude of the location
+        longitude: Longitude of the location
+        radius: Search radius in meters (default: 1000)
+
+    Returns:
+        A dictionary with nearby stations data, sorted by distance
+
+    Example:
+        >>> get_bicimad_station_poi(40.4168, -3.7038, 500)
+        {'status': 'success', 'data': [...]}
+    """
+    logger.info("Fetching BiciMAD stations near location (%.4f, %.4f) with radius %d meters",
+                latitude, longitude, radius)
+    try:
+        return _local_poi(_station_cache.get(), latitude, longitude, radius)
+    except SnapshotUnavailableError as err:
+        logger.warning("Station list unavailable (%s), using the EMT POI endpoint", err)
+
+    return _call_emt("POST", _POI_PATH, "nearby BiciMAD stations",
+                     body=_poi_body(latitude, longitude, radius))
+
+
+async def get_bicimad_station_poi_async(latitude: float, longitude: float, radius: int = 1000) -> dict:
+    """
+    Retrieves BiciMAD stations near a specific location (Point of Interest).
+
+    Non-blocking version of get_bicimad_station_poi().
+
+    Args:
+        latitude: Latitude of the location
+        longitude: Longitude of the location
+        radius: Search radius in meters (default: 1000)
+
+    Returns:
+        A dictionary with nearby stations data, sorted by distance
+    """
+    logger.info("Fetching BiciMAD stations near location (%.4f, %.4f) with radius %d meters",
+                latitude, longitude, radius)
+    try:
+        return _local_poi(await _station_cache.aget(), latitude, longitude, radius)
+    except SnapshotUnavailableError as err:
+        logger.warning("Station list unavailable (%s), using the EMT POI endpoint", err)
+
+    return await _call_emt_async("POST", _POI_PATH, "nearby BiciMAD stations",
+                                 body=_poi_body(latitude, longitude, radius))
+
+
+def get_bicimad_nearest_stations(latitude: float, longitude: float, count: int = 5) -> dict:
+    """
+    Retrieves the BiciMAD stations closest to a location, whatever the distance.
+
+    Args:
+        latitude: Latitude of the location
+        longitude: Longitude of the location
+        count: Number of stations to return (default: 5, at most 50)
+
+    Returns:
+        A dictionary with the nearest stations, sorted by distance
+
+    Example:
+        >>> get_bicimad_nearest_stations(40.4168, -3.7038, 3)
+        {'status': 'success', 'data': {'data': [...]}, 'source': 'local_index'}
+    """
+    try:
+        return _local_nearest(_station_cache.get(), latitude, longitude, count)
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+
+
+async def get_bicimad_nearest_stations_async(latitude: float, longitude: float, count: int = 5) -> dict:
+    """
+    Retrieves the BiciMAD stations closest to a location, whatever the distance.
+
+    Non-blocking version of get_bicimad_nearest_stations().
+
+    Args:
+        latitude: Latitude of the location
+        longitude: Longitude of the location
+        count: Number of stations to return (default: 5)
+
+    Returns:
+        A dictionary with the nearest stations, sorted by distance
+    """
+    try:
+        return _local_nearest(await _station_cache.aget(), latitude, longitude, count)
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+
+
+def _parse_points(points: List[dict]) -> Tuple[List[float], List[float], List[str]]:
+    """
+    Normalize a list of query points.
+
+    Args:
+        points: Points as {"latitude", "longitude", "label"?} dicts or
+            [latitude, longitude] pairs
+
+    Returns:
+        Tuple[List[float], List[float], List[str]]: Latitudes, longitudes and labels
+
+    Raises:
+        ValueError: If a point has no usable (finite) coordinates
+    """
+    lats, lons, labels = [], [], []
+    for number, point in enumerate(points, start=1):
+        if isinstance(point, dict):
+            lat, lon = point.get("latitude"), point.get("longitude")
+            label = point.get("label") or f"point {number}"
+        elif isinstance(point, (list, tuple)) and len(point) >= 2:
+            lat, lon = point[0], point[1]
+            label = f"point {number}"
+        else:
+            lat = lon = None
+        if lat is None or lon is None:
+            raise ValueError(f"Point {number} needs a latitude and a longitude")
+        if not _is_finite(lat, lon):
+            raise ValueError(f"Point {number} has invalid coordinates: {lat}, {lon}")
+        lats.append(float(lat))
+        lons.append(float(lon))
+        labels.append(str(label))
+    return lats, lons, labels
+
+
+def _eligible_mask(snapshot: StationSnapshot, positions: np.ndarray, need: str) -> np.ndarray:
+    """Which indexed stations are active and have a bike and/or a free dock."""
+    store = snapshot.store
+    mask = store.activate[positions] == 1
+    if need in ("bikes", "both"):
+        mask &= store.dock_bikes[positions] > 0
+    if need in ("docks", "both"):
+        mask &= store.free_bases[positions] > 0
+    return mask
+
+
+# Points per get_bicimad_stations_near_points() call, and stations per point
+_MAX_POINTS = 25
+_MAX_POINT_STATIONS = 20
+
+
+def _stations_near_points(snapshot: StationSnapshot, points: List[dict], count: int, need: str) -> dict:
+    if need not in ("bikes", "docks", "both", "any"):
+        return {"status": "ERROR", "message": "need must be one of: bikes, docks, both, any"}
+    try:
+        count = _parse_count(count, "count", 1, _MAX_POINT_STATIONS)
+    except ValueError as err:
+        return {"status": "ERROR", "message": str(err)}
+    if not isinstance(points, (list, tuple)) or not points:
+        return {"status": "ERROR", "message": "Invalid points: pass a non-empty list of points"}
+    if len(points) > _MAX_POINTS:
+        return {"status": "ERROR", "message": f"Invalid points: at most {_MAX_POINTS} points per call"}
+    try:
+        lats, lons, labels = _parse_points(points)
+    except (TypeError, ValueError) as err:
+        return {"status": "ERROR", "message": f"Invalid points: {err}"}
+
+    index = get_spatial_index(snapshot)
+    mask = None if need == "any" else _eligible_mask(snapshot, index.positions, need)
+    positions, distances = index.query_knn_batch(lats, lons, count, mask)
+
+    results = []
+    for lat, lon, label, row_positions, row_distances in zip(lats, lons, labels, positions, distances):
+        results.append({
+            "label": label,
+            "latitude": lat,
+            "longitude": lon,
+            "stations": [
+                dict(snapshot.store.record(position), distance=round(float(distance)))
+                for position, distance in zip(row_positions, row_distances)
+                if position >= 0
+            ]
+        })
+
+    return {
+        "status": "success",
+        "need": need,
+        "results": results,
+        "snapshot_age_seconds": round(snapshot.age(), 1)
+    }
+
+
+def get_bicimad_stations_near_points(points: List[dict], count: int = 3, need: str = "bikes") -> dict:
+    """
+    Finds the nearest usable BiciMAD stations for several points in one call.
+
+    Useful for route planning: pass the origin, destination and any waypoints
+    together instead of calling get_bicimad_station_poi once per point.
+
+    Args:
+        points: List of up to 25 points, each {"latitude": float, "longitude": float,
+            "label": optional str such as "origin" or "destination"}
+        count: Number of stations to return per point (default: 3, at most 20)
+        need: "bikes" (at least one bike), "docks" (at least one free dock),
+            "both" or "any". Only active stations are returned unless "any".
+
+    Returns:
+        A dictionary with one entry per point listing its nearest stations,
+        sorted by distance in meters
+
+    Example:
+        >>> get_bicimad_stations_near_points([
+        ...     {"latitude": 40.4168, "longitude": -3.7038, "label": "origin"},
+        ...     {"latitude": 40.4530, "longitude": -3.6883, "label": "destination"}], need="docks")
+        {'status': 'success', 'results': [{'label': 'origin', 'stations': [...]}, ...]}
+    """
+    try:
+        snapshot = _station_cache.get()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return _stations_near_points(snapshot, points, count, need)
+
+
+async def get_bicimad_stations_near_points_async(points: List[dict], count: int = 3,
+                                                 need: str = "bikes") -> dict:
+    """
+    Finds the nearest usable BiciMAD stations for several points in one call.
+
+    Non-blocking version of get_bicimad_stations_near_points().
+
+    Args:
+        points: List of points, each {"latitude": float, "longitude": float,
+            "label": optional str such as "origin" or "destination"}
+        count: Number of stations to return per point (default: 3)
+        need: "bikes", "docks", "both" or "any"
+
+    Returns:
+        A dictionary with one entry per point listing its nearest stations
+    """
+    try:
+        snapshot = await _station_cache.aget()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return _stations_near_points(snapshot, points, count, need)
+
+
+# Fields of the stations returned by find_bicimad_station
+_SEARCH_FIELDS = ("id", "number", "name", "address", "dock_bikes", "free_bases", "activate",
+                  "latitude", "longitude")
+
+
+def _search_result(snapshot: StationSnapshot, text: str, limit: int) -> dict:
+    """
+    Resolves a station name from the text index of a snapshot.
+
+    Args:
+        snapshot: The cached station snapshot
+        text: Name, address or number as written by the user
+        limit: Maximum number of stations returned
+
+    Returns:
+        dict: The best matching stations with their match score
+    """
+    if not text or not str(text).strip():
+        return {"status": "ERROR", "message": "Provide part of a station name, address or number"}
+    try:
+        limit = _parse_count(limit, "limit", 1, 20)
+    except ValueError as err:
+        return {"status": "ERROR", "message": str(err)}
+    rows, scores = get_search_index(snapshot).search(str(text), limit)
+    matches = project_stations(snapshot.store, rows, _SEARCH_FIELDS)
+    for match, score in zip(matches, scores.tolist()):
+        match["match"] = round(score, 2)
+    result = {
+        "status": "success",
+        "query": text,
+        "matches": matches,
+        "snapshot_age_seconds": round(snapshot.age(), 1),
+    }
+    if not matches:
+        result["message"] = f"No station name or address matches '{text}'"
+    return result
+
+
+def find_bicimad_station(text: str, limit: int = 5) -> dict:
+    """
+    Finds BiciMAD stations by name, address or number, ignoring accents and case.
+
+    Resolves loose names such as "Sol", "atocha" or "glorieta de bilbao"
+    (prefixes and small typos included) from an index over the cached
+    station list, without fetching the full list.
+
+    Args:
+        text: Station name, address or number as written by the user
+        limit: Maximum number of stations returned (default: 5, at most 20)
+
+    Returns:
+        A dictionary with the best matching stations, best first, each with
+        a "match" score from 0 to 1
+
+    Example:
+        >>> find_bicimad_station("glorieta de bilbao")
+        {'status': 'success', 'matches': [{'id': 90, 'name': 'Glorieta de Bilbao', 'match': 1.0, ...}], ...}
+    """
+    try:
+        snapshot = _station_cache.get()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return _search_result(snapshot, text, limit)
+
+
+async def find_bicimad_station_async(text: str, limit: int = 5) -> dict:
+    """
+    Finds BiciMAD stations by name, address or number, ignoring accents and case.
+
+    Non-blocking version of find_bicimad_station() (a lookup takes
+    microseconds, so it runs on the event loop).
+
+    Args:
+        text: Station name, address or number as written by the user
+        limit: Maximum number of stations returned (default: 5, at most 20)
+
+    Returns:
+        A dictionary with the best matching stations, best first
+    """
+    try:
+        snapshot = await _station_cache.aget()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return _search_result(snapshot, text, limit)
+
+
+# Upper bound of `limit` in query_bicimad_stations
+_MAX_QUERY_LIMIT = 100
+
+
+def _query_result(snapshot: StationSnapshot, min_bikes: Optional[int], max_bikes: Optional[int],
+                  min_docks: Optional[int], max_docks: Optional[int], active: Optional[bool],
+                  bbox: Optional[List[float]], sort_by: Optional[str], limit: int,
+                  fields: Optional[List[str]]) -> dict:
+    """
+    Runs a station query on the sorted column indexes of a snapshot.
+
+    Args:
+        snapshot: The cached station snapshot
+        min_bikes, max_bikes: Inclusive range of available bikes
+        min_docks, max_docks: Inclusive range of free docks
+        active: Stations in service (True), out of service (False) or both (None)
+        bbox: [south, west, north, east]
+        sort_by: Field to sort by, "-" prefix for descending
+        limit: Maximum number of stations returned
+        fields: Fields to keep per station (DEFAULT_FIELDS if None)
+
+    Returns:
+        dict: The matching stations and their total count
+    """
+    try:
+        fields = parse_fields(fields) or list(DEFAULT_FIELDS)
+        ranges = parse_bbox(bbox)
+        if min_bikes is not None or max_bikes is not None:
+            ranges["dock_bikes"] = (min_bikes, max_bikes)
+        if min_docks is not None or max_docks is not None:
+            ranges["free_bases"] = (min_docks, max_docks)
+        limit = _parse_count(limit, "limit", 1, _MAX_QUERY_LIMIT)
+        positions, total = get_query_index(snapshot).query(ranges, active, sort_by, limit)
+    except (TypeError, ValueError) as err:
+        return {"status": "ERROR", "message": str(err)}
+
+    result = {
+        "status": "success",
+        "matching_stations": total,
+        "snapshot_age_seconds": round(snapshot.age(), 1),
+    }
+    if total > len(positions):
+        result["hint"] = f"Showing {len(positions)} of {total}; narrow the filters or raise limit."
+    # Replaces the hint above if the byte budget cuts the list further, where
+    # raising limit would not help
+    budget_hint = f"{total} stations match; narrow the filters or request fewer fields."
+    return fit_to_budget(result, result, "stations", project_stations(snapshot.store, positions, fields),
+                         _MAX_RESPONSE_BYTES, hint=budget_hint)
+
+
+def query_bicimad_stations(min_bikes: Optional[int] = None, max_bikes: Optional[int] = None,
+                           min_docks: Optional[int] = None, max_docks: Optional[int] = None,
+                           active: Optional[bool] = True, bbox: Optional[List[float]] = None,
+                           sort_by: Optional[str] = None, limit: int = 10,
+                           fields: Optional[List[str]] = None) -> dict:
+    """
+    Finds the BiciMAD stations matching filters on bikes, docks, status and area.
+
+    Answered from sorted indexes over the cached station list, so only the
+    matching stations are returned, e.g. "active stations with at least 5
+    bikes in this area, ordered by free docks".
+
+    Args:
+        min_bikes: Minimum available bikes
+        max_bikes: Maximum available bikes (0 for empty stations)
+        min_docks: Minimum free docks
+        max_docks: Maximum free docks (0 for full stations)
+        active: True (default) for stations in service, False for stations
+            out of service, None for all
+        bbox: Area as [south, west, north, east] in degrees
+        sort_by: Field to sort by, prefixed with "-" for descending order
+            (e.g. "-free_bases"); also accepts "occupancy"
+        limit: Maximum number of stations returned (default: 10, at most 100)
+        fields: Fields to keep per station (default: id, name, dock_bikes,
+            free_bases, total_bases, activate)
+
+    Returns:
+        A dictionary with the matching stations and how many matched in total
+
+    Example:
+        >>> query_bicimad_stations(min_bikes=5, bbox=[40.41, -3.71, 40.43, -3.69], sort_by="-free_bases")
+        {'status': 'success', 'matching_stations': 12, 'stations': [...]}
+    """
+    try:
+        snapshot = _station_cache.get()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return _query_result(snapshot, min_bikes, max_bikes, min_docks, max_docks, active, bbox,
+                         sort_by, limit, fields)
+
+
+async def query_bicimad_stations_async(min_bikes: Optional[int] = None, max_bikes: Optional[int] = None,
+                                       min_docks: Optional[int] = None, max_docks: Optional[int] = None,
+                                       active: Optional[bool] = True, bbox: Optional[List[float]] = None,
+                                       sort_by: Optional[str] = None, limit: int = 10,
+                                       fields: Optional[List[str]] = None) -> dict:
+    """
+    Finds the BiciMAD stations matching filters on bikes, docks, status and area.
+
+    Non-blocking version of query_bicimad_stations() (the query itself takes
+    well under a millisecond, so it runs on the event loop).
+
+    Args:
+        min_bikes: Minimum available bikes
+        max_bikes: Maximum available bikes (0 for empty stations)
+        min_docks: Minimum free docks
+        max_docks: Maximum free docks (0 for full stations)
+        active: True for stations in service, False for out of service, None for all
+        bbox: Area as [south, west, north, east] in degrees
+        sort_by: Field to sort by, prefixed with "-" for descending order
+        limit: Maximum number of stations returned (default: 10, at most 100)
+        fields: Fields to keep per station
+
+    Returns:
+        A dictionary with the matching stations and how many matched in total
+    """
+    try:
+        snapshot = await _station_cache.aget()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return _query_result(snapshot, min_bikes, max_bikes, min_docks, max_docks, active, bbox,
+                         sort_by, limit, fields)
+
+
+# Places matched below this score are not trusted
+_MIN_PLACE_MATCH = 0.5
+
+# Trip ends must fall in this box around Madrid: (south, west, north, east)
+_TRIP_AREA = (40.20, -4.00, 40.65, -3.45)
+
+
+def _stations_near_place(snapshot: StationSnapshot, place: str, count: int, need: str) -> dict:
+    """
+    Resolves a place with the offline gazetteer and finds the stations around it.
+
+    Args:
+        snapshot: The cached station snapshot
+        place: Landmark, metro station or barrio as written by the user
+        count: Number of stations to return
+        need: "bikes", "docks", "both" or "any"
+
+    Returns:
+        dict: The resolved place, other candidate places and the nearest stations
+    """
+    if not place or not str(place).strip():
+        return {"status": "ERROR", "message": "Provide the name of a place in Madrid"}
+    matches = get_gazetteer().resolve(str(place), limit=4)
+    if not matches or matches[0][1] < _MIN_PLACE_MATCH:
+        return {
+            "status": "ERROR",
+            "message": f"Unknown place '{place}'. Find its coordinates and use get_bicimad_nearest_stations",
+            "suggestions": [candidate.name for candidate, _ in matches],
+        }
+
+    best, score = matches[0]
+    result = _stations_near_points(
+        snapshot, [{"latitude": best.latitude, "longitude": best.longitude, "label": best.name}], count, need
+    )
+    if result["status"] != "success":
+        return result
+    return {
+        "status": "success",
+        "place": {"name": best.name, "kind": best.kind, "latitude": best.latitude,
+                  "longitude": best.longitude, "match": round(score, 2)},
+        # Same-named places (the park and the metro station "Retiro") lie close together
+        "other_places": [{"name": other.name, "kind": other.kind} for other, other_score in matches[1:]
+                         if other_score >= _MIN_PLACE_MATCH],
+        "need": need,
+        "stations": result["results"][0]["stations"],
+        "snapshot_age_seconds": result["snapshot_age_seconds"],
+    }
+
+
+def get_bicimad_stations_near_place(place: str, count: int = 5, need: str = "bikes") -> dict:
+    """
+    Finds the BiciMAD stations nearest to a named place in Madrid.
+
+    The place (landmark, metro station or barrio, e.g. "Retiro", "metro
+    Bilbao", "Malasaña") is resolved offline from a built-in gazetteer,
+    accents and case ignored, so no geocoding or web search is needed.
+
+    Args:
+        place: Place name as written by the user, e.g. "cerca del Retiro"
+        count: Number of stations to return (default: 5)
+        need: "bikes" (default), "docks", "both" or "any"
+
+    Returns:
+        A dictionary with the resolved place and its nearest usable stations,
+        with the distance in meters
+
+    Example:
+        >>> get_bicimad_stations_near_place("cerca del Retiro", count=3)
+        {'status': 'success', 'place': {'name': 'Parque del Retiro', ...}, 'stations': [...]}
+    """
+    try:
+        snapshot = _station_cache.get()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return _stations_near_place(snapshot, place, count, need)
+
+
+async def get_bicimad_stations_near_place_async(place: str, count: int = 5, need: str = "bikes") -> dict:
+    """
+    Finds the BiciMAD stations nearest to a named place in Madrid.
+
+    Non-blocking version of get_bicimad_stations_near_place(): the place
+    lookup (the gazetteer is loaded on first use) runs in a worker thread.
+
+    Args:
+        place: Place name as written by the user, e.g. "cerca del Retiro"
+        count: Number of stations to return (default: 5)
+        need: "bikes" (default), "docks", "both" or "any"
+
+    Returns:
+        A dictionary with the resolved place and its nearest usable stations
+    """
+    try:
+        snapshot = await _station_cache.aget()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return await asyncio.to_thread(_stations_near_place, snapshot, place, count, need)
+
+
+def _coordinates_end(label: str, lat: float, lon: float) -> dict:
+    """A trip end given as coordinates, checked to be a point in Madrid."""
+    if not _is_finite(lat, lon):
+        raise ValueError(f"coordinates {lat}, {lon} are not finite")
+    south, west, north, east = _TRIP_AREA
+    if not (south <= lat <= north and west <= lon <= east):
+        raise ValueError(f"{lat}, {lon} is outside Madrid")
+    return {"label": label, "latitude": lat, "longitude": lon, "resolved_from": "coordinates"}
+
+
+def _resolve_location(snapshot: StationSnapshot, location) -> dict:
+    """
+    Turns a trip end into coordinates.
+
+    Args:
+        snapshot: The cached station snapshot (for station names)
+        location: "latitude,longitude", a Madrid place, a station name, a
+            {"latitude", "longitude"} dict or a [latitude, longitude] pair
+
+    Returns:
+        dict: label, latitude, longitude and how the location was resolved
+
+    Raises:
+        ValueError: If the location cannot be resolved
+    """
+    if isinstance(location, (dict, list, tuple)):
+        (lat,), (lon,), (label,) = _parse_points([location])
+        return _coordinates_end(label, lat, lon)
+
+    text = str(location or "").strip()
+    if not text:
+        raise ValueError("empty location")
+    parts = text.split(",")
+    if len(parts) == 2:
+        try:
+            lat, lon = float(parts[0]), float(parts[1])
+        except ValueError:
+            pass
+        else:
+            return _coordinates_end(text, lat, lon)
+
+    places = get_gazetteer().resolve(text, limit=1)
+    if places and places[0][1] >= _MIN_PLACE_MATCH:
+        place = places[0][0]
+        return {"label": place.name, "latitude": place.latitude, "longitude": place.longitude,
+                "resolved_from": place.kind}
+
+    rows, scores = get_search_index(snapshot).search(text, limit=1)
+    store = snapshot.store
+    if len(rows) and scores[0] >= _MIN_PLACE_MATCH and not np.isnan(store.lats[rows[0]]):
+        return {"label": store.names[rows[0]], "latitude": float(store.lats[rows[0]]),
+                "longitude": float(store.lons[rows[0]]), "resolved_from": "station"}
+    raise ValueError(f"unknown place '{text}'; pass 'latitude,longitude' instead")
+
+
+def _trip_result(snapshot: StationSnapshot, origin, destination) -> dict:
+    """
+    Plans a bike trip on the current snapshot.
+
+    Args:
+        snapshot: The cached station snapshot
+        origin: Where the trip starts (see _resolve_location)
+        destination: Where the trip ends (see _resolve_location)
+
+    Returns:
+        dict: Both ends, the chosen stations and the estimated minutes
+    """
+    try:
+        start = _resolve_location(snapshot, origin)
+        end = _resolve_location(snapshot, destination)
+    except (TypeError, ValueError) as err:
+        return {"status": "ERROR", "message": f"Invalid trip end: {err}"}
+
+    plan = plan_trip(snapshot, (start["latitude"], start["longitude"]), (end["latitude"], end["longitude"]))
+    if plan is None:
+        return {"status": "ERROR", "message": "No active station has a bike near the origin and a free dock near the destination"}
+
+    result = {"status": "success", "origin": start, "destination": end}
+    result.update(plan)
+    if plan["walk_only_min"] <= plan["total_min"]:
+        result["message"] = "Walking directly is as fast as cycling for this trip."
+    result["snapshot_age_seconds"] = round(snapshot.age(), 1)
+    return result
+
+
+def plan_bicimad_trip(origin: str, destination: str) -> dict:
+    """
+    Plans a BiciMAD trip: the best station to pick up a bike and to drop it off.
+
+    Scores the nearby stations with bikes around the origin and with free
+    docks around the destination by walking + riding time, penalizing
+    stations with only one or two bikes (docks) left. Deterministic and
+    computed locally from the cached station list in one call.
+
+    Args:
+        origin: Where the trip starts: a Madrid place ("Puerta del Sol",
+            "metro Bilbao"), a station name, or "latitude,longitude"
+        destination: Where the trip ends, in the same forms
+
+    Returns:
+        A dictionary with the pickup and drop-off stations (walking distance,
+        bikes, docks), the ride distance, the estimated minutes and the
+        runner-up stations
+
+    Example:
+        >>> plan_bicimad_trip("Puerta del Sol", "Parque del Retiro")
+        {'status': 'success', 'pickup': {'id': 1, ...}, 'dropoff': {...}, 'total_min': 12.4, ...}
+    """
+    try:
+        snapshot = _station_cache.get()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return _trip_result(snapshot, origin, destination)
+
+
+async def plan_bicimad_trip_async(origin: str, destination: str) -> dict:
+    """
+    Plans a BiciMAD trip: the best station to pick up a bike and to drop it off.
+
+    Non-blocking version of plan_bicimad_trip(): resolving the trip ends
+    (gazetteer, search index) and the planning run in a worker thread.
+
+    Args:
+        origin: A Madrid place, a station name, or "latitude,longitude"
+        destination: Where the trip ends, in the same forms
+
+    Returns:
+        A dictionary with the pickup and drop-off stations, the ride distance,
+        the estimated minutes and the runner-up stations
+    """
+    try:
+        snapshot = await _station_cache.aget()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return await asyncio.to_thread(_trip_result, snapshot, origin, destination)
+
+
+def _parse_iso(text: str) -> datetime:
+    """
+    Parse an ISO datetime; one without a time zone is taken as Madrid time.
+
+    Raises:
+        ValueError: If the text is not an ISO datetime
+    """
+    moment = datetime.fromisoformat(text)
+    if moment.tzinfo is not None:
+        return moment
+    # Without a tz database, Madrid time is the machine's local time
+    return moment.replace(tzinfo=MADRID_TZ) if MADRID_TZ is not None else moment.astimezone()
+
+
+def _resolve_since(since: Optional[str], current: StationSnapshot) -> Tuple[Optional[StationSnapshot], bool]:
+    """
+    Find the retained snapshot a change report should start from.
+
+    Args:
+        since: Snapshot version, ISO timestamp, or None for the previous snapshot
+        current: The current snapshot
+
+    Returns:
+        Tuple[Optional[StationSnapshot], bool]: The base snapshot (None if
+        there is no older snapshot yet) and whether `since` was older than
+        the retained history, so the oldest retained snapshot was used
+
+    Raises:
+        ValueError: If `since` is neither a version nor an ISO timestamp
+    """
+    history = [snapshot for snapshot in _station_cache.history() if snapshot.version <= current.version]
+    if since is None or str(since).strip() == "":
+        return (history[-2] if len(history) >= 2 else None), False
+
+    since = str(since).strip()
+    if since.isdigit():
+        version = int(since)
+        # Versions are not consecutive: start from the newest one not after `since`
+        # (the current snapshot itself for a future version, i.e. no changes)
+        candidates = [snapshot for snapshot in history if snapshot.version <= version]
+    else:
+        cutoff = _parse_iso(since).timestamp()
+        candidates = [snapshot for snapshot in history if snapshot.fetched_at <= cutoff]
+    if candidates:
+        return candidates[-1], False
+    return history[0], True
+
+
+# Advice when the change lists were cut to the byte budget
+_CHANGES_HINT = ("Too many changes to list them all: use get_bicimad_stations(summary=True) "
+                 "for the network state, or pass a more recent since.")
+
+
+def _changes_result(snapshot: StationSnapshot, since: Optional[str]) -> dict:
+    try:
+        base, truncated = _resolve_since(since, snapshot)
+    except ValueError:
+        return {
+            "status": "ERROR",
+            "message": "since must be a snapshot version number or an ISO timestamp (YYYY-MM-DDTHH:MM:SS)"
+        }
+
+    if base is None:
+        return {
+            "status": "success",
+            "current_version": snapshot.version,
+            "changed": [],
+            "message": "Only one snapshot has been downloaded so far; call again later to see changes."
+        }
+
+    result = {"status": "success", "current_version": snapshot.version}
+    delta = diff_snapshots(base, snapshot).to_dict()
+    lists = [(result, key, delta.pop(key)) for key in ("changed", "added", "removed")]
+    result.update(delta)
+    if truncated:
+        result["message"] = "Requested point is older than the retained history; changes are reported from the oldest retained snapshot."
+    # A network-wide change lists every station: keep the answer within the byte budget
+    return fit_lists_to_budget(result, lists, _MAX_RESPONSE_BYTES, hint=_CHANGES_HINT)
+
+
+def get_bicimad_changes(since: Optional[str] = None) -> dict:
+    """
+    Reports only the BiciMAD stations whose bikes, docks or activation changed.
+
+    Much smaller than get_bicimad_stations for monitoring and "what changed"
+    questions. Pass the returned current_version as `since` in the next call
+    to get only the newer changes.
+
+    Args:
+        since: Snapshot version (e.g. "12") or ISO timestamp
+            (e.g. "2025-05-01T08:00:00", Madrid time) to compare against. If omitted,
+            compares the current snapshot with the previous one.
+
+    Returns:
+        A dictionary with the changed stations (new values and deltas),
+        added and removed stations, and the current snapshot version
+
+    Example:
+        >>> get_bicimad_changes(since="12")
+        {'status': 'success', 'from_version': 12, 'to_version': 15, 'changed': [...], ...}
+    """
+    try:
+        snapshot = _station_cache.get()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return _changes_result(snapshot, since)
+
+
+async def get_bicimad_changes_async(since: Optional[str] = None) -> dict:
+    """
+    Reports only the BiciMAD stations whose bikes, docks or activation changed.
+
+    Non-blocking version of get_bicimad_changes().
+
+    Args:
+        since: Snapshot version or ISO timestamp to compare against. If
+            omitted, compares the current snapshot with the previous one.
+
+    Returns:
+        A dictionary with the changed, added and removed stations
+    """
+    try:
+        snapshot = await _station_cache.aget()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return _changes_result(snapshot, since)
+
+
+def start_bicimad_poller(interval_seconds: float = 60.0) -> None:
+    """
+    Start the optional background poller that refreshes the station list.
+
+    Every downloaded snapshot is recorded in the occupancy ring buffer used
+    by get_bicimad_station_history().
+
+    Args:
+        interval_seconds: Seconds between two downloads (default: 60)
+    """
+    _poller.interval = interval_seconds
+    _poller.start()
+
+
+def _poll_interval(value: Optional[str]) -> Optional[float]:
+    """Parse BICIMAD_POLL_INTERVAL: seconds between polls, None when unset or invalid."""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = float("nan")
+    if not math.isfinite(seconds) or seconds <= 0:
+        logger.warning("Ignoring BICIMAD_POLL_INTERVAL=%r: expected a positive number of seconds", value)
+        return None
+    return seconds
+
+
+def start_bicimad_services() -> None:
+    """
+    Start the background work of the BiciMAD tools; safe to call repeatedly.
+
+    Logs in to EMT from a background thread so the first tool call finds a
+    token ready, and starts the poller when BICIMAD_POLL_INTERVAL is set.
+    Nothing runs when the module is imported: the agent calls this on its
+    first turn.
+    """
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+    get_token_manager().prefetch()
+    interval = _poll_interval(os.getenv("BICIMAD_POLL_INTERVAL"))
+    if interval is not None:
+        start_bicimad_poller(interval)
+
+
+def get_bicimad_station_history(station_id: str, minutes: int = 60, max_points: int = 30) -> dict:
+    """
+    Shows how bikes and free docks evolved at a BiciMAD station recently.
+
+    Answered from the in-memory occupancy buffer (filled by the background
+    poller and by every station list download), without calling the API.
+
+    Args:
+        station_id: Station ID
+        minutes: How far back to look (default: 60)
+        max_points: Maximum number of samples returned (default: 30);
+            longer series are evenly thinned out
+
+    Returns:
+        A dictionary with the samples (time, bikes, docks) and a summary
+        (first, last, min, max and mean bikes)
+
+    Example:
+        >>> get_bicimad_station_history("25", minutes=60)
+        {'status': 'success', 'station_id': '25', 'samples': [...], 'summary': {...}}
+    """
+    try:
+        numeric_id = int(station_id)
+    except (TypeError, ValueError):
+        return {"status": "ERROR", "message": f"Invalid station_id: {station_id}"}
+    try:
+        minutes = _parse_count(minutes, "minutes", 1)
+        max_points = _parse_count(max_points, "max_points", 0)
+    except ValueError as err:
+        return {"status": "ERROR", "message": str(err)}
+    series = _occupancy.series(numeric_id, since=time.time() - minutes * 60)
+
+    if series is None or len(series[0]) == 0:
+        return {
+            "status": "ERROR",
+            "message": (
+                f"No recent occupancy recorded for station {station_id}. "
+                "History is collected while the BiciMAD poller is running."
+            )
+        }
+
+    timestamps, bikes, docks = series
+    rows = np.arange(len(timestamps))
+    if len(rows) > max_points > 0:
+        rows = np.unique(np.linspace(0, len(rows) - 1, max_points).round().astype(int))
+
+    return {
+        "status": "success",
+        "station_id": str(station_id),
+        "minutes": minutes,
+        "samples": [
+            {
+                "time": datetime.fromtimestamp(timestamps[row]).strftime("%H:%M"),
+                "dock_bikes": int(bikes[row]),
+                "free_bases": int(docks[row])
+            }
+            for row in rows
+        ],
+        "summary": {
+            "samples": int(len(timestamps)),
+            "first_bikes": int(bikes[0]),
+            "last_bikes": int(bikes[-1]),
+            "min_bikes": int(bikes.min()),
+            "max_bikes": int(bikes.max()),
+            "mean_bikes": round(float(bikes.mean()), 1),
+            "min_free_bases": int(docks.min()),
+        }
+    }
+
 
+def _trend_result(station_id: str, hours: float, bucket_minutes: int) -> dict:
+    if _tiered_history is None:
+        return {"status": "ERROR", "message": _HISTORY_OFF_MESSAGE}
     try:
-        # Create request with credentials in headers
-        request = urllib.request.Request(login_url, method='GET')
-        request.add_header("email", email)
-        request.add_header("password", password)
+        numeric_id = int(station_id)
+    except (TypeError, ValueError):
+        return {"status": "ERROR", "message": f"Invalid station_id: {station_id}"}
+    try:
+        bucket_minutes = _parse_count(bucket_minutes, "bucket_minutes", 1)
+        if not _is_finite(hours) or float(hours) <= 0:
+            raise ValueError(f"Invalid hours: {hours}")
+        hours = float(hours)
+    except ValueError as err:
+        return {"status": "ERROR", "message": str(err)}
+
+    bucket_seconds = bucket_minutes * 60
+    end = time.time()
+    rows, tier = _tiered_history.query(numeric_id, end - hours * 3600, end, bucket_seconds)
+    if len(rows) == 0:
+        return {
+            "status": "ERROR",
+            "message": f"No stored history for station {station_id} in the last {hours} hours."
+        }
 
-        # Make the login request
-        with urllib.request.urlopen(request) as response:
-            response_data = response.read().decode("utf-8")
-            data = json.loads(response_data)
+    buckets = rollup_summary(rows, bucket_seconds)
+    for bucket in buckets:
+        bucket["start"] = datetime.fromtimestamp(bucket["start"]).isoformat(timespec="minutes")
+    samples = rows["samples"].astype(np.float64)
+    total = float(samples.sum())
+    return {
+        "status": "success",
+        "station_id": str(station_id),
+        "hours": hours,
+        "bucket_minutes": bucket_minutes,
+        "tier": tier,
+        "samples": int(total),
+        "buckets": buckets,
+        "overall": {
+            "mean_bikes": round(float((rows["mean_bikes"] * samples).sum() / total), 1),
+            "min_bikes": int(rows["min_bikes"].min()),
+            "max_bikes": int(rows["max_bikes"].max()),
+            "empty_pct": round(float(rows["empty"].sum()) / total * 100),
+            "full_pct": round(float(rows["full"].sum()) / total * 100)
+        }
+    }
 
-        #logger.debug("data: %s", data)
 
-        # Extract access token from response
-        # The response structure should contain the access token
-        # Adjust based on actual API response structure
-        if data.get("code") == "01" and "data" in data:
-            access_token = data["data"][0].get("accessToken")
-            if access_token:
-                logger.info("Successfully obtained access token")
-                # Cache the token for 24 hours (adjust based on actual token expiry)
-                _token_cache["access_token"] = access_token
-                _token_cache["expires_at"] = datetime.now() + timedelta(hours=24)
-                return access_token
+def get_bicimad_station_trend(station_id: str, hours: float = 24, bucket_minutes: int = 60) -> dict:
+    """
+    Summarizes the stored occupancy history of a BiciMAD station over hours or days.
 
-        logger.error("Failed to extract access token from login response")
-        logger.debug("Login response: %s", data)
-        return None
+    Reads the persistent on-disk history (kept across restarts), aggregated
+    in time buckets: mean/min/max bikes and the share of time (and minutes)
+    the station was empty (no bikes) or full (no free docks). Long ranges are
+    served from the 15-minute or hourly rollups, so months of history stay
+    cheap to query; use bucket_minutes that are multiples of 60 for those.
 
-    except urllib.error.HTTPError as err:
-        logger.error("Login failed with HTTP Error %d: %s", err.code, err.reason)
-        try:
-            error_body = err.read().decode("utf-8")
-            logger.error("Error response: %s", error_body)
-        except:
-            pass
-        return None
+    Args:
+        station_id: Station ID
+        hours: How far back to look (default: 24; e.g. 168 for a week, 720 for a month)
+        bucket_minutes: Width of each aggregation bucket (default: 60)
 
-    except Exception as err:
-        logger.error("Unexpected error during login: %s", str(err))
-        return None
+    Returns:
+        A dictionary with one entry per bucket plus overall figures
+
+    Example:
+        >>> get_bicimad_station_trend("25", hours=48, bucket_minutes=120)
+        {'status': 'success', 'buckets': [...], 'overall': {...}}
+    """
+    return _trend_result(station_id, hours, bucket_minutes)
 
 
-def get_bicimad_stations(station_id: Optional[str] = None) -> dict:
+async def get_bicimad_station_trend_async(station_id: str, hours: float = 24,
+                                          bucket_minutes: int = 60) -> dict:
     """
-    Retrieves BiciMAD bike stations information from EMT Madrid API.
+    Summarizes the stored occupancy history of a BiciMAD station over hours or days.
 
-    This tool fetches real-time data about BiciMAD bike-sharing stations in Madrid,
-    including availability of bikes and docks.
+    Non-blocking version of get_bicimad_station_trend(): the disk read runs
+    in a worker thread.
 
     Args:
-        station_id: Optional station ID to get specific station info.
-                   If None, returns all stations.
+        station_id: Station ID
+        hours: How far back to look (default: 24)
+        bucket_minutes: Width of each aggregation bucket (default: 60)
 
     Returns:
-        A dictionary with station data including:
-        - Station locations
-        - Available bikes
-        - Available docks
-        - Station status
-
-    Example:
-        >>> get_bicimad_stations()
-        {'status': 'success', 'data': [...]}
-
-        >>> get_bicimad_stations(station_id='123')
-        {'status': 'success', 'data': {...}}
+        A dictionary with one entry per bucket plus overall figures
     """
-    # First, login to get access token
-    access_token = _login()
-    if not access_token:
-        return {
-            "status": "ERROR",
-            "message": "Failed to authenticate with EMT Madrid API. Please check EMT_EMAIL and EMT_PASSWORD environment variables."
-        }
+    return await asyncio.to_thread(_trend_result, station_id, hours, bucket_minutes)
 
-    # Build the API URL
-    base_url = "https://openapi.emtmadrid.es/v1"
 
-    # For BiciMAD stations, the endpoint is /transport/bicimad/stations/
-    if station_id:
-        url = f"{base_url}/transport/bicimad/stations/{station_id}/"
-    else:
-        url = f"{base_url}/transport/bicimad/stations/"
-
-    logger.info("Fetching BiciMAD stations from EMT Madrid API: %s", url)
+def _parse_when(when: Optional[str], now: datetime) -> datetime:
+    """
+    Resolve the time a forecast is asked for.
 
-    try:
-        # Create request with access token in header
-        request = urllib.request.Request(url, method='GET')
-        request.add_header("accessToken", access_token)
+    Args:
+        when: None (one hour from now), "HH:MM" (next occurrence, Madrid
+            time) or an ISO datetime
+        now: Current time, timezone-aware
 
-        # Make the API call
-        with urllib.request.urlopen(request) as response:
-            response_data = response.read().decode("utf-8")
-            data = json.loads(response_data)
+    Returns:
+        datetime: The target time, timezone-aware
+    """
+    if when is None or str(when).strip() == "":
+        return datetime.fromtimestamp(now.timestamp() + 3600, now.tzinfo)
 
-        logger.info("Successfully fetched BiciMAD stations data")
-        return {
-            "status": "success",
-            "data": data
-        }
+    when = str(when).strip()
+    if len(when) <= 5 and ":" in when:
+        hours, minutes = (int(part) for part in when.split(":"))
+        target = now.replace(hour=hours, minute=minutes, second=0, microsecond=0)
+        if target <= now:
+            target = datetime.fromtimestamp(target.timestamp() + 86400, now.tzinfo)
+        return target
 
-    except urllib.error.HTTPError as err:
-        error_msg = f"HTTP Error {err.code}: {err.reason}"
-        logger.error("Failed to fetch BiciMAD stations: %s", error_msg)
+    return _parse_iso(when)
 
-        # Try to read error response body
-        try:
-            error_body = err.read().decode("utf-8")
-            logger.error("Error response body: %s", error_body)
-            error_msg += f" - {error_body}"
-        except:
-            pass
 
-        return {
-            "status": "ERROR",
-            "message": error_msg
-        }
+def _forecast_result(station_id: str, when: Optional[str]) -> dict:
+    if _forecaster is None:
+        return {"status": "ERROR", "message": _HISTORY_OFF_MESSAGE}
+    try:
+        numeric_id = int(station_id)
+    except (TypeError, ValueError):
+        return {"status": "ERROR", "message": f"Invalid station_id: {station_id}"}
 
-    except urllib.error.URLError as err:
-        error_msg = f"URL Error: {err.reason}"
-        logger.error("Failed to connect to EMT Madrid API: %s", error_msg)
+    now = datetime.now().astimezone(MADRID_TZ)
+    try:
+        target = _parse_when(when, now)
+    except ValueError:
+        return {"status": "ERROR", "message": f"Invalid time: {when} (use HH:MM or an ISO datetime)"}
+
+    if _forecaster.tables() is None and not _forecaster.attempted:
+        return {"status": "ERROR", "message": "Forecast profiles are not fitted yet, try again in a minute."}
+    profile = _forecaster.forecast(numeric_id, target.timestamp())
+    if profile is None:
         return {
             "status": "ERROR",
-            "message": error_msg
+            "message": f"Not enough stored history to forecast station {station_id} at that hour."
         }
 
-    except json.JSONDecodeError as err:
-        error_msg = f"Failed to parse JSON response: {err}"
-        logger.error(error_msg)
-        return {
-            "status": "ERROR",
-            "message": error_msg
-        }
+    horizon_hours = max((target - now).total_seconds() / 3600, 0.0)
+    expected = profile["mean_bikes"]
+    result = {
+        "status": "success",
+        "station_id": str(station_id),
+        "time": target.isoformat(timespec="minutes"),
+        "horizon_hours": round(horizon_hours, 1),
+        "typical_bikes": profile["mean_bikes"],
+        "range_bikes": profile["spread"],
+        "probability_bikes_available": round(1.0 - profile["empty_share"], 2),
+        "probability_docks_available": round(1.0 - profile["full_share"], 2),
+        "based_on_weeks": profile["weeks"],
+    }
 
-    except Exception as err:
-        error_msg = f"Unexpected error: {str(err)}"
-        logger.error("Unexpected error fetching BiciMAD stations: %s", error_msg)
-        return {
-            "status": "ERROR",
-            "message": error_msg
-        }
+    # For the next few hours, lean on the current count and decay to the profile
+    snapshot = _station_cache.peek()
+    position = snapshot.store.position_of(numeric_id) if snapshot is not None else None
+    if position is not None and horizon_hours < 3:
+        current = int(snapshot.store.dock_bikes[position])
+        weight = float(np.exp(-horizon_hours))
+        expected = weight * current + (1.0 - weight) * expected
+        result["current_bikes"] = current
+    result["expected_bikes"] = round(float(expected), 1)
+    return result
 
 
-def get_bicimad_station_poi(latitude: float, longitude: float, radius: int = 1000) -> dict:
+def forecast_bicimad_availability(station_id: str, when: Optional[str] = None) -> dict:
     """
-    Retrieves BiciMAD stations near a specific location (Point of Interest).
+    Forecasts how many bikes a BiciMAD station will have at a given time.
+
+    Uses per-station hour-of-week profiles learnt from the stored history
+    (typical bikes, the range seen over past weeks and how often the station
+    was empty or full at that hour). For the next few hours the current count
+    is blended in. Answers come from precomputed tables, without API calls.
 
     Args:
-        latitude: Latitude of the location
-        longitude: Longitude of the location
-        radius: Search radius in meters (default: 1000)
+        station_id: Station ID
+        when: Target time: "HH:MM" (next occurrence, Madrid time), an ISO
+            datetime such as "2025-10-20T08:00", or None for one hour from now
 
     Returns:
-        A dictionary with nearby stations data
+        A dictionary with the expected bikes, typical range and probabilities
 
     Example:
-        >>> get_bicimad_station_poi(40.4168, -3.7038, 500)
-        {'status': 'success', 'data': [...]}
+        >>> forecast_bicimad_availability("25", when="08:00")
+        {'status': 'success', 'expected_bikes': 6.4, 'probability_bikes_available': 0.93, ...}
     """
-    # First, login to get access token
-    access_token = _login()
-    if not access_token:
-        return {
-            "status": "ERROR",
-            "message": "Failed to authenticate with EMT Madrid API. Please check EMT_EMAIL and EMT_PASSWORD environment variables."
-        }
-
-    base_url = "https://openapi.emtmadrid.es/v1"
-    url = f"{base_url}/transport/bicimad/stations/poi/"
-
-    # Prepare POST data
-    post_data = json.dumps({
-        "latitude": latitude,
-        "longitude": longitude,
-        "radius": radius
-    }).encode('utf-8')
-
-    logger.info("Fetching BiciMAD stations near location (%.4f, %.4f) with radius %d meters",
-                latitude, longitude, radius)
+    return _forecast_result(station_id, when)
 
-    try:
-        request = urllib.request.Request(url, data=post_data, method='POST')
-        request.add_header("accessToken", access_token)
-        request.add_header("Content-Type", "application/json")
 
-        with urllib.request.urlopen(request) as response:
-            response_data = response.read().decode("utf-8")
-            data = json.loads(response_data)
+async def forecast_bicimad_availability_async(station_id: str, when: Optional[str] = None) -> dict:
+    """
+    Forecasts how many bikes a BiciMAD station will have at a given time.
 
-        logger.info("Successfully fetched nearby BiciMAD stations")
-        return {
-            "status": "success",
-            "data": data
-        }
+    Non-blocking version of forecast_bicimad_availability(): a (re)fit of
+    the profile tables, when due, runs in a worker thread.
 
-    except urllib.error.HTTPError as err:
-        error_msg = f"HTTP Error {err.code}: {err.reason}"
-        logger.error("Failed to fetch nearby BiciMAD stations: %s", error_msg)
+    Args:
+        station_id: Station ID
+        when: Target time: "HH:MM", an ISO datetime, or None for one hour from now
 
-        try:
-            error_body = err.read().decode("utf-8")
-            logger.error("Error response body: %s", error_body)
-            error_msg += f" - {error_body}"
-        except:
-            pass
+    Returns:
+        A dictionary with the expected bikes, typical range and probabilities
+    """
+    return await asyncio.to_thread(_forecast_result, station_id, when)
 
-        return {
-            "status": "ERROR",
-            "message": error_msg
-        }
 
-    except Exception as err:
-        error_msg = f"Unexpected error: {str(err)}"
-        logger.error("Unexpected error fetching nearby BiciMAD stations: %s", error_msg)
-        return {
-            "status": "ERROR",
-            "message": error_msg
-        }
+def _live_map_default(live: Optional[bool]) -> bool:
+    if live is not None:
+        return bool(live)
+    return os.getenv("BICIMAD_LIVE_MAP", "").lower() in ("1", "true", "yes")
 
 
-def visualize_bicimad_stations() -> dict:
+def visualize_bicimad_stations(live: Optional[bool] = None) -> dict:
     """
     Generates an HTML visualization of all BiciMAD stations with their occupancy status.
 
@@ -273,574 +1832,391 @@ def visualize_bicimad_stations() -> dict:
     - Available bikes and docks
     - Visual occupancy indicators with color coding
 
+    Args:
+        live: Serve the map from a local HTTP server that keeps open pages
+            up to date instead of writing a file (default: BICIMAD_LIVE_MAP)
+
     Returns:
-        A dictionary with the path to the generated HTML file
+        A dictionary with the path to the generated HTML file, or the URL
+        of the live map
 
     Example:
         >>> visualize_bicimad_stations()
-        {'status': 'success', 'html_file': '/tmp/bicimad_stations.html', 'message': 'Visualization created successfully'}
+        {'status': 'success', 'html_file': '/tmp/bicimad_maps/bicimad_stations_x1y2.html', 'message': 'Visualization created successfully'}
     """
-    # Get all stations data
-    stations_response = get_bicimad_stations()
+    try:
+        snapshot = _station_cache.get()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": f"Failed to fetch stations data: {err}"}
+    if _live_map_default(live):
+        return _open_live_map(snapshot)
+    return _write_visualization(snapshot)
 
-    if stations_response.get("status") != "success":
-        return {
-            "status": "ERROR",
-            "message": f"Failed to fetch stations data: {stations_response.get('message', 'Unknown error')}"
-        }
 
-    # Extract stations from response
-    api_data = stations_response.get("data", {})
-    stations = api_data.get("data", [])
+async def visualize_bicimad_stations_async(live: Optional[bool] = None) -> dict:
+    """
+    Generates an HTML visualization of all BiciMAD stations with their occupancy status.
+
+    Non-blocking version of visualize_bicimad_stations(): stations are fetched
+    on the event loop and the HTML file is written in a worker thread.
+
+    Args:
+        live: Serve the map from a local HTTP server that keeps open pages
+            up to date instead of writing a file (default: BICIMAD_LIVE_MAP)
+
+    Returns:
+        A dictionary with the path to the generated HTML file, or the URL
+        of the live map
+    """
+    try:
+        snapshot = await _station_cache.aget()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": f"Failed to fetch stations data: {err}"}
+    if _live_map_default(live):
+        return await asyncio.to_thread(_open_live_map, snapshot)
+    return await asyncio.to_thread(_write_visualization, snapshot)
+
+
+def _open_live_map(snapshot: StationSnapshot) -> dict:
+    """
+    Starts the live map server once and opens the map unless a page is already open.
 
-    if not stations:
+    Args:
+        snapshot: The cached station snapshot
+
+    Returns:
+        A dictionary with the URL of the live map
+    """
+    if not len(snapshot):
         return {
             "status": "ERROR",
             "message": "No station data available"
         }
 
-    # Generate HTML
-    html_content = """<!DOCTYPE html>
-<html lang="es">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>BiciMAD - Estado de Estaciones</title>
-    <link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"
-          integrity="sha256-p4NxAoJBhIIN+hmNHrzRCf9tD/miZyoHS5obTRR9BMY="
-          crossorigin=""/>
-    <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"
-            integrity="sha256-20nQCchB9co0qIjJZRGuk2/Z9VM+kNiyxNV1lvTlZBo="
-            crossorigin=""></script>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
+    try:
+        _map_server.start()
+    except OSError as err:
+        return {"status": "ERROR", "message": f"Could not start the live map server: {err}"}
+    _map_server.publish(snapshot)
 
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            padding: 20px;
-            min-height: 100vh;
-        }
+    result = {
+        "status": "success",
+        "url": _map_server.url,
+        "total_stations": len(snapshot),
+        "snapshot_version": _map_server.current().version,
+        "live": True,
+    }
 
-        .container {
-            max-width: 1400px;
-            margin: 0 auto;
-        }
+    # An open page already receives every change: nothing to send again
+    if _map_server.client_count():
+        result["message"] = f"The live map is already open at {_map_server.url} and updates itself with every change."
+        result["browser_opened"] = False
+        return result
 
-        header {
-            background: white;
-            padding: 30px;
-            border-radius: 15px;
-            margin-bottom: 30px;
-            box-shadow: 0 10px 30px rgba(0,0,0,0.2);
-        }
+    try:
+        webbrowser.open(_map_server.url)
+        browser_opened = True
+    except Exception as err:
+        logger.warning("Failed to open browser: %s", str(err))
+        browser_opened = False
+    result["message"] = f"Live map of {len(snapshot)} stations served at {_map_server.url}; the page updates itself as stations change."
+    result["browser_opened"] = browser_opened
+    return result
 
-        h1 {
-            color: #333;
-            font-size: 2.5em;
-            margin-bottom: 10px;
-        }
 
-        .subtitle {
-            color: #666;
-            font-size: 1.1em;
-        }
+def _write_visualization(snapshot: StationSnapshot) -> dict:
+    """
+    Renders a snapshot to an HTML file and opens it in the browser.
 
-        .stats {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 20px;
-            margin-bottom: 30px;
-        }
+    Args:
+        snapshot: The cached station snapshot
 
-        .stat-card {
-            background: white;
-            padding: 20px;
-            border-radius: 10px;
-            box-shadow: 0 5px 15px rgba(0,0,0,0.1);
-            text-align: center;
+    Returns:
+        A dictionary with the path to the generated HTML file
+    """
+    if not len(snapshot):
+        return {
+            "status": "ERROR",
+            "message": "No station data available"
         }
 
-        .stat-value {
-            font-size: 2.5em;
-            font-weight: bold;
-            color: #667eea;
-        }
+    # Pages are content-addressed: an unchanged snapshot reuses the existing file
+    html_file, total_stations, reused = render_station_map(
+        snapshot.store, max_files=_MAP_MAX_FILES, max_bytes=_MAP_MAX_BYTES
+    )
+    logger.info("HTML visualization %s at: %s", "reused" if reused else "created", html_file)
 
-        .stat-label {
-            color: #666;
-            margin-top: 5px;
-        }
+    # Open the HTML file in the default browser
+    try:
+        webbrowser.open('file://' + html_file)
+        logger.info("Opened visualization in browser")
+        browser_opened = True
+    except Exception as err:
+        logger.warning("Failed to open browser: %s", str(err))
+        browser_opened = False
 
-        .stations-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fill, minmax(350px, 1fr));
-            gap: 20px;
-        }
+    return {
+        "status": "success",
+        "html_file": html_file,
+        "message": f"Visualization created successfully with {total_stations} stations. The file has been opened in your default browser.",
+        "total_stations": total_stations,
+        "reused": reused,
+        "browser_opened": browser_opened
+    }
 
-        .station-card {
-            background: white;
-            border-radius: 12px;
-            padding: 20px;
-            box-shadow: 0 5px 20px rgba(0,0,0,0.15);
-            transition: transform 0.2s, box-shadow 0.2s;
-        }
 
-        .station-card:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 10px 30px rgba(0,0,0,0.25);
-        }
+# Largest side of the grid returned by get_bicimad_heatmap(output="array")
+_HEATMAP_ARRAY_SIDE = 32
 
-        .station-id {
-            background: #667eea;
-            color: white;
-            padding: 5px 15px;
-            border-radius: 20px;
-            display: inline-block;
-            font-weight: bold;
-            font-size: 0.9em;
-            margin-bottom: 10px;
-        }
+# Most scarce areas reported by get_bicimad_heatmap()
+_MAX_HEATMAP_ZONES = 50
 
-        .station-name {
-            font-size: 1.3em;
-            font-weight: bold;
-            color: #333;
-            margin-bottom: 8px;
-        }
 
-        .station-address {
-            color: #666;
-            font-size: 0.9em;
-            margin-bottom: 15px;
-            min-height: 40px;
-        }
+def _heatmap_result(snapshot: StationSnapshot, layer: str, output: str, zones: int) -> dict:
+    """
+    Builds the heatmap tool result from the cached rasters of a snapshot.
 
-        .availability {
-            margin-top: 15px;
-        }
+    Args:
+        snapshot: The cached station snapshot
+        layer: One of HEATMAP_LAYERS
+        output: "png" (image file for a map overlay) or "array" (coarse grid)
+        zones: Number of scarce areas to report
 
-        .availability-item {
-            margin-bottom: 12px;
+    Returns:
+        A dictionary with the overlay bounds, the scarce areas and the PNG
+        file or the grid values
+    """
+    if layer not in HEATMAP_LAYERS:
+        return {"status": "ERROR", "message": f"Unknown layer '{layer}'. Available: {', '.join(HEATMAP_LAYERS)}"}
+    if output not in ("png", "array"):
+        return {"status": "ERROR", "message": f"Unknown output '{output}'. Use 'png' or 'array'"}
+    try:
+        zones = _parse_count(zones, "zones", 0, _MAX_HEATMAP_ZONES)
+    except ValueError as err:
+        return {"status": "ERROR", "message": str(err)}
+    if not len(snapshot):
+        return {"status": "ERROR", "message": "No station data available"}
+
+    raster = get_heatmap(snapshot)
+    store = snapshot.store
+    south, west, north, east = raster.bounds
+    rows, cols = raster.scarce_cells(zones)
+    lats, lons = raster.cell_centers(rows, cols)
+    nearest, distances = get_spatial_index(snapshot).query_knn_batch(lats, lons, 1)
+
+    scarce_areas = []
+    for i in range(len(rows)):
+        area = {
+            "latitude": round(float(lats[i]), 5),
+            "longitude": round(float(lons[i]), 5),
+            "availability_pct": round(float(raster.availability[rows[i], cols[i]]) * 100),
+            "bikes_per_km2": round(float(raster.bikes[rows[i], cols[i]]), 1),
         }
+        if len(nearest[i]):
+            position = int(nearest[i][0])
+            area["nearest_station"] = {
+                "id": int(store.ids[position]),
+                "name": store.names[position],
+                "dock_bikes": int(store.dock_bikes[position]),
+                "distance": round(float(distances[i][0])),
+            }
+        scarce_areas.append(area)
 
-        .availability-label {
-            display: flex;
-            justify-content: space-between;
-            margin-bottom: 5px;
-            font-size: 0.9em;
-            color: #555;
-        }
+    bikes = int(store.dock_bikes.sum())
+    docks = int(store.free_bases.sum())
+    result = {
+        "status": "success",
+        "layer": layer,
+        # Leaflet order for L.imageOverlay(url, bounds)
+        "bounds": [[south, west], [north, east]],
+        "grid": {"rows": raster.shape[0], "cols": raster.shape[1],
+                 "cell_m": raster.cell_m, "bandwidth_m": raster.bandwidth_m},
+        "stations": raster.stations,
+        "network_availability_pct": round(100 * bikes / (bikes + docks)) if bikes + docks else None,
+        "scarce_areas": scarce_areas,
+        "snapshot_age_seconds": round(snapshot.age(), 1),
+    }
 
-        .progress-bar {
-            background: #e0e0e0;
-            height: 25px;
-            border-radius: 12px;
-            overflow: hidden;
-            position: relative;
-        }
+    if output == "png":
+        result["png_file"] = write_heatmap_png(raster, store.digest(), layer, default_output_dir())
+        return result
 
-        .progress-fill {
-            height: 100%;
-            transition: width 0.3s ease;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            color: white;
-            font-weight: bold;
-            font-size: 0.85em;
-        }
+    values = raster.downsample(layer, _HEATMAP_ARRAY_SIDE)
+    if layer == "availability":
+        values = values * 100
+    result["values"] = [
+        [None if np.isnan(value) else round(float(value)) for value in row] for row in values
+    ]
+    result["values_grid"] = {"rows": values.shape[0], "cols": values.shape[1]}
+    result["units"] = "% bikes of bikes + free docks" if layer == "availability" else f"{layer} per km²"
+    return result
 
-        .bikes-fill {
-            background: linear-gradient(90deg, #4CAF50, #45a049);
-        }
 
-        .docks-fill {
-            background: linear-gradient(90deg, #2196F3, #1976D2);
-        }
+def get_bicimad_heatmap(layer: str = "availability", output: str = "png", zones: int = 5) -> dict:
+    """
+    Builds a city-wide heatmap of BiciMAD bike and dock availability.
 
-        .status-active {
-            border-left: 5px solid #4CAF50;
-        }
+    The station counts are smoothed over a grid covering Madrid, so the
+    answer describes areas rather than single stations. The raster is built
+    once per station snapshot, without API calls beyond the cached list.
 
-        .status-inactive {
-            border-left: 5px solid #f44336;
-            opacity: 0.7;
-        }
+    Args:
+        layer: "availability" (share of bikes among bikes + free docks),
+            "bikes" or "docks" (density per km²)
+        output: "png" to write a translucent image for a map overlay,
+            "array" to return a coarse grid of values
+        zones: Number of areas with the lowest availability to report (at most 50)
 
-        .filter-bar {
-            background: white;
-            padding: 20px;
-            border-radius: 10px;
-            margin-bottom: 20px;
-            box-shadow: 0 5px 15px rgba(0,0,0,0.1);
-        }
+    Returns:
+        A dictionary with the scarce areas (and their nearest station), the
+        overlay bounds and the PNG file or the grid values
 
-        .filter-bar input {
-            width: 100%;
-            padding: 12px;
-            border: 2px solid #e0e0e0;
-            border-radius: 8px;
-            font-size: 1em;
-            transition: border-color 0.3s;
-        }
+    Example:
+        >>> get_bicimad_heatmap(zones=3)
+        {'status': 'success', 'layer': 'availability', 'scarce_areas': [...], 'png_file': '/tmp/bicimad_maps/bicimad_heatmap_...png', ...}
+    """
+    try:
+        snapshot = _station_cache.get()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return _heatmap_result(snapshot, layer, output, zones)
 
-        .filter-bar input:focus {
-            outline: none;
-            border-color: #667eea;
-        }
 
-        #map {
-            height: 600px;
-            width: 100%;
-            border-radius: 10px;
-            box-shadow: 0 5px 15px rgba(0,0,0,0.1);
-            margin-bottom: 30px;
-        }
+async def get_bicimad_heatmap_async(layer: str = "availability", output: str = "png",
+                                    zones: int = 5) -> dict:
+    """
+    Builds a city-wide heatmap of BiciMAD bike and dock availability.
 
-        .legend {
-            background: white;
-            padding: 15px;
-            border-radius: 8px;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.2);
-            line-height: 24px;
-            color: #555;
-            font-size: 13px;
-        }
+    Non-blocking version of get_bicimad_heatmap(): the raster and the PNG
+    are built in a worker thread when the snapshot has not been seen yet.
 
-        .legend h4 {
-            margin: 0 0 10px 0;
-            color: #333;
-            font-size: 14px;
-        }
+    Args:
+        layer: "availability", "bikes" or "docks"
+        output: "png" or "array"
+        zones: Number of areas with the lowest availability to report
 
-        .legend i {
-            width: 18px;
-            height: 18px;
-            float: left;
-            margin-right: 8px;
-            border-radius: 50%;
-            border: 2px solid white;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.3);
-        }
+    Returns:
+        A dictionary with the scarce areas, the overlay bounds and the PNG
+        file or the grid values
+    """
+    try:
+        snapshot = await _station_cache.aget()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return await asyncio.to_thread(_heatmap_result, snapshot, layer, output, zones)
 
-        .map-container {
-            background: white;
-            padding: 20px;
-            border-radius: 15px;
-            margin-bottom: 30px;
-            box-shadow: 0 10px 30px rgba(0,0,0,0.2);
-        }
 
-        .map-header {
-            font-size: 1.5em;
-            font-weight: bold;
-            color: #333;
-            margin-bottom: 15px;
-        }
+def _rebalancing_result(snapshot: StationSnapshot, max_moves: int, truck_capacity: int,
+                        max_distance_km: Optional[float]) -> dict:
+    """
+    Builds the rebalancing tool result from a snapshot.
 
-        @media (max-width: 768px) {
-            .stations-grid {
-                grid-template-columns: 1fr;
-            }
+    Args:
+        snapshot: The cached station snapshot
+        max_moves: Maximum number of moves listed (largest first)
+        truck_capacity: Bikes a truck carries per trip
+        max_distance_km: Longest move allowed (no limit if None)
 
-            h1 {
-                font-size: 1.8em;
-            }
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <header>
-            <h1>🚲 BiciMAD Madrid</h1>
-            <p class="subtitle">Estado en tiempo real de las estaciones</p>
-        </header>
-
-        <div class="stats" id="stats">
-            <!-- Stats will be populated by JavaScript -->
-        </div>
-
-        <div class="map-container">
-            <div class="map-header">📍 Mapa de Estaciones</div>
-            <div id="map"></div>
-        </div>
-
-        <div class="filter-bar">
-            <input type="text" id="searchInput" placeholder="🔍 Buscar por ID, nombre o dirección...">
-        </div>
-
-        <div class="stations-grid" id="stationsGrid">
-            <!-- Stations will be populated here -->
-        </div>
-    </div>
-
-    <script>
-        const stationsData = """ + json.dumps(stations) + """;
-
-        function calculateStats(stations) {
-            let totalStations = stations.length;
-            let activeStations = 0;
-            let totalBikes = 0;
-            let totalDocks = 0;
-
-            stations.forEach(station => {
-                if (station.activate === 1) activeStations++;
-                totalBikes += station.dock_bikes || 0;
-                totalDocks += station.free_bases || 0;
-            });
-
-            return {
-                totalStations,
-                activeStations,
-                totalBikes,
-                totalDocks
-            };
-        }
+    Returns:
+        dict: The truck moves and the network balance totals
+    """
+    try:
+        truck_capacity = int(truck_capacity)
+        if truck_capacity <= 0:
+            raise ValueError("truck_capacity must be positive")
+        max_moves = _parse_count(max_moves, "max_moves", 0, 100)
+        max_distance_m = float(max_distance_km) * 1000 if max_distance_km is not None else None
+        if max_distance_m is not None and not (_is_finite(max_distance_m) and max_distance_m > 0):
+            raise ValueError("max_distance_km must be a positive number")
+    except (TypeError, ValueError, OverflowError) as err:
+        return {"status": "ERROR", "message": str(err)}
+    if not len(snapshot):
+        return {"status": "ERROR", "message": "No station data available"}
+
+    plan = plan_rebalancing(snapshot, max_distance_m=max_distance_m)
+    store = snapshot.store
+    moves = plan["moves"]
+
+    def station(position: int) -> dict:
+        return {"id": int(store.ids[position]), "name": store.names[position],
+                "dock_bikes": int(store.dock_bikes[position]), "total_bases": int(store.total_bases[position])}
+
+    bikes_moved = sum(bikes for _, _, bikes, _ in moves)
+    trips = sum(-(-bikes // truck_capacity) for _, _, bikes, _ in moves)
+    # The biggest moves matter most to the operators
+    listed = sorted(moves, key=lambda move: (-move[2], move[3]))[:max_moves]
+    result = {
+        "status": "success",
+        "target_fill_pct": round(100 * plan["target_fill"]),
+        "surplus_stations": plan["surplus_stations"],
+        "deficit_stations": plan["deficit_stations"],
+        "surplus_bikes": plan["surplus_bikes"],
+        "deficit_bikes": plan["deficit_bikes"],
+        "bikes_moved": bikes_moved,
+        "truck_trips": trips,
+        "bike_km": round(sum(bikes * meters for _, _, bikes, meters in moves) / 1000, 1),
+        "unmet_deficit": plan["unmet_deficit"],
+        "total_moves": len(moves),
+        "moves": [
+            {"from": station(source), "to": station(target), "bikes": bikes,
+             "distance_m": round(meters), "truck_trips": -(-bikes // truck_capacity)}
+            for source, target, bikes, meters in listed
+        ],
+        "snapshot_age_seconds": round(snapshot.age(), 1),
+    }
+    if len(listed) < len(moves):
+        result["hint"] = f"Showing the {len(listed)} largest of {len(moves)} moves; raise max_moves for more."
+    return result
 
-        function renderStats() {
-            const stats = calculateStats(stationsData);
-            const statsHTML = `
-                <div class="stat-card">
-                    <div class="stat-value">${stats.totalStations}</div>
-                    <div class="stat-label">Estaciones Totales</div>
-                </div>
-                <div class="stat-card">
-                    <div class="stat-value">${stats.activeStations}</div>
-                    <div class="stat-label">Estaciones Activas</div>
-                </div>
-                <div class="stat-card">
-                    <div class="stat-value">${stats.totalBikes}</div>
-                    <div class="stat-label">Bicis Disponibles</div>
-                </div>
-                <div class="stat-card">
-                    <div class="stat-value">${stats.totalDocks}</div>
-                    <div class="stat-label">Anclajes Libres</div>
-                </div>
-            `;
-            document.getElementById('stats').innerHTML = statsHTML;
-        }
 
-        function renderStations(stations) {
-            const grid = document.getElementById('stationsGrid');
+def get_bicimad_rebalancing(max_moves: int = 20, truck_capacity: int = DEFAULT_TRUCK_CAPACITY,
+                            max_distance_km: Optional[float] = None) -> dict:
+    """
+    Recommends truck moves to rebalance bikes between BiciMAD stations.
 
-            if (stations.length === 0) {
-                grid.innerHTML = '<p style="color: white; text-align: center; padding: 40px; grid-column: 1/-1;">No se encontraron estaciones</p>';
-                return;
-            }
+    Stations fuller than 75% give away their bikes beyond the network-wide
+    fill ratio, and stations emptier than 25% receive bikes up to it.
+    Surplus is assigned to the nearest deficits, shortest moves first,
+    using the station coordinates of the cached list.
 
-            const stationsHTML = stations.map(station => {
-                const stationId = station.id || station.number || 'N/A';
-                const stationName = station.name || 'Estación sin nombre';
-                const address = station.address || '';
-                const bikes = station.dock_bikes || 0;
-                const freeDocks = station.free_bases || 0;
-                const totalDocks = station.total_bases || (bikes + freeDocks);
-                const isActive = station.activate === 1;
-
-                const bikesPercent = totalDocks > 0 ? (bikes / totalDocks * 100) : 0;
-                const docksPercent = totalDocks > 0 ? (freeDocks / totalDocks * 100) : 0;
-
-                const statusClass = isActive ? 'status-active' : 'status-inactive';
-
-                return `
-                    <div class="station-card ${statusClass}">
-                        <div class="station-id">ID: ${stationId}</div>
-                        <div class="station-name">${stationName}</div>
-                        <div class="station-address">${address}</div>
-
-                        <div class="availability">
-                            <div class="availability-item">
-                                <div class="availability-label">
-                                    <span>🚲 Bicis disponibles</span>
-                                    <span><strong>${bikes}</strong> / ${totalDocks}</span>
-                                </div>
-                                <div class="progress-bar">
-                                    <div class="progress-fill bikes-fill" style="width: ${bikesPercent}%">
-                                        ${bikesPercent > 15 ? bikes : ''}
-                                    </div>
-                                </div>
-                            </div>
-
-                            <div class="availability-item">
-                                <div class="availability-label">
-                                    <span>🅿️ Anclajes libres</span>
-                                    <span><strong>${freeDocks}</strong> / ${totalDocks}</span>
-                                </div>
-                                <div class="progress-bar">
-                                    <div class="progress-fill docks-fill" style="width: ${docksPercent}%">
-                                        ${docksPercent > 15 ? freeDocks : ''}
-                                    </div>
-                                </div>
-                            </div>
-                        </div>
-                    </div>
-                `;
-            }).join('');
-
-            grid.innerHTML = stationsHTML;
-        }
+    Args:
+        max_moves: Maximum number of moves listed, largest first (default: 20)
+        truck_capacity: Bikes a truck carries per trip (default: 20)
+        max_distance_km: Longest move allowed in kilometers (default: no limit)
 
-        // Search functionality
-        document.getElementById('searchInput').addEventListener('input', function(e) {
-            const searchTerm = e.target.value.toLowerCase();
-            const filteredStations = stationsData.filter(station => {
-                const id = String(station.id || station.number || '').toLowerCase();
-                const name = (station.name || '').toLowerCase();
-                const address = (station.address || '').toLowerCase();
-                return id.includes(searchTerm) || name.includes(searchTerm) || address.includes(searchTerm);
-            });
-            renderStations(filteredStations);
-        });
-
-        // Initialize map
-        function initMap() {
-            // Center on Madrid
-            const madridCenter = [40.4168, -3.7038];
-            const map = L.map('map').setView(madridCenter, 13);
-
-            // Add OpenStreetMap tile layer
-            L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
-                attribution: '© <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-                maxZoom: 19
-            }).addTo(map);
-
-            // Add markers for each station
-            stationsData.forEach(station => {
-                // Get coordinates from the station data
-                // EMT API uses 'geometry' field with coordinates
-                let lat, lng;
-
-                if (station.geometry && station.geometry.coordinates) {
-                    // GeoJSON format: [longitude, latitude]
-                    lng = station.geometry.coordinates[0];
-                    lat = station.geometry.coordinates[1];
-                } else if (station.latitude && station.longitude) {
-                    // Direct lat/lng fields
-                    lat = station.latitude;
-                    lng = station.longitude;
-                } else {
-                    return; // Skip if no coordinates
-                }
-
-                const stationId = station.id || station.number || 'N/A';
-                const stationName = station.name || 'Estación sin nombre';
-                const bikes = station.dock_bikes || 0;
-                const freeDocks = station.free_bases || 0;
-                const totalDocks = station.total_bases || (bikes + freeDocks);
-                const isActive = station.activate === 1;
-
-                // Choose marker color based on occupancy percentage
-                let markerColor = '#666';
-                if (!isActive) {
-                    markerColor = '#9E9E9E'; // Gray for inactive
-                } else if (totalDocks > 0) {
-                    const occupancyPercent = (bikes / totalDocks) * 100;
-
-                    if (occupancyPercent === 0) {
-                        markerColor = '#D32F2F'; // Dark red - no bikes
-                    } else if (occupancyPercent < 20) {
-                        markerColor = '#F44336'; // Red - very low
-                    } else if (occupancyPercent < 40) {
-                        markerColor = '#FF9800'; // Orange - low
-                    } else if (occupancyPercent < 60) {
-                        markerColor = '#FFC107'; // Amber - medium
-                    } else if (occupancyPercent < 80) {
-                        markerColor = '#8BC34A'; // Light green - good
-                    } else {
-                        markerColor = '#4CAF50'; // Green - excellent
-                    }
-                } else {
-                    markerColor = '#9E9E9E'; // Gray for no data
-                }
-
-                // Create custom icon
-                const markerIcon = L.divIcon({
-                    className: 'custom-marker',
-                    html: `<div style="background-color: ${markerColor}; width: 30px; height: 30px; border-radius: 50%; border: 3px solid white; box-shadow: 0 2px 5px rgba(0,0,0,0.3); display: flex; align-items: center; justify-content: center; color: white; font-weight: bold; font-size: 12px;">${bikes}</div>`,
-                    iconSize: [30, 30],
-                    iconAnchor: [15, 15]
-                });
-
-                // Create marker
-                const marker = L.marker([lat, lng], { icon: markerIcon }).addTo(map);
-
-                // Calculate occupancy percentage
-                const occupancyPercent = totalDocks > 0 ? Math.round((bikes / totalDocks) * 100) : 0;
-
-                // Create popup content
-                const popupContent = `
-                    <div style="min-width: 200px;">
-                        <h3 style="margin: 0 0 10px 0; color: #333;">${stationName}</h3>
-                        <p style="margin: 5px 0; color: #666;"><strong>ID:</strong> ${stationId}</p>
-                        <p style="margin: 5px 0; color: #666;"><strong>Estado:</strong> ${isActive ? '✅ Activa' : '❌ Inactiva'}</p>
-                        <p style="margin: 5px 0; color: #666; font-size: 0.9em;"><strong>📍 Coordenadas:</strong> ${lat.toFixed(6)}, ${lng.toFixed(6)}</p>
-                        <hr style="margin: 10px 0; border: none; border-top: 1px solid #eee;">
-                        <p style="margin: 5px 0;"><strong>🚲 Bicis:</strong> ${bikes} / ${totalDocks} <span style="color: ${markerColor}; font-weight: bold;">(${occupancyPercent}%)</span></p>
-                        <p style="margin: 5px 0;"><strong>🅿️ Anclajes libres:</strong> ${freeDocks}</p>
-                    </div>
-                `;
-
-                marker.bindPopup(popupContent);
-            });
-
-            // Add legend
-            const legend = L.control({position: 'bottomright'});
-
-            legend.onAdd = function (map) {
-                const div = L.DomUtil.create('div', 'legend');
-                div.innerHTML = `
-                    <h4>📊 Ocupación de Bicis</h4>
-                    <i style="background: #4CAF50"></i> 80-100% (Excelente)<br>
-                    <i style="background: #8BC34A"></i> 60-80% (Buena)<br>
-                    <i style="background: #FFC107"></i> 40-60% (Media)<br>
-                    <i style="background: #FF9800"></i> 20-40% (Baja)<br>
-                    <i style="background: #F44336"></i> 1-20% (Muy baja)<br>
-                    <i style="background: #D32F2F"></i> 0% (Sin bicis)<br>
-                    <i style="background: #9E9E9E"></i> Inactiva
-                `;
-                return div;
-            };
-
-            legend.addTo(map);
-
-            return map;
-        }
+    Returns:
+        A dictionary with the moves (from station, to station, bikes,
+        distance, truck trips) and the totals of the plan
+
+    Example:
+        >>> get_bicimad_rebalancing(max_moves=5)
+        {'status': 'success', 'bikes_moved': 412, 'moves': [{'from': {...}, 'to': {...}, 'bikes': 14, ...}], ...}
+    """
+    try:
+        snapshot = _station_cache.get()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return _rebalancing_result(snapshot, max_moves, truck_capacity, max_distance_km)
 
-        // Initial render
-        renderStats();
-        renderStations(stationsData);
-        initMap();
-    </script>
-</body>
-</html>"""
 
-    # Save HTML to file
-    import tempfile
-    import webbrowser
-    output_file = tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8')
-    output_file.write(html_content)
-    output_file.close()
+async def get_bicimad_rebalancing_async(max_moves: int = 20, truck_capacity: int = DEFAULT_TRUCK_CAPACITY,
+                                        max_distance_km: Optional[float] = None) -> dict:
+    """
+    Recommends truck moves to rebalance bikes between BiciMAD stations.
 
-    logger.info("HTML visualization created at: %s", output_file.name)
+    Non-blocking version of get_bicimad_rebalancing(): the plan is computed
+    in a worker thread.
 
-    # Open the HTML file in the default browser
-    try:
-        webbrowser.open('file://' + output_file.name)
-        logger.info("Opened visualization in browser")
-        browser_opened = True
-    except Exception as err:
-        logger.warning("Failed to open browser: %s", str(err))
-        browser_opened = False
+    Args:
+        max_moves: Maximum number of moves listed, largest first (default: 20)
+        truck_capacity: Bikes a truck carries per trip (default: 20)
+        max_distance_km: Longest move allowed in kilometers (default: no limit)
 
-    return {
-        "status": "success",
-        "html_file": output_file.name,
-        "message": f"Visualization created successfully with {len(stations)} stations. The file has been opened in your default browser.",
-        "total_stations": len(stations),
-        "browser_opened": browser_opened
-    }
+    Returns:
+        A dictionary with the moves and the totals of the plan
+    """
+    try:
+        snapshot = await _station_cache.aget()
+    except SnapshotUnavailableError as err:
+        return {"status": "ERROR", "message": str(err)}
+    return await asyncio.to_thread(_rebalancing_result, snapshot, max_moves, truck_capacity, max_distance_km)
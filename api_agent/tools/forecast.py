@@ -0,0 +1,321 @@
+"""Seasonal availability forecasts for the BiciMAD stations.
+
+Bike availability is dominated by a weekly rhythm: commuters empty the
+residential stations on weekday mornings and fill the business districts.
+AvailabilityForecaster fits, for every station at once, an hour-of-week
+profile from the hourly history rollups:
+
+    mean       sample-weighted mean bikes per (station, hour of week)
+    p10..p90   spread of that hour's mean across the past weeks
+    empty/full share of samples that found the station empty / full
+
+The fit is a handful of vectorized passes over the rollups and produces
+dense (stations x 168) tables, so answering a forecast is a dict lookup
+plus an array read. Fits run on a background thread every few hours (the
+station cache triggers them as snapshots arrive); lookups in between are
+served from the last tables, so a tool call never waits for a fit.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, tzinfo
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from .history_rollups import TieredHistory
+
+logger = logging.getLogger(__name__)
+
+HOURS_PER_WEEK = 168
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+    MADRID_TZ: Optional[tzinfo] = ZoneInfo("Europe/Madrid")
+except (ImportError, ZoneInfoNotFoundError):
+    # No tz database available: fall back to the machine's local time
+    MADRID_TZ = None
+
+
+def _hour_and_week(ts: np.ndarray, tz: Optional[tzinfo]):
+    """
+    Local hour of week (0 = Monday 00h) and week number of each timestamp.
+
+    Local time is only computed once per distinct hour, so the cost does not
+    depend on the number of stations.
+    """
+    hours, inverse = np.unique(ts.astype(np.int64) // 3600, return_inverse=True)
+    hour_of_week = np.empty(len(hours), dtype=np.int64)
+    week = np.empty(len(hours), dtype=np.int64)
+    for position, hour in enumerate(hours.tolist()):
+        moment = datetime.fromtimestamp(hour * 3600, tz)
+        hour_of_week[position] = moment.weekday() * 24 + moment.hour
+        # Day ordinal 1 (0001-01-01) is a Monday, so weeks start on Mondays
+        week[position] = (moment.toordinal() - 1) // 7
+    return hour_of_week[inverse], week[inverse]
+
+
+def _quantiles_last_axis(cube: np.ndarray, levels: Sequence[float]) -> np.ndarray:
+    """
+    Linear-interpolated quantiles along the last axis, ignoring NaNs.
+
+    np.nanquantile falls back to one Python-level call per cell; sorting
+    the whole cube once (NaNs sort last) and interpolating between the two
+    neighbouring ranks keeps everything vectorized.
+
+    Returns:
+        np.ndarray: Shape (len(levels),) + cube.shape[:-1], NaN where a cell has no data
+    """
+    ordered = np.sort(cube, axis=-1)
+    valid = np.sum(~np.isnan(cube), axis=-1)
+    last = np.maximum(valid - 1, 0)
+    result = np.empty((len(levels),) + cube.shape[:-1], dtype=np.float32)
+    for index, level in enumerate(levels):
+        rank = last * level
+        below = np.floor(rank).astype(np.int64)
+        above = np.minimum(below + 1, last)
+        low = np.take_along_axis(ordered, below[..., None], axis=-1)[..., 0]
+        high = np.take_along_axis(ordered, above[..., None], axis=-1)[..., 0]
+        result[index] = low + (high - low) * (rank - below)
+    result[:, valid == 0] = np.nan
+    return result
+
+
+def hour_of_week(ts: float, tz: Optional[tzinfo] = MADRID_TZ) -> int:
+    """Local hour of week of one timestamp (0 = Monday 00h)."""
+    moment = datetime.fromtimestamp(ts, tz)
+    return moment.weekday() * 24 + moment.hour
+
+
+class ForecastTables:
+    """
+    Precomputed hour-of-week profiles of every station.
+
+    Attributes:
+        station_ids: Station ids, one per table row
+        mean: Mean bikes, shape (stations, 168), NaN without data
+        quantiles: Quantile levels of `spread`
+        spread: Quantiles of the hourly mean across weeks, shape (levels, stations, 168)
+        empty_share: Share of samples with no bikes
+        full_share: Share of samples with no free docks
+        samples: Number of samples behind each cell
+        weeks: Number of distinct weeks behind each cell
+        fitted_at: Epoch time of the fit
+    """
+
+    def __init__(self, station_ids, mean, quantiles, spread, empty_share, full_share,
+                 samples, weeks, fitted_at: float):
+        self.station_ids = station_ids
+        self.mean = mean
+        self.quantiles = tuple(quantiles)
+        self.spread = spread
+        self.empty_share = empty_share
+        self.full_share = full_share
+        self.samples = samples
+        self.weeks = weeks
+        self.fitted_at = fitted_at
+        self._rows: Dict[int, int] = {
+            int(station_id): row for row, station_id in enumerate(station_ids.tolist())
+        }
+
+    def __len__(self) -> int:
+        return len(self.station_ids)
+
+    def row_of(self, station_id: int) -> Optional[int]:
+        return self._rows.get(int(station_id))
+
+    def nbytes(self) -> int:
+        arrays = (self.mean, self.spread, self.empty_share, self.full_share,
+                  self.samples, self.weeks)
+        return sum(array.nbytes for array in arrays)
+
+
+def fit_profiles(rows: np.ndarray, quantiles: Sequence[float] = (0.1, 0.5, 0.9),
+                 tz: Optional[tzinfo] = MADRID_TZ, chunk_stations: int = 2048) -> ForecastTables:
+    """
+    Fit the hour-of-week profiles of all stations from hourly rollups.
+
+    Args:
+        rows: Hourly ROLLUP_DTYPE rows of any number of stations
+        quantiles: Quantile levels to compute (default: 10th, 50th, 90th)
+        tz: Time zone of the hour of week
+        chunk_stations: Stations per quantile pass (bounds memory)
+
+    Returns:
+        ForecastTables: Dense profile tables
+    """
+    station_ids, station_rows = np.unique(rows["station_id"], return_inverse=True)
+    hours, weeks = _hour_and_week(rows["ts"], tz)
+    week_slots = weeks - weeks.min() if len(weeks) else weeks
+    n_stations = len(station_ids)
+    n_weeks = int(week_slots.max()) + 1 if len(week_slots) else 1
+    cells = station_rows * HOURS_PER_WEEK + hours
+    size = n_stations * HOURS_PER_WEEK
+    shape = (n_stations, HOURS_PER_WEEK)
+
+    samples = rows["samples"].astype(np.float64)
+    total = np.bincount(cells, weights=samples, minlength=size)
+    weighted = np.bincount(cells, weights=rows["mean_bikes"] * samples, minlength=size)
+    empty = np.bincount(cells, weights=rows["empty"], minlength=size)
+    full = np.bincount(cells, weights=rows["full"], minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (weighted / total).reshape(shape).astype(np.float32)
+        empty_share = (empty / total).reshape(shape).astype(np.float32)
+        full_share = (full / total).reshape(shape).astype(np.float32)
+
+    # (station, hour of week, week) cube of hourly means, filled per station chunk
+    spread = np.full((len(quantiles),) + shape, np.nan, dtype=np.float32)
+    week_count = np.zeros(shape, dtype=np.int16)
+    order = np.argsort(station_rows, kind="stable")
+    bounds = np.searchsorted(station_rows[order], np.arange(0, n_stations + chunk_stations,
+                                                            chunk_stations))
+    for chunk, first in enumerate(range(0, n_stations, chunk_stations)):
+        picked = order[bounds[chunk]:bounds[chunk + 1]]
+        count = min(chunk_stations, n_stations - first)
+        cube = np.full((count, HOURS_PER_WEEK, n_weeks), np.nan, dtype=np.float32)
+        cube[station_rows[picked] - first, hours[picked], week_slots[picked]] = (
+            rows["mean_bikes"][picked]
+        )
+        week_count[first:first + count] = np.sum(~np.isnan(cube), axis=2)
+        spread[:, first:first + count] = _quantiles_last_axis(cube, quantiles)
+
+    return ForecastTables(
+        station_ids=station_ids.astype(np.int64),
+        mean=mean,
+        quantiles=quantiles,
+        spread=spread,
+        empty_share=empty_share,
+        full_share=full_share,
+        samples=total.reshape(shape).astype(np.int32),
+        weeks=week_count,
+        fitted_at=time.time(),
+    )
+
+
+class AvailabilityForecaster:
+    """
+    Hour-of-week availability profiles fitted from the stored history.
+    """
+
+    def __init__(self, history: TieredHistory, lookback_days: float = 28,
+                 refit_interval: float = 6 * 3600, empty_retry_interval: float = 900.0,
+                 tz: Optional[tzinfo] = MADRID_TZ):
+        """
+        Args:
+            history: Tiered occupancy history to learn from
+            lookback_days: Days of history used by a fit
+            refit_interval: Seconds after which the tables are refitted
+            empty_retry_interval: Seconds before a fit that found no history is retried
+            tz: Time zone of the hour of week
+        """
+        self.history = history
+        self.lookback_days = lookback_days
+        self.refit_interval = refit_interval
+        self.empty_retry_interval = empty_retry_interval
+        self.tz = tz
+        self._tables: Optional[ForecastTables] = None
+        # Time of the last fit attempt, including the ones that found no history
+        self._last_fit = 0.0
+        self._running = False
+        self._lock = threading.Lock()
+
+    def fit(self, now: Optional[float] = None) -> Optional[ForecastTables]:
+        """
+        Refit the tables from the last `lookback_days` of history.
+
+        Args:
+            now: Current epoch time (defaults to time.time())
+
+        Returns:
+            ForecastTables: The new tables, or None if there is no history
+        """
+        now = time.time() if now is None else now
+        started = time.monotonic()
+        rows, tier = self.history.query(None, now - self.lookback_days * 86400, now, 3600)
+        self._last_fit = time.time()
+        if len(rows) == 0:
+            return None
+        tables = fit_profiles(rows, tz=self.tz)
+        self._tables = tables
+        logger.info(
+            "Fitted BiciMAD forecast tables: %d stations from %d %s rows in %.2fs",
+            len(tables), len(rows), tier, time.monotonic() - started
+        )
+        return tables
+
+    @property
+    def attempted(self) -> bool:
+        """Whether a fit has run, even one that found no history."""
+        return self._last_fit > 0
+
+    def _due(self) -> bool:
+        interval = self.refit_interval if self._tables is not None else self.empty_retry_interval
+        return time.time() - self._last_fit >= interval
+
+    def maybe_refit_in_background(self, *_args) -> None:
+        """
+        Start a background fit if the tables are due for one and none is running.
+
+        Accepts (and ignores) positional arguments so it can be registered
+        directly as a StationSnapshotCache listener.
+        """
+        with self._lock:
+            if self._running or not self._due():
+                return
+            self._running = True
+
+        def run():
+            try:
+                self.fit()
+            except Exception as err:
+                logger.warning("BiciMAD forecast fit failed: %s", str(err))
+            finally:
+                self._running = False
+
+        threading.Thread(target=run, name="bicimad-forecast-fit", daemon=True).start()
+
+    def tables(self) -> Optional[ForecastTables]:
+        """
+        Current tables, without waiting for a fit.
+
+        Starts a background fit when the tables are missing or older than
+        refit_interval; until it finishes the previous tables (or None) are
+        returned.
+        """
+        self.maybe_refit_in_background()
+        return self._tables
+
+    def forecast(self, station_id: int, when: float) -> Optional[dict]:
+        """
+        Look up the profile of a station at a given time.
+
+        Args:
+            station_id: Station id
+            when: Epoch time to forecast
+
+        Returns:
+            dict: Profile values at that hour of week, or None if the station
+            has no history
+        """
+        tables = self.tables()
+        row = tables.row_of(station_id) if tables is not None else None
+        if row is None:
+            return None
+        hour = hour_of_week(when, self.tz)
+        if tables.samples[row, hour] == 0:
+            return None
+        spread = {
+            f"p{round(level * 100)}": round(float(tables.spread[index, row, hour]), 1)
+            for index, level in enumerate(tables.quantiles)
+        }
+        return {
+            "hour_of_week": hour,
+            "mean_bikes": round(float(tables.mean[row, hour]), 1),
+            "spread": spread,
+            "empty_share": float(tables.empty_share[row, hour]),
+            "full_share": float(tables.full_share[row, hour]),
+            "samples": int(tables.samples[row, hour]),
+            "weeks": int(tables.weeks[row, hour]),
+        }
@@ -0,0 +1,128 @@
+"""Offline gazetteer of Madrid places: landmarks, metro stations and barrios.
+
+Users locate themselves by place ("cerca del Retiro", "metro Bilbao"), while
+the station tools need coordinates. The places shipped in
+data/madrid_places.tsv are loaded once and indexed with the same folded-word
+TextIndex as the station names, so a name resolves to coordinates in
+microseconds, without geocoding or web searches.
+"""
+
+import csv
+import logging
+import os
+import threading
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .station_search import TextIndex, fold
+
+logger = logging.getLogger(__name__)
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "madrid_places.tsv")
+
+PLACE_KINDS = ("landmark", "metro", "barrio")
+
+# Words naming the kind of place wanted ("metro Bilbao", "barrio de Salamanca")
+_KIND_WORDS = {"metro": "metro", "barrio": "barrio", "distrito": "barrio"}
+
+# Words around a place name that do not name it ("cerca del Retiro", "near Sol")
+_FILLER_WORDS = frozenset((
+    "cerca", "junto", "lado", "zona", "alrededor", "por", "desde", "hasta", "hacia",
+    "near", "next", "to", "close", "around", "at", "the", "from",
+))
+
+
+class Place(NamedTuple):
+    """A named point of Madrid."""
+    kind: str
+    name: str
+    latitude: float
+    longitude: float
+
+
+class Gazetteer:
+    """
+    Name index over a list of places.
+
+    Attributes:
+        places: The places, in file order (landmarks first, which also wins ties)
+    """
+
+    def __init__(self, places: List[Place], aliases: List[str]):
+        """
+        Index the names and aliases of the places.
+
+        Args:
+            places: Places to index
+            aliases: Alternative names of each place, separated by "|"
+        """
+        self.places = places
+        self._kinds = np.array([place.kind for place in places])
+        self._index = TextIndex(
+            [([place.name for place in places], 1.0), ([alias.replace("|", " ") for alias in aliases], 1.0)],
+            len(places),
+        )
+
+    def __len__(self) -> int:
+        return len(self.places)
+
+    @classmethod
+    def load(cls, path: str = GAZETTEER_PATH) -> "Gazetteer":
+        """
+        Read a tab-separated place file (kind, name, latitude, longitude, aliases).
+
+        Args:
+            path: File to read; lines starting with "#" are comments
+
+        Returns:
+            Gazetteer: The indexed places
+        """
+        places, aliases = [], []
+        with open(path, encoding="utf-8", newline="") as file:
+            rows = csv.DictReader((line for line in file if not line.startswith("#")), delimiter="\t")
+            for row in rows:
+                places.append(Place(row["kind"], row["name"], float(row["latitude"]), float(row["longitude"])))
+                aliases.append(row.get("aliases") or "")
+        logger.info("Loaded %d Madrid places from %s", len(places), path)
+        return cls(places, aliases)
+
+    def resolve(self, text: str, limit: int = 5) -> List[Tuple[Place, float]]:
+        """
+        Find the places matching a name.
+
+        Args:
+            text: Place as written by the user, e.g. "cerca del Retiro"
+            limit: Maximum number of places returned
+
+        Returns:
+            List[Tuple[Place, float]]: Places and match scores (0..1), best
+            first; places of the kind named in the text ("metro ...") first
+        """
+        words = fold(text).split()
+        kinds = {_KIND_WORDS[word] for word in words if word in _KIND_WORDS}
+        query = " ".join(word for word in words if word not in _KIND_WORDS and word not in _FILLER_WORDS)
+        rows, scores = self._index.search(query or " ".join(words), limit=len(self.places))
+        if kinds:
+            preferred = np.isin(self._kinds[rows], list(kinds))
+            order = np.argsort(~preferred, kind="stable")
+            rows, scores = rows[order], scores[order]
+        return [(self.places[row], float(score)) for row, score in zip(rows[:limit], scores[:limit])]
+
+
+_gazetteer: Optional[Gazetteer] = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    """
+    Get the Madrid gazetteer, loading it on first use.
+
+    Returns:
+        Gazetteer: The shared instance
+    """
+    global _gazetteer
+    with _gazetteer_lock:
+        if _gazetteer is None:
+            _gazetteer = Gazetteer.load()
+        return _gazetteer
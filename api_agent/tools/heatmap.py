@@ -0,0 +1,349 @@
+"""Occupancy heatmap rasters of the BiciMAD station snapshot.
+
+For city-wide questions ("where are bikes scarce?") the stations are turned
+into a fixed grid over Madrid with a weighted Gaussian kernel density
+estimate of available bikes and free docks. The estimate is binned: station
+weights are summed into the grid cells with np.bincount and then smoothed
+with two dense Gaussian matrices (rows and columns), so the cost depends on
+the grid size, not on the number of stations. From the two densities the
+share of bikes among the available bike+dock capacity gives the
+"availability" layer.
+
+A raster is built once per snapshot (cached on the identity of its
+StationStore, like the spatial index) and can be exported as an RGBA PNG,
+encoded with zlib only, for a Leaflet image overlay. PNG files are
+content-addressed and evicted like the map pages.
+"""
+
+import hashlib
+import math
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from .spatial_index import M_PER_DEG_LAT
+from .station_map import PARTIAL_PREFIX, evict_pages
+
+# South, west, north, east of the raster (the BiciMAD service area with a margin)
+MADRID_BOUNDS = (40.36, -3.78, 40.52, -3.60)
+
+DEFAULT_CELL_M = 100.0
+DEFAULT_BANDWIDTH_M = 350.0
+
+HEATMAP_LAYERS = ("availability", "bikes", "docks")
+
+# A cell counts as served if its dock density is at least that of a
+# 20-dock station two bandwidths away
+_SERVICE_DOCKS = 20
+_SERVICE_BANDWIDTHS = 2.0
+# Scarce areas are only picked where that station would be one bandwidth away,
+# not on the thinly served fringe
+_SCARCE_BANDWIDTHS = 1.0
+
+# PNG files kept in the output directory (least recently used evicted first)
+_PNG_PREFIX = "bicimad_heatmap_"
+_MAX_PNG_FILES = 20
+
+# Colour ramp from scarce (red) through medium (yellow) to plentiful (green)
+_RAMP_STOPS = np.array([0.0, 0.5, 1.0])
+_RAMP_COLORS = np.array([[215, 48, 39], [254, 224, 139], [26, 152, 80]], dtype=np.float64)
+_OVERLAY_ALPHA = 170
+
+
+def _capacity_threshold(bandwidth_m: float, bandwidths: float) -> float:
+    """Bike + dock density of a _SERVICE_DOCKS station `bandwidths` away, per km²."""
+    per_km2 = 1e6 / (2.0 * math.pi * bandwidth_m * bandwidth_m)
+    return _SERVICE_DOCKS * math.exp(-0.5 * bandwidths ** 2) * per_km2
+
+
+def _gaussian_matrix(centers_m: np.ndarray, bandwidth_m: float) -> np.ndarray:
+    """Kernel weights between every pair of cell centers along one axis."""
+    offsets = (centers_m[:, None] - centers_m[None, :]) / bandwidth_m
+    return np.exp(-0.5 * offsets * offsets)
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """
+    Encode an RGBA image as PNG with the standard library only.
+
+    Args:
+        rgba: (height, width, 4) uint8 array
+
+    Returns:
+        bytes: The PNG file
+    """
+    height, width = rgba.shape[:2]
+    # Every scanline starts with filter type 0 (none)
+    scanlines = np.concatenate(
+        (np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)), axis=1
+    )
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)),
+        chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 9)),
+        chunk(b"IEND", b""),
+    ))
+
+
+class HeatmapRaster:
+    """
+    Kernel density rasters of one snapshot. Row 0 is the northern edge.
+
+    Attributes:
+        bounds: (south, west, north, east) of the grid
+        cell_m: Approximate side of a cell in meters
+        bandwidth_m: Standard deviation of the Gaussian kernel in meters
+        bikes: Available bikes per km², shape (rows, cols)
+        docks: Free docks per km², shape (rows, cols)
+        availability: Share of bikes in bikes + docks (0..1), NaN where
+            there is no service
+        stations: Number of stations that contributed
+    """
+
+    def __init__(self, bounds, cell_m: float, bandwidth_m: float,
+                 bikes: np.ndarray, docks: np.ndarray, availability: np.ndarray, stations: int):
+        self.bounds = bounds
+        self.cell_m = cell_m
+        self.bandwidth_m = bandwidth_m
+        self.bikes = bikes
+        self.docks = docks
+        self.availability = availability
+        self.stations = stations
+        self._png: Dict[str, bytes] = {}
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.bikes.shape
+
+    def layer(self, name: str) -> np.ndarray:
+        """
+        Return one layer by name.
+
+        Raises:
+            ValueError: If the layer is not one of HEATMAP_LAYERS
+        """
+        if name not in HEATMAP_LAYERS:
+            raise ValueError(f"Unknown layer '{name}'. Available: {', '.join(HEATMAP_LAYERS)}")
+        return getattr(self, name)
+
+    def cell_centers(self, rows: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Latitude and longitude of the centers of the given cells."""
+        south, west, north, east = self.bounds
+        height, width = self.shape
+        lats = north - (np.asarray(rows) + 0.5) * (north - south) / height
+        lons = west + (np.asarray(cols) + 0.5) * (east - west) / width
+        return lats, lons
+
+    def normalized(self, name: str) -> np.ndarray:
+        """Layer scaled to 0..1 (densities by their 99th percentile), NaN where empty."""
+        values = self.layer(name)
+        if name == "availability":
+            return values
+        served = values[~np.isnan(self.availability)]
+        scale = float(np.percentile(served, 99)) if served.size else 0.0
+        if scale <= 0:
+            return np.full(values.shape, np.nan)
+        return np.where(np.isnan(self.availability), np.nan, np.clip(values / scale, 0.0, 1.0))
+
+    def png(self, name: str = "availability") -> bytes:
+        """
+        Render a layer as a translucent RGBA PNG, computed once per layer.
+
+        Args:
+            name: One of HEATMAP_LAYERS
+
+        Returns:
+            bytes: PNG to overlay on `bounds`
+        """
+        if name not in self._png:
+            values = self.normalized(name)
+            empty = np.isnan(values)
+            filled = np.where(empty, 0.0, values)
+            rgba = np.empty(values.shape + (4,), dtype=np.uint8)
+            for channel in range(3):
+                rgba[..., channel] = np.interp(filled, _RAMP_STOPS, _RAMP_COLORS[:, channel]).round()
+            rgba[..., 3] = np.where(empty, 0, _OVERLAY_ALPHA)
+            self._png[name] = encode_png(rgba)
+        return self._png[name]
+
+    def downsample(self, name: str, max_side: int) -> np.ndarray:
+        """
+        Average a layer over blocks so that no side exceeds max_side cells.
+
+        Args:
+            name: One of HEATMAP_LAYERS
+            max_side: Maximum number of rows and columns of the result
+
+        Returns:
+            np.ndarray: Block means, NaN where a block has no service
+        """
+        values = np.where(np.isnan(self.availability), np.nan, self.layer(name))
+        height, width = values.shape
+        factor = max(1, math.ceil(max(height, width) / max_side))
+        padded = np.full((math.ceil(height / factor) * factor, math.ceil(width / factor) * factor), np.nan)
+        padded[:height, :width] = values
+        blocks = padded.reshape(padded.shape[0] // factor, factor, padded.shape[1] // factor, factor)
+        counts = (~np.isnan(blocks)).sum(axis=(1, 3))
+        sums = np.nansum(blocks, axis=(1, 3))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+    def scarce_cells(self, count: int, min_distance_m: float = 1000.0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pick the well served cells with the lowest availability, spread apart.
+
+        Args:
+            count: Maximum number of cells
+            min_distance_m: Minimum distance between two picked cells
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Rows and columns of the picked cells
+        """
+        core = (self.bikes + self.docks) >= _capacity_threshold(self.bandwidth_m, _SCARCE_BANDWIDTHS)
+        served = np.flatnonzero((~np.isnan(self.availability) & core).ravel())
+        order = served[np.argsort(self.availability.ravel()[served], kind="stable")]
+        rows, cols = np.divmod(order, self.shape[1])
+        min_cells = min_distance_m / self.cell_m
+        picked = []
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            if all((row - r) ** 2 + (col - c) ** 2 >= min_cells ** 2 for r, c in picked):
+                picked.append((row, col))
+                if len(picked) == count:
+                    break
+        picked = np.array(picked, dtype=np.int64).reshape(-1, 2)
+        return picked[:, 0], picked[:, 1]
+
+
+def build_heatmap(store, bounds=MADRID_BOUNDS, cell_m: float = DEFAULT_CELL_M,
+                  bandwidth_m: float = DEFAULT_BANDWIDTH_M) -> HeatmapRaster:
+    """
+    Compute the bike, dock and availability rasters of a snapshot.
+
+    Args:
+        store: StationStore of the snapshot
+        bounds: (south, west, north, east) of the grid
+        cell_m: Side of a cell in meters
+        bandwidth_m: Standard deviation of the Gaussian kernel in meters
+
+    Returns:
+        HeatmapRaster: The rasters
+    """
+    south, west, north, east = bounds
+    m_per_deg_lon = M_PER_DEG_LAT * math.cos(math.radians((south + north) / 2.0))
+    height = max(1, math.ceil((north - south) * M_PER_DEG_LAT / cell_m))
+    width = max(1, math.ceil((east - west) * m_per_deg_lon / cell_m))
+
+    # Active stations inside the grid
+    lats, lons = store.lats, store.lons
+    inside = (
+        store.has_coordinates() & (store.activate == 1) & (store.no_available == 0)
+        & (lats >= south) & (lats < north) & (lons >= west) & (lons < east)
+    )
+    rows = ((north - lats[inside]) / (north - south) * height).astype(np.int64).clip(0, height - 1)
+    cols = ((lons[inside] - west) / (east - west) * width).astype(np.int64).clip(0, width - 1)
+    cells = rows * width + cols
+
+    def binned(weights: np.ndarray) -> np.ndarray:
+        return np.bincount(cells, weights=weights.astype(np.float64), minlength=height * width).reshape(height, width)
+
+    # Separable Gaussian smoothing: K_rows @ binned @ K_cols.T
+    row_kernel = _gaussian_matrix((np.arange(height) + 0.5) * (north - south) * M_PER_DEG_LAT / height, bandwidth_m)
+    col_kernel = _gaussian_matrix((np.arange(width) + 0.5) * (east - west) * m_per_deg_lon / width, bandwidth_m)
+    per_km2 = 1e6 / (2.0 * math.pi * bandwidth_m * bandwidth_m)
+
+    bikes = row_kernel @ binned(store.dock_bikes[inside]) @ col_kernel.T * per_km2
+    docks = row_kernel @ binned(store.free_bases[inside]) @ col_kernel.T * per_km2
+    capacity = bikes + docks
+
+    # Served cells: enough docks (free or holding a bike) within reach
+    threshold = _capacity_threshold(bandwidth_m, _SERVICE_BANDWIDTHS)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        availability = np.where(capacity >= threshold, bikes / capacity, np.nan)
+
+    return HeatmapRaster(
+        bounds, cell_m, bandwidth_m,
+        bikes.astype(np.float32), docks.astype(np.float32), availability.astype(np.float32),
+        stations=int(inside.sum()),
+    )
+
+
+# Rasters of the last station store, rebuilt only when the stations change
+_heatmap_cache = {
+    "store": None,
+    "rasters": {}
+}
+_heatmap_lock = threading.Lock()
+
+
+def get_heatmap(snapshot, cell_m: float = DEFAULT_CELL_M,
+                bandwidth_m: float = DEFAULT_BANDWIDTH_M) -> HeatmapRaster:
+    """
+    Return the heatmap of a station snapshot, building it once per snapshot.
+
+    Also usable as a StationSnapshotCache listener to precompute the
+    default raster as soon as a snapshot arrives.
+
+    Args:
+        snapshot: StationSnapshot from the station cache
+        cell_m: Side of a cell in meters
+        bandwidth_m: Standard deviation of the Gaussian kernel in meters
+
+    Returns:
+        HeatmapRaster: Rasters over MADRID_BOUNDS
+    """
+    key = (float(cell_m), float(bandwidth_m))
+    with _heatmap_lock:
+        if _heatmap_cache["store"] is not snapshot.store:
+            _heatmap_cache["store"] = snapshot.store
+            _heatmap_cache["rasters"] = {}
+        raster: Optional[HeatmapRaster] = _heatmap_cache["rasters"].get(key)
+        if raster is None:
+            raster = build_heatmap(snapshot.store, cell_m=cell_m, bandwidth_m=bandwidth_m)
+            _heatmap_cache["rasters"][key] = raster
+        return raster
+
+
+def write_heatmap_png(raster: HeatmapRaster, key: str, layer: str, output_dir: str) -> str:
+    """
+    Write a layer as PNG, named after `key` so an unchanged snapshot reuses the file.
+
+    Args:
+        raster: Rasters of the snapshot
+        key: Content address of the snapshot (e.g. StationStore.digest())
+        layer: One of HEATMAP_LAYERS
+        output_dir: Directory of the PNG files
+
+    Returns:
+        str: Path of the PNG file
+    """
+    name = f"{raster.bounds}|{raster.cell_m}|{raster.bandwidth_m}|{key}".encode("utf-8")
+    digest = hashlib.blake2b(name, digest_size=12).hexdigest()
+    path = os.path.join(output_dir, f"{_PNG_PREFIX}{digest}_{layer}.png")
+    try:
+        # Mark as recently used for the eviction order
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(output_dir, exist_ok=True)
+    file = tempfile.NamedTemporaryFile(dir=output_dir, prefix=PARTIAL_PREFIX, suffix=".png", delete=False)
+    try:
+        with file:
+            file.write(raster.png(layer))
+        os.replace(file.name, path)
+    except BaseException:
+        if os.path.exists(file.name):
+            os.remove(file.name)
+        raise
+    evict_pages(output_dir, max_files=_MAX_PNG_FILES, keep=path, prefix=_PNG_PREFIX, suffix=".png")
+    return path
@@ -0,0 +1,300 @@
+"""Tiered retention rollups of the BiciMAD occupancy history.
+
+Raw per-poll records grow without limit, and a month-long trend question
+should not have to read all of them. The compaction job downsamples the raw
+history into two rollup tiers stored with the same append-only layout:
+
+    raw    one record per station and poll       (kept 14 days)
+    15min  one record per station and 15 minutes (kept 180 days)
+    1h     one record per station and hour       (kept 5 years)
+
+Each rollup record holds the number of samples, mean/min/max bikes and how
+many samples found the station empty (no bikes) or full (no free docks).
+Queries read the coarsest tier whose resolution divides the requested bucket
+width, and fill the not-yet-compacted tail from the raw records.
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from .history_store import HistoryStore
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_DTYPE = np.dtype([
+    ("ts", "<u4"),
+    ("station_id", "<u4"),
+    ("samples", "<u4"),
+    ("empty", "<u4"),
+    ("full", "<u4"),
+    ("min_bikes", "<i2"),
+    ("max_bikes", "<i2"),
+    ("mean_bikes", "<f4"),
+])
+
+# (tier name, bucket width in seconds), finest first
+ROLLUP_TIERS = (("15min", 900), ("1h", 3600))
+
+DEFAULT_RETENTION_DAYS = {"raw": 14, "15min": 180, "1h": 1825}
+
+_DAY = 86400
+
+
+def _group(ts: np.ndarray, station_ids: np.ndarray, bucket_seconds: int):
+    """
+    Sort rows by (bucket, station) and find the group boundaries.
+
+    Returns:
+        tuple: (sort order, group starts, group keys)
+    """
+    buckets = (ts.astype(np.uint64) // bucket_seconds) * bucket_seconds
+    keys = (buckets << np.uint64(32)) | station_ids.astype(np.uint64)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    return order, starts, sorted_keys[starts]
+
+
+def _from_groups(keys: np.ndarray) -> np.ndarray:
+    rollups = np.zeros(len(keys), dtype=ROLLUP_DTYPE)
+    rollups["ts"] = keys >> np.uint64(32)
+    rollups["station_id"] = keys & np.uint64(0xFFFFFFFF)
+    return rollups
+
+
+def rollup_raw(records: np.ndarray, bucket_seconds: int) -> np.ndarray:
+    """
+    Aggregate raw records into per-station buckets.
+
+    Args:
+        records: Records of RECORD_DTYPE
+        bucket_seconds: Bucket width in seconds
+
+    Returns:
+        np.ndarray: ROLLUP_DTYPE rows sorted by (bucket, station)
+    """
+    if len(records) == 0:
+        return np.empty(0, dtype=ROLLUP_DTYPE)
+    order, starts, keys = _group(records["ts"], records["station_id"], bucket_seconds)
+    bikes = records["dock_bikes"][order]
+    docks = records["free_bases"][order]
+
+    rollups = _from_groups(keys)
+    rollups["samples"] = np.diff(np.r_[starts, len(order)])
+    rollups["empty"] = np.add.reduceat((bikes == 0).astype(np.uint32), starts)
+    rollups["full"] = np.add.reduceat((docks == 0).astype(np.uint32), starts)
+    rollups["min_bikes"] = np.minimum.reduceat(bikes, starts)
+    rollups["max_bikes"] = np.maximum.reduceat(bikes, starts)
+    rollups["mean_bikes"] = np.add.reduceat(bikes.astype(np.float64), starts) / rollups["samples"]
+    return rollups
+
+
+def merge_rollups(rows: np.ndarray, bucket_seconds: int) -> np.ndarray:
+    """
+    Re-aggregate rollup rows into wider buckets (sample-weighted).
+
+    Args:
+        rows: ROLLUP_DTYPE rows
+        bucket_seconds: New bucket width, a multiple of the rows' width
+
+    Returns:
+        np.ndarray: ROLLUP_DTYPE rows sorted by (bucket, station)
+    """
+    if len(rows) == 0:
+        return np.empty(0, dtype=ROLLUP_DTYPE)
+    order, starts, keys = _group(rows["ts"], rows["station_id"], bucket_seconds)
+    rows = rows[order]
+    samples = rows["samples"].astype(np.float64)
+
+    merged = _from_groups(keys)
+    merged["samples"] = np.add.reduceat(rows["samples"], starts)
+    merged["empty"] = np.add.reduceat(rows["empty"], starts)
+    merged["full"] = np.add.reduceat(rows["full"], starts)
+    merged["min_bikes"] = np.minimum.reduceat(rows["min_bikes"], starts)
+    merged["max_bikes"] = np.maximum.reduceat(rows["max_bikes"], starts)
+    merged["mean_bikes"] = (
+        np.add.reduceat(rows["mean_bikes"] * samples, starts) / merged["samples"]
+    )
+    return merged
+
+
+def _append_by_bucket(store: HistoryStore, rollups: np.ndarray) -> None:
+    """Append rollup rows, one index entry per bucket."""
+    if len(rollups) == 0:
+        return
+    bounds = np.flatnonzero(np.r_[True, rollups["ts"][1:] != rollups["ts"][:-1], True])
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        store.append(int(rollups["ts"][start]), rollups[start:end])
+
+
+class TieredHistory:
+    """
+    Raw history plus its 15-minute and hourly rollup tiers.
+    """
+
+    def __init__(self, raw: HistoryStore, retention_days: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            raw: The raw HistoryStore fed with every snapshot
+            retention_days: Days kept per tier (defaults to DEFAULT_RETENTION_DAYS)
+        """
+        self.raw = raw
+        self.tiers = {
+            name: HistoryStore(raw.root, name, ROLLUP_DTYPE) for name, _ in ROLLUP_TIERS
+        }
+        self.retention_days = dict(DEFAULT_RETENTION_DAYS, **(retention_days or {}))
+        self._lock = threading.Lock()
+        self._last_compaction = 0.0
+        self._running = False
+
+    def _source_of(self, tier_index: int) -> Tuple[HistoryStore, int]:
+        """Store and resolution a tier is computed from."""
+        if tier_index == 0:
+            return self.raw, 0
+        name, seconds = ROLLUP_TIERS[tier_index - 1]
+        return self.tiers[name], seconds
+
+    def compact(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        Roll complete buckets up into every tier, then apply retention.
+
+        Safe to call repeatedly: each tier resumes after its last bucket.
+
+        Args:
+            now: Current epoch time (defaults to time.time())
+
+        Returns:
+            Dict[str, int]: Rollup rows written per tier
+        """
+        now = time.time() if now is None else now
+        written = {}
+        with self._lock:
+            for tier_index, (name, bucket) in enumerate(ROLLUP_TIERS):
+                target = self.tiers[name]
+                source, source_bucket = self._source_of(tier_index)
+                source_range = source.time_range()
+                if source_range is None:
+                    written[name] = 0
+                    continue
+
+                target_range = target.time_range()
+                start = target_range[1] + bucket if target_range else (source_range[0] // bucket) * bucket
+                # Only complete buckets: the source must have moved past their end
+                source_end = now if source_bucket == 0 else source_range[1] + source_bucket
+                end = (int(source_end) // bucket) * bucket
+
+                count = 0
+                # One day at a time keeps memory bounded on a first large compaction
+                for chunk_start in range(int(start), int(end), _DAY):
+                    chunk_end = min(chunk_start + _DAY, end)
+                    rows = source.query(chunk_start, chunk_end - 1)
+                    if source_bucket == 0:
+                        rollups = rollup_raw(rows, bucket)
+                    else:
+                        rollups = merge_rollups(rows, bucket)
+                    _append_by_bucket(target, rollups)
+                    count += len(rollups)
+                written[name] = count
+
+            self.apply_retention(now)
+            self._last_compaction = now
+        logger.info("Compacted BiciMAD history: %s", written)
+        return written
+
+    def apply_retention(self, now: Optional[float] = None) -> None:
+        """Delete the partitions older than each tier's retention period."""
+        now = time.time() if now is None else now
+        for name, store in [("raw", self.raw)] + list(self.tiers.items()):
+            store.delete_before(now - self.retention_days[name] * _DAY)
+
+    def maybe_compact_in_background(self, *_args, min_interval: float = 900.0) -> None:
+        """
+        Start a background compaction if none ran in the last `min_interval` seconds.
+
+        Accepts (and ignores) positional arguments so it can be registered
+        directly as a StationSnapshotCache listener.
+        """
+        if self._running or time.time() - self._last_compaction < min_interval:
+            return
+        self._running = True
+
+        def run():
+            try:
+                self.compact()
+            except Exception as err:
+                logger.warning("BiciMAD history compaction failed: %s", str(err))
+            finally:
+                self._running = False
+
+        threading.Thread(target=run, name="bicimad-history-compaction", daemon=True).start()
+
+    def query(self, station_id: Optional[int], start: float, end: float,
+              bucket_seconds: int) -> Tuple[np.ndarray, str]:
+        """
+        Read a station's history aggregated in buckets, from the cheapest tier.
+
+        Picks the coarsest tier whose resolution divides `bucket_seconds`;
+        the part of the range not compacted yet is aggregated from the raw
+        records.
+
+        Args:
+            station_id: Station id, or None for every station
+            start: Epoch seconds, inclusive
+            end: Epoch seconds, inclusive
+            bucket_seconds: Width of the returned buckets
+
+        Returns:
+            Tuple[np.ndarray, str]: ROLLUP_DTYPE rows sorted by (bucket, station), and the
+            name of the tier that served the bulk of the range
+        """
+        for name, resolution in reversed(ROLLUP_TIERS):
+            if bucket_seconds % resolution:
+                continue
+            store = self.tiers[name]
+            tier_range = store.time_range()
+            if tier_range is None or tier_range[1] + resolution <= start:
+                continue
+            # Align the range to the tier's buckets so no bucket is half counted
+            aligned_start = (int(start) // resolution) * resolution
+            rows = store.query(aligned_start, end, station_id=station_id)
+            tail_start = tier_range[1] + resolution
+            if tail_start <= end:
+                tail = self.raw.query(max(tail_start, start), end, station_id=station_id)
+                rows = np.concatenate([rows, rollup_raw(tail, resolution)])
+            return merge_rollups(rows, bucket_seconds), name
+
+        raw = self.raw.query(start, end, station_id=station_id)
+        return rollup_raw(raw, bucket_seconds), "raw"
+
+
+def rollup_summary(rows: np.ndarray, bucket_seconds: int) -> list:
+    """
+    Describe rollup rows for a tool response.
+
+    Args:
+        rows: ROLLUP_DTYPE rows of one station
+        bucket_seconds: Width of the buckets
+
+    Returns:
+        list: One dict per bucket with bikes statistics and minutes empty/full
+    """
+    samples = np.maximum(rows["samples"], 1).astype(np.float64)
+    empty_ratio = rows["empty"] / samples
+    full_ratio = rows["full"] / samples
+    return [
+        {
+            "start": int(row["ts"]),
+            "mean_bikes": round(float(row["mean_bikes"]), 1),
+            "min_bikes": int(row["min_bikes"]),
+            "max_bikes": int(row["max_bikes"]),
+            "empty_pct": round(float(empty) * 100),
+            "full_pct": round(float(full) * 100),
+            "empty_minutes": round(float(empty) * bucket_seconds / 60),
+            "full_minutes": round(float(full) * bucket_seconds / 60),
+        }
+        for row, empty, full in zip(rows, empty_ratio, full_ratio)
+    ]
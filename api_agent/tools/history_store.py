@@ -0,0 +1,309 @@
+"""Persistent, append-only occupancy history of the BiciMAD stations.
+
+Every station snapshot is appended to disk as fixed-width binary records
+(one per station) so weeks of history survive process restarts:
+
+    <history_dir>/raw/YYYYMMDD.bin   records of one UTC day, in time order
+    <history_dir>/raw/YYYYMMDD.idx   one index entry per appended snapshot
+
+Record layout (16 bytes, little-endian): timestamp u4, station_id u4,
+dock_bikes i2, free_bases i2, total_bases i2, activate i1, padding.
+Index layout (16 bytes): timestamp u4, count u4, first record u8.
+
+Reads memory-map the partition files and view them as NumPy structured
+arrays: a time range query is a binary search in the index followed by a
+slice of the records, with no parsing at all. Only records covered by an
+index entry are ever read; records left behind by a crash between the two
+writes are cut off by the next append.
+"""
+
+import logging
+import mmap
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RECORD_DTYPE = np.dtype([
+    ("ts", "<u4"),
+    ("station_id", "<u4"),
+    ("dock_bikes", "<i2"),
+    ("free_bases", "<i2"),
+    ("total_bases", "<i2"),
+    ("activate", "i1"),
+    ("pad", "i1"),
+])
+
+INDEX_DTYPE = np.dtype([
+    ("ts", "<u4"),
+    ("count", "<u4"),
+    ("first", "<u8"),
+])
+
+DEFAULT_HISTORY_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bicimad", "history")
+
+
+def partition_key(ts: float) -> str:
+    """Name of the UTC-day partition holding a timestamp."""
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y%m%d")
+
+
+def partition_keys(start: float, end: float) -> List[str]:
+    """Names of the UTC-day partitions overlapping [start, end]."""
+    day = datetime.fromtimestamp(start, tz=timezone.utc).date()
+    last = datetime.fromtimestamp(end, tz=timezone.utc).date()
+    keys = []
+    while day <= last:
+        keys.append(day.strftime("%Y%m%d"))
+        day += timedelta(days=1)
+    return keys
+
+
+def _map_array(path: str, dtype: np.dtype) -> Tuple[Optional[mmap.mmap], np.ndarray]:
+    """
+    Memory-map a file as an array of complete records.
+
+    A trailing partial record (e.g. after a crash mid-write) is ignored.
+
+    Returns:
+        tuple: (mmap object or None, read-only array view)
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return None, np.empty(0, dtype=dtype)
+    count = size // dtype.itemsize
+    if count == 0:
+        return None, np.empty(0, dtype=dtype)
+    with open(path, "rb") as handle:
+        mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    return mapped, np.frombuffer(mapped, dtype=dtype, count=count)
+
+
+class HistoryStore:
+    """
+    Append-only, time-partitioned store of per-station occupancy records.
+    """
+
+    def __init__(self, root: str = DEFAULT_HISTORY_DIR, tier: str = "raw",
+                 dtype: np.dtype = RECORD_DTYPE):
+        """
+        Args:
+            root: Base directory of the history
+            tier: Sub-directory holding this store's partitions
+            dtype: Fixed-width record type; must have a leading "ts" u4 field
+        """
+        self.root = root
+        self.tier = tier
+        self.dtype = dtype
+        self.directory = os.path.join(root, tier)
+        self._lock = threading.Lock()
+        self._last_ts = 0
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def partitions(self) -> List[str]:
+        """Names of the existing partitions, oldest first."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted(name[:-4] for name in names if name.endswith(".bin"))
+
+    def _indexed_end(self, key: str) -> int:
+        """
+        Records of a partition covered by its index, dropping a torn index entry.
+
+        Returns:
+            int: First record after the last indexed block
+        """
+        index_path = self._path(key, "idx")
+        try:
+            size = os.path.getsize(index_path)
+        except OSError:
+            return 0
+        complete = size - size % INDEX_DTYPE.itemsize
+        if complete != size:
+            os.truncate(index_path, complete)
+        if complete == 0:
+            return 0
+        with open(index_path, "rb") as handle:
+            handle.seek(complete - INDEX_DTYPE.itemsize)
+            last = np.frombuffer(handle.read(INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)[0]
+        return int(last["first"]) + int(last["count"])
+
+    def append(self, ts: float, records: np.ndarray, newer_only: bool = False) -> bool:
+        """
+        Append a block of records sharing a timestamp.
+
+        Args:
+            ts: Epoch seconds of the block
+            records: Array of the store's record type
+            newer_only: Skip the block unless it is newer than the last one
+                appended by this store
+
+        Returns:
+            bool: Whether the block was written
+        """
+        if len(records) == 0:
+            return False
+        key = partition_key(ts)
+        itemsize = self.dtype.itemsize
+        with self._lock:
+            if newer_only and int(ts) <= self._last_ts:
+                return False
+            os.makedirs(self.directory, exist_ok=True)
+            # Start after the last indexed block, dropping records a crash left
+            # without an index entry (and any torn write)
+            first = self._indexed_end(key)
+            with open(self._path(key, "bin"), "ab") as handle:
+                if handle.tell() != first * itemsize:
+                    handle.truncate(first * itemsize)
+                    handle.seek(first * itemsize)
+                handle.write(records.astype(self.dtype, copy=False).tobytes())
+
+            # The index entry is written last: a block is visible only once complete
+            entry = np.array([(int(ts), len(records), first)], dtype=INDEX_DTYPE)
+            with open(self._path(key, "idx"), "ab") as handle:
+                handle.write(entry.tobytes())
+            self._last_ts = int(ts)
+        return True
+
+    def append_snapshot(self, snapshot) -> None:
+        """
+        Append one record per station of a StationSnapshot.
+
+        Suitable as a StationSnapshotCache listener.
+
+        Args:
+            snapshot: The snapshot to persist
+        """
+        ts = int(snapshot.fetched_at)
+        if ts <= self._last_ts:
+            # Cheap early exit; append() checks again under the lock
+            return
+        store = snapshot.store
+        valid = store.ids >= 0
+        # Sorted by station id so each block can be binary-searched
+        order = np.argsort(store.ids[valid], kind="stable")
+        rows = np.flatnonzero(valid)[order]
+
+        records = np.zeros(len(rows), dtype=RECORD_DTYPE)
+        records["ts"] = ts
+        records["station_id"] = store.ids[rows]
+        records["dock_bikes"] = store.dock_bikes[rows]
+        records["free_bases"] = store.free_bases[rows]
+        records["total_bases"] = store.total_bases[rows]
+        records["activate"] = store.activate[rows]
+        self.append(ts, records, newer_only=True)
+
+    def _blocks(self, key: str, start: float, end: float,
+                station_id: Optional[int] = None) -> Iterator[np.ndarray]:
+        """Yield copies of the records of one partition within [start, end]."""
+        index_map, index = _map_array(self._path(key, "idx"), INDEX_DTYPE)
+        data_map, data = _map_array(self._path(key, "bin"), self.dtype)
+        try:
+            if len(index) == 0 or len(data) == 0:
+                return
+            lo = int(np.searchsorted(index["ts"], start, side="left"))
+            hi = int(np.searchsorted(index["ts"], end, side="right"))
+            if lo >= hi:
+                return
+            starts = index["first"][lo:hi].astype(np.int64)
+            stops = np.minimum(starts + index["count"][lo:hi], len(data))
+            if np.array_equal(starts[1:], stops[:-1]):
+                # Contiguous blocks (the normal case): one slice of the mapping
+                view = data[starts[0]:stops[-1]]
+            else:
+                # Gaps of unindexed records: gather only the indexed blocks
+                view = data[np.concatenate([np.arange(a, b) for a, b in zip(starts, stops)])]
+            if station_id is not None:
+                # Filter on the mapped pages; only the matches are copied
+                yield view[view["station_id"] == station_id]
+            else:
+                yield view.copy()
+            del view
+        finally:
+            del index, data
+            for mapped in (index_map, data_map):
+                if mapped is not None:
+                    mapped.close()
+
+    def query(self, start: float, end: float, station_id: Optional[int] = None) -> np.ndarray:
+        """
+        Read the records between two timestamps.
+
+        Args:
+            start: Epoch seconds, inclusive
+            end: Epoch seconds, inclusive
+            station_id: Only return records of this station
+
+        Returns:
+            np.ndarray: Records of the store's record type in time order
+        """
+        chunks = []
+        existing = set(self.partitions())
+        for key in partition_keys(start, end):
+            if key not in existing:
+                continue
+            chunks.extend(self._blocks(key, start, end, station_id))
+        if not chunks:
+            return np.empty(0, dtype=self.dtype)
+        return np.concatenate(chunks)
+
+    def time_range(self) -> Optional[Tuple[int, int]]:
+        """First and last timestamps stored, or None if the store is empty."""
+        partitions = self.partitions()
+        if not partitions:
+            return None
+        bounds = []
+        for key, position in ((partitions[0], 0), (partitions[-1], -1)):
+            mapped, index = _map_array(self._path(key, "idx"), INDEX_DTYPE)
+            if len(index):
+                bounds.append(int(index["ts"][position]))
+            del index
+            if mapped is not None:
+                mapped.close()
+        return (bounds[0], bounds[1]) if len(bounds) == 2 else None
+
+    def disk_usage(self) -> int:
+        """Bytes used by the partition files."""
+        total = 0
+        for key in self.partitions():
+            for extension in ("bin", "idx"):
+                try:
+                    total += os.path.getsize(self._path(key, extension))
+                except OSError:
+                    pass
+        return total
+
+    def delete_before(self, cutoff: float) -> List[str]:
+        """
+        Delete the partitions whose whole UTC day is older than `cutoff`.
+
+        Args:
+            cutoff: Epoch seconds; data older than this may be removed
+
+        Returns:
+            List[str]: Names of the deleted partitions
+        """
+        cutoff_key = partition_key(cutoff)
+        deleted = []
+        with self._lock:
+            for key in self.partitions():
+                if key >= cutoff_key:
+                    break
+                for extension in ("bin", "idx"):
+                    try:
+                        os.remove(self._path(key, extension))
+                    except OSError:
+                        pass
+                deleted.append(key)
+        if deleted:
+            logger.info("Deleted %d expired %s history partitions", len(deleted), self.tier)
+        return deleted
@@ -0,0 +1,297 @@
+"""Local HTTP server for a live BiciMAD station map.
+
+Writing a new HTML file for every "show me the map" request leaves stale
+files behind and the page is out of date as soon as it is written. The
+MapServer is started once per process on 127.0.0.1 and serves:
+
+    /                   the map page, rendered from the current snapshot
+    /assets/<name>      the content-hashed CSS/JS of the page
+    /events?since=<v>   Server-Sent Events with snapshot deltas
+
+Every new snapshot of the station cache is diffed against the previously
+published one and turned into a single "delta" event (changed and added
+stations as page rows, removed station ids), encoded once and pushed to all
+open pages. An open page therefore only ever downloads the deltas; a page
+that fell too far behind the retained events is told to reload.
+"""
+
+import contextlib
+import http.server
+import io
+import json
+import logging
+import threading
+import urllib.parse
+from collections import deque
+from typing import Iterator, Optional
+
+import numpy as np
+
+from .station_delta import diff_snapshots
+from .station_map import asset, station_rows, write_station_map
+
+logger = logging.getLogger(__name__)
+
+# Seconds between keep-alive comments on an idle event stream
+_KEEPALIVE_SECONDS = 15.0
+
+
+class _MapHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, map_server: "MapServer"):
+        self.map_server = map_server
+        super().__init__(address, _MapRequestHandler)
+
+
+class _MapRequestHandler(http.server.BaseHTTPRequestHandler):
+    server_version = "BicimadMap/1.0"
+
+    def log_message(self, format, *args):  # noqa: A002 - BaseHTTPRequestHandler signature
+        logger.debug("Map server: " + format, *args)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        map_server = self.server.map_server
+        try:
+            if url.path in ("/", "/index.html"):
+                self._send_page(map_server)
+            elif url.path.startswith("/assets/"):
+                self._send_asset(url.path.lstrip("/"))
+            elif url.path == "/events":
+                since = urllib.parse.parse_qs(url.query).get("since", [None])[0]
+                self._send_events(map_server, self.headers.get("Last-Event-ID") or since)
+            else:
+                self.send_error(404)
+        except (BrokenPipeError, ConnectionResetError):
+            # The browser closed the tab or navigated away
+            pass
+
+    def _send_page(self, map_server: "MapServer") -> None:
+        snapshot = map_server.current()
+        if snapshot is None:
+            self.send_error(503, "No station snapshot available yet")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        # Streamed straight into the socket; the page is never held in memory whole
+        stream = io.TextIOWrapper(self.wfile, encoding="utf-8", newline="")
+        write_station_map(stream, snapshot.store, {"version": snapshot.version, "events": "/events"})
+        stream.flush()
+        stream.detach()
+        map_server._stats["pages"] += 1
+
+    def _send_asset(self, relative_path: str) -> None:
+        content = asset(relative_path)
+        if content is None:
+            self.send_error(404)
+            return
+        content_type = "text/css" if relative_path.endswith(".css") else "text/javascript"
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        # Names carry a content hash, so they never change
+        self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_events(self, map_server: "MapServer", since: Optional[str]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(b"retry: 5000\n\n")
+        self.wfile.flush()
+
+        version = int(since) if since and since.isdigit() else None
+        with map_server.client():
+            while map_server.is_running():
+                events, version = map_server.events_after(version, timeout=_KEEPALIVE_SECONDS)
+                self.wfile.write(b"".join(events) if events else b": keep-alive\n\n")
+                self.wfile.flush()
+
+
+class MapServer:
+    """
+    Local HTTP server pushing station snapshot deltas to open map pages.
+
+    Attributes:
+        host: Interface the server listens on
+        port: Port it listens on (chosen by the OS when 0 was requested)
+    """
+
+    def __init__(self, cache, host: str = "127.0.0.1", port: int = 0,
+                 max_events: int = 64, refresh_interval: Optional[float] = None):
+        """
+        Args:
+            cache: StationSnapshotCache whose snapshots are published
+            host: Interface to listen on (keep it local)
+            port: Port to listen on, 0 for any free port
+            max_events: Deltas retained for pages reconnecting after a gap
+            refresh_interval: Seconds between snapshot refreshes while a page
+                is open (the cache TTL if None)
+        """
+        self.cache = cache
+        self.host = host
+        self.port = port
+        self.refresh_interval = refresh_interval or cache.ttl
+        self._events: "deque[tuple]" = deque(maxlen=max_events)
+        self._published = None
+        self._clients = 0
+        self._changed = threading.Condition()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._httpd: Optional[_MapHTTPServer] = None
+        self._stats = {"pages": 0, "events": 0, "event_bytes": 0}
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/"
+
+    def is_running(self) -> bool:
+        return self._httpd is not None and not self._stop.is_set()
+
+    def start(self) -> "MapServer":
+        """
+        Start serving and publishing snapshots, unless already started.
+
+        Returns:
+            MapServer: self, for chaining
+        """
+        with self._start_lock:
+            if self.is_running():
+                return self
+            self._stop.clear()
+            self._httpd = _MapHTTPServer((self.host, self.port), self)
+            self.port = self._httpd.server_address[1]
+            threading.Thread(target=self._httpd.serve_forever, name="bicimad-map-server",
+                             daemon=True).start()
+            threading.Thread(target=self._refresh_while_watched, name="bicimad-map-refresh",
+                             daemon=True).start()
+            self.cache.subscribe(self.publish)
+            snapshot = self.cache.peek()
+            if snapshot is not None:
+                self.publish(snapshot)
+        logger.info("Live BiciMAD map served at %s", self.url)
+        return self
+
+    def stop(self) -> None:
+        """Stop the server; open event streams end within the keep-alive interval."""
+        with self._start_lock:
+            if self._httpd is None:
+                return
+            self._stop.set()
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+        with self._changed:
+            self._changed.notify_all()
+
+    def current(self):
+        """The last published snapshot (what a newly loaded page shows)."""
+        return self._published
+
+    def client_count(self) -> int:
+        """Number of pages currently listening for updates."""
+        return self._clients
+
+    @contextlib.contextmanager
+    def client(self) -> Iterator[None]:
+        """Context manager counting an open event stream."""
+        with self._changed:
+            self._clients += 1
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._clients -= 1
+
+    def publish(self, snapshot) -> None:
+        """
+        Publish a new snapshot: encode its delta once and wake the open pages.
+
+        Snapshots identical to the published one (same columns or no changed
+        station) produce no event and are not published.
+
+        Args:
+            snapshot: StationSnapshot from the cache
+        """
+        with self._changed:
+            previous = self._published
+            if previous is not None and snapshot.version <= previous.version:
+                return
+            if previous is None:
+                self._published = snapshot
+                return
+            delta = diff_snapshots(previous, snapshot)
+            if not (len(delta.changed_new) or len(delta.added) or len(delta.removed)):
+                return
+            payload = {
+                "version": snapshot.version,
+                "from_version": previous.version,
+                "stations": station_rows(
+                    snapshot.store, np.concatenate((delta.changed_new, delta.added))
+                ),
+                "removed": previous.store.ids[delta.removed].tolist(),
+            }
+            data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+            event = f"id: {snapshot.version}\nevent: delta\ndata: {data}\n\n".encode("utf-8")
+            self._events.append((previous.version, snapshot.version, event))
+            self._published = snapshot
+            self._stats["events"] += 1
+            self._stats["event_bytes"] += len(event)
+            self._changed.notify_all()
+
+    def events_after(self, version: Optional[int], timeout: float):
+        """
+        Wait for the events a page at `version` has not seen yet.
+
+        Args:
+            version: Snapshot version the page shows (None for the current one)
+            timeout: Seconds to wait when the page is up to date
+
+        Returns:
+            tuple: (encoded events, version the page will be at after them)
+        """
+        with self._changed:
+            if version is None and self._published is not None:
+                version = self._published.version
+            if not self._is_pending(version):
+                self._changed.wait(timeout)
+            current = self._published.version if self._published is not None else version
+            if version is None or version == current:
+                return [], current
+            for index, (from_version, _, _) in enumerate(self._events):
+                if from_version == version:
+                    return [event for _, _, event in list(self._events)[index:]], current
+            # Too old (or unknown) for the retained deltas: the page has to reload
+            return [f"id: {current}\nevent: reload\ndata: {{}}\n\n".encode("utf-8")], current
+
+    def _is_pending(self, version: Optional[int]) -> bool:
+        return (
+            self._published is not None and version is not None
+            and version != self._published.version
+        )
+
+    def _refresh_while_watched(self) -> None:
+        # Keep the cache fresh only while somebody is looking at the map
+        while not self._stop.wait(self.refresh_interval):
+            if not self._clients:
+                continue
+            try:
+                # Refreshes in the background once the snapshot is stale, so this
+                # shares downloads with the poller and with tool calls
+                self.cache.get()
+            except Exception as err:
+                logger.warning("Live map refresh failed: %s", str(err))
+
+    def stats(self) -> dict:
+        """
+        Return server counters.
+
+        Returns:
+            dict: Pages served, events published and their size, open pages
+        """
+        return dict(self._stats, clients=self._clients, url=self.url if self.is_running() else None)
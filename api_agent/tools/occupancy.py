@@ -0,0 +1,169 @@
+"""Recent per-station occupancy kept in fixed-size ring buffers.
+
+An optional background poller refreshes the station snapshot on a fixed
+interval. Every snapshot is appended to OccupancyRingBuffer: preallocated
+NumPy arrays of shape (capacity, max_stations) holding bikes and free docks
+per sample. Old samples are overwritten, so memory stays constant and
+"how has station X evolved in the last hour" is answered from memory
+without extra API calls.
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class OccupancyRingBuffer:
+    """
+    Circular buffer of bikes/free docks per station and sample.
+    """
+
+    def __init__(self, capacity: int = 120, max_stations: int = 1024):
+        """
+        Preallocate the buffers.
+
+        Args:
+            capacity: Number of samples kept (e.g. 120 samples at 60s = 2 hours)
+            max_stations: Maximum number of distinct stations tracked
+        """
+        self.capacity = capacity
+        self.max_stations = max_stations
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.bikes = np.full((capacity, max_stations), -1, dtype=np.int16)
+        self.docks = np.full((capacity, max_stations), -1, dtype=np.int16)
+
+        self._columns: Dict[int, int] = {}
+        self._head = 0
+        self._count = 0
+        self._last_version = None
+        self._last_ids: Optional[np.ndarray] = None
+        self._last_columns: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _columns_for(self, ids: np.ndarray) -> np.ndarray:
+        """Map station ids to buffer columns, assigning columns to new ids."""
+        if self._last_ids is not None and np.array_equal(ids, self._last_ids):
+            return self._last_columns
+
+        columns = np.empty(len(ids), dtype=np.int64)
+        dropped = 0
+        for row, station_id in enumerate(ids.tolist()):
+            column = self._columns.get(station_id)
+            if column is None:
+                if len(self._columns) >= self.max_stations:
+                    columns[row] = -1
+                    dropped += 1
+                    continue
+                column = len(self._columns)
+                self._columns[station_id] = column
+            columns[row] = column
+        if dropped:
+            logger.warning("Occupancy buffer full: %d stations not tracked", dropped)
+
+        self._last_ids = ids.copy()
+        self._last_columns = columns
+        return columns
+
+    def append(self, snapshot) -> None:
+        """
+        Record the bikes and docks of every station in a snapshot.
+
+        Args:
+            snapshot: StationSnapshot to record (ignored if already recorded)
+        """
+        store = snapshot.store
+        with self._lock:
+            if snapshot.version == self._last_version:
+                return
+            self._last_version = snapshot.version
+
+            columns = self._columns_for(store.ids)
+            tracked = columns >= 0
+            slot = self._head
+            self.timestamps[slot] = snapshot.fetched_at
+            self.bikes[slot, :] = -1
+            self.docks[slot, :] = -1
+            self.bikes[slot, columns[tracked]] = store.dock_bikes[tracked]
+            self.docks[slot, columns[tracked]] = store.free_bases[tracked]
+
+            self._head = (self._head + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def series(self, station_id: int, since: float = 0.0):
+        """
+        Return the samples of one station in chronological order.
+
+        Args:
+            station_id: Station id
+            since: Only samples taken at or after this epoch time
+
+        Returns:
+            tuple: (timestamps, bikes, docks) arrays, or None if the station
+            has never been recorded
+        """
+        with self._lock:
+            column = self._columns.get(int(station_id))
+            if column is None or self._count == 0:
+                return None
+            start = (self._head - self._count) % self.capacity
+            slots = (start + np.arange(self._count)) % self.capacity
+            timestamps = self.timestamps[slots]
+            bikes = self.bikes[slots, column]
+            docks = self.docks[slots, column]
+
+        keep = (timestamps >= since) & (bikes >= 0)
+        return timestamps[keep], bikes[keep], docks[keep]
+
+    def nbytes(self) -> int:
+        """Memory held by the preallocated arrays."""
+        return self.timestamps.nbytes + self.bikes.nbytes + self.docks.nbytes
+
+
+class BicimadPoller:
+    """
+    Daemon thread refreshing the station snapshot every `interval` seconds.
+    """
+
+    def __init__(self, cache, interval: float = 60.0):
+        """
+        Args:
+            cache: StationSnapshotCache to refresh
+            interval: Seconds between two downloads
+        """
+        self.cache = cache
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start polling unless already running."""
+        if self.is_running():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="bicimad-poller", daemon=True)
+        self._thread.start()
+        logger.info("BiciMAD poller started (every %.0fs)", self.interval)
+
+    def stop(self) -> None:
+        """Ask the poller to stop after the current iteration."""
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.cache.refresh()
+            except Exception as err:
+                logger.warning("BiciMAD poll failed: %s", str(err))
+            self._stop.wait(max(self.interval - (time.monotonic() - started), 0.0))
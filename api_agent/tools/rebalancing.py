@@ -0,0 +1,169 @@
+"""Truck moves that rebalance bikes between stations.
+
+Every active station has a target of the network-wide fill ratio times its
+docks. Stations above HIGH_FILL have their bikes beyond the target as
+surplus; stations below LOW_FILL are short of the target by their deficit.
+Moving surplus to deficits is a transportation problem. It is solved with
+the greedy least-cost method on a sparse graph: each surplus station is
+linked to its nearest deficit stations and each deficit station to its
+nearest surplus stations (k-NN on projected coordinates, in chunks). The
+links are then filled shortest first, each with as many bikes as both ends
+still allow. Stations left unbalanced because all their links were used up
+get fresh links in a few more passes.
+"""
+
+import math
+from typing import Optional
+
+import numpy as np
+
+from .spatial_index import M_PER_DEG_LAT
+
+# Fill ratios outside which a station is rebalanced
+LOW_FILL = 0.25
+HIGH_FILL = 0.75
+
+# Nearest opposite stations linked to each station
+DEFAULT_NEIGHBOURS = 16
+
+# Bikes a truck carries per trip
+DEFAULT_TRUCK_CAPACITY = 20
+
+# Stations per k-NN chunk (bounds the chunk x opposite stations distance matrix)
+_CHUNK_POINTS = 256
+
+# Passes over the stations still unbalanced, each with fresh nearest links
+_MAX_ROUNDS = 4
+
+
+def station_imbalance(store, low: float = LOW_FILL, high: float = HIGH_FILL):
+    """
+    Compute the surplus and deficit of every station.
+
+    Args:
+        store: StationStore of the snapshot
+        low: Fill ratio below which a station needs bikes
+        high: Fill ratio above which a station gives bikes away
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, float]: Surplus and deficit bikes per
+        row (0 for balanced or inactive stations) and the target fill ratio
+    """
+    active = (store.activate == 1) & (store.no_available == 0) & store.has_coordinates() \
+        & (store.total_bases > 0)
+    bikes = store.dock_bikes.astype(np.int64)
+    docks = store.total_bases.astype(np.int64)
+    capacity = int(docks[active].sum())
+    target_fill = float(bikes[active].sum()) / capacity if capacity else 0.0
+    # The target stays inside the band, so a rebalanced station is no longer flagged
+    target = np.round(np.clip(target_fill, low, high) * docks).astype(np.int64)
+
+    fill = np.where(docks > 0, bikes / np.maximum(docks, 1), 0.0)
+    surplus = np.where(active & (fill > high), np.maximum(bikes - target, 0), 0)
+    deficit = np.where(active & (fill < low), np.maximum(target - bikes, 0), 0)
+    return surplus, deficit, target_fill
+
+
+def _project(store) -> np.ndarray:
+    """Station coordinates in meters on a local equirectangular plane."""
+    lat0 = float(np.nanmean(store.lats)) if len(store) else 40.4168
+    return np.column_stack((
+        store.lons * M_PER_DEG_LAT * math.cos(math.radians(lat0)),
+        store.lats * M_PER_DEG_LAT,
+    ))
+
+
+def _nearest_links(xy: np.ndarray, from_rows: np.ndarray, to_rows: np.ndarray, neighbours: int):
+    """Links from each of `from_rows` to its nearest `to_rows`, as (from, to, meters) arrays."""
+    k = min(neighbours, len(to_rows))
+    targets_xy = xy[to_rows]
+    sources, targets, meters = [], [], []
+    for start in range(0, len(from_rows), _CHUNK_POINTS):
+        chunk = from_rows[start:start + _CHUNK_POINTS]
+        dx = xy[chunk, 0][:, None] - targets_xy[None, :, 0]
+        dy = xy[chunk, 1][:, None] - targets_xy[None, :, 1]
+        squared = dx * dx + dy * dy
+        nearest = np.argpartition(squared, k - 1, axis=1)[:, :k] if k < len(to_rows) \
+            else np.broadcast_to(np.arange(len(to_rows)), squared.shape)
+        sources.append(np.repeat(chunk, k))
+        targets.append(to_rows[nearest].ravel())
+        meters.append(np.sqrt(np.take_along_axis(squared, nearest, axis=1)).ravel())
+    return np.concatenate(sources), np.concatenate(targets), np.concatenate(meters)
+
+
+def _fill_links(store, sources: np.ndarray, targets: np.ndarray, meters: np.ndarray,
+                supply: np.ndarray, demand: np.ndarray) -> list:
+    """Greedy least-cost pass: fill the links shortest first; updates supply and demand."""
+    # Station ids break ties so the plan is deterministic
+    order = np.lexsort((store.ids[targets], store.ids[sources], meters))
+    remaining_supply, remaining_demand = supply.tolist(), demand.tolist()
+    left_supply, left_demand = int(supply.sum()), int(demand.sum())
+    moves = []
+    for source, target, distance in zip(sources[order].tolist(), targets[order].tolist(),
+                                        meters[order].tolist()):
+        bikes = min(remaining_supply[source], remaining_demand[target])
+        if bikes <= 0:
+            continue
+        remaining_supply[source] -= bikes
+        remaining_demand[target] -= bikes
+        left_supply -= bikes
+        left_demand -= bikes
+        moves.append((source, target, bikes, distance))
+        if not left_supply or not left_demand:
+            break
+    supply[:] = remaining_supply
+    demand[:] = remaining_demand
+    return moves
+
+
+def plan_rebalancing(snapshot, neighbours: int = DEFAULT_NEIGHBOURS,
+                     max_distance_m: Optional[float] = None,
+                     low: float = LOW_FILL, high: float = HIGH_FILL) -> dict:
+    """
+    Assign surplus bikes to deficit stations, nearest pairs first.
+
+    Args:
+        snapshot: StationSnapshot from the station cache
+        neighbours: Nearest opposite stations linked to each station
+        max_distance_m: Longest move allowed (no limit if None)
+        low: Fill ratio below which a station needs bikes
+        high: Fill ratio above which a station gives bikes away
+
+    Returns:
+        dict: "moves" as (from row, to row, bikes, meters) tuples in
+        assignment order, plus surplus/deficit totals and the target fill
+    """
+    store = snapshot.store
+    surplus, deficit, target_fill = station_imbalance(store, low, high)
+    xy = _project(store)
+    supply, demand = surplus.copy(), deficit.copy()
+
+    moves = []
+    for _ in range(_MAX_ROUNDS):
+        senders, receivers = np.flatnonzero(supply > 0), np.flatnonzero(demand > 0)
+        if not len(senders) or not len(receivers):
+            break
+        forward = _nearest_links(xy, senders, receivers, neighbours)
+        backward = _nearest_links(xy, receivers, senders, neighbours)
+        sources = np.concatenate((forward[0], backward[1]))
+        targets = np.concatenate((forward[1], backward[0]))
+        meters = np.concatenate((forward[2], backward[2]))
+        if max_distance_m is not None:
+            keep = meters <= max_distance_m
+            sources, targets, meters = sources[keep], targets[keep], meters[keep]
+        # Both directions find the same pair: keep it once
+        _, unique = np.unique(sources * len(store) + targets, return_index=True)
+        filled = _fill_links(store, sources[unique], targets[unique], meters[unique], supply, demand)
+        if not filled:
+            break
+        moves.extend(filled)
+
+    return {
+        "moves": moves,
+        "target_fill": target_fill,
+        "surplus_stations": int(np.count_nonzero(surplus)),
+        "deficit_stations": int(np.count_nonzero(deficit)),
+        "surplus_bikes": int(surplus.sum()),
+        "deficit_bikes": int(deficit.sum()),
+        "unmet_deficit": int(demand.sum()),
+    }
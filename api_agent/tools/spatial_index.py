@@ -0,0 +1,296 @@
+"""Local spatial index over the BiciMAD station snapshot.
+
+All station coordinates are already in the cached station list, so radius
+and nearest-station queries can be answered in-process instead of calling
+the EMT POI endpoint. Stations are bucketed in a uniform grid (cells of a
+few hundred meters); a query only computes distances for the stations in
+the cells around the point, using a vectorized haversine.
+"""
+
+import math
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+
+# Meters per degree of latitude
+M_PER_DEG_LAT = 111320.0
+
+
+def haversine_m(lat, lon, lats, lons) -> np.ndarray:
+    """
+    Great-circle distance in meters, broadcasting over NumPy arrays.
+
+    Args:
+        lat: Latitude(s) of the origin point(s), in degrees
+        lon: Longitude(s) of the origin point(s), in degrees
+        lats: Latitudes of the destination points, in degrees
+        lons: Longitudes of the destination points, in degrees
+
+    Returns:
+        np.ndarray: Distances in meters, with the broadcast shape of the inputs
+    """
+    lat1 = np.radians(lat)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons) - np.radians(lon)
+    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def station_coordinates(station: dict) -> Optional[Tuple[float, float]]:
+    """
+    Extract (latitude, longitude) from an EMT station dict.
+
+    Args:
+        station: Station as returned by the EMT API
+
+    Returns:
+        Optional[Tuple[float, float]]: Coordinates, or None if missing
+    """
+    geometry = station.get("geometry") or {}
+    coordinates = geometry.get("coordinates")
+    if coordinates and len(coordinates) >= 2:
+        # GeoJSON format: [longitude, latitude]
+        return float(coordinates[1]), float(coordinates[0])
+    if station.get("latitude") is not None and station.get("longitude") is not None:
+        return float(station["latitude"]), float(station["longitude"])
+    return None
+
+
+class StationSpatialIndex:
+    """
+    Uniform-grid index of station positions.
+
+    Attributes:
+        lats: Latitudes of the indexed stations
+        lons: Longitudes of the indexed stations
+        positions: Position of each indexed station in the source list
+    """
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, positions: np.ndarray,
+                 cell_size_m: float = 500.0):
+        """
+        Build the grid.
+
+        Args:
+            lats: Station latitudes
+            lons: Station longitudes
+            positions: Index of each station in the source list
+            cell_size_m: Side of a grid cell in meters
+        """
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.cell_size_m = cell_size_m
+
+        ref_lat = float(self.lats.mean()) if len(self.lats) else 40.4168
+        self._dlat = cell_size_m / M_PER_DEG_LAT
+        self._dlon = cell_size_m / (M_PER_DEG_LAT * math.cos(math.radians(ref_lat)))
+        self._lat0 = float(self.lats.min()) if len(self.lats) else 0.0
+        self._lon0 = float(self.lons.min()) if len(self.lons) else 0.0
+
+        rows = np.floor((self.lats - self._lat0) / self._dlat).astype(np.int64)
+        cols = np.floor((self.lons - self._lon0) / self._dlon).astype(np.int64)
+        self._max_row = int(rows.max(initial=0))
+        self._max_col = int(cols.max(initial=0))
+
+        # Group station indices by cell in a single sort
+        self._cells: Dict[Tuple[int, int], np.ndarray] = {}
+        if len(rows):
+            keys = np.stack([rows, cols], axis=1)
+            order = np.lexsort((cols, rows))
+            unique_keys, starts = np.unique(keys[order], axis=0, return_index=True)
+            bounds = list(starts[1:]) + [len(order)]
+            for (row, col), start, end in zip(unique_keys, starts, bounds):
+                self._cells[(int(row), int(col))] = order[start:end]
+
+    @classmethod
+    def from_stations(cls, stations: List[dict], cell_size_m: float = 500.0) -> "StationSpatialIndex":
+        """
+        Build an index from a list of EMT station dicts.
+
+        Stations without coordinates are skipped.
+
+        Args:
+            stations: Stations as returned by the EMT API
+            cell_size_m: Side of a grid cell in meters
+
+        Returns:
+            StationSpatialIndex: The index
+        """
+        lats, lons, positions = [], [], []
+        for position, station in enumerate(stations):
+            coordinates = station_coordinates(station)
+            if coordinates is None:
+                continue
+            lats.append(coordinates[0])
+            lons.append(coordinates[1])
+            positions.append(position)
+        return cls(np.array(lats), np.array(lons), np.array(positions, dtype=np.int64), cell_size_m)
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    def _cell_of(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (int(math.floor((lat - self._lat0) / self._dlat)),
+                int(math.floor((lon - self._lon0) / self._dlon)))
+
+    def _candidates(self, lat: float, lon: float, rings: int) -> np.ndarray:
+        """Indices of the stations in the cells at most `rings` cells away."""
+        row, col = self._cell_of(lat, lon)
+        # Cells outside the grid are empty: clamp so far-away points stay cheap
+        found = [
+            self._cells[(r, c)]
+            for r in range(max(row - rings, 0), min(row + rings, self._max_row) + 1)
+            for c in range(max(col - rings, 0), min(col + rings, self._max_col) + 1)
+            if (r, c) in self._cells
+        ]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(found)
+
+    def _all_within_rings(self, lat: float, lon: float, rings: int) -> bool:
+        """Whether `rings` around the query cell already cover the whole grid."""
+        row, col = self._cell_of(lat, lon)
+        return (row - rings <= 0 and row + rings >= self._max_row
+                and col - rings <= 0 and col + rings >= self._max_col)
+
+    def query_radius(self, lat: float, lon: float, radius_m: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the stations within a radius of a point.
+
+        Args:
+            lat: Latitude of the point
+            lon: Longitude of the point
+            radius_m: Search radius in meters
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Source-list positions and distances
+            in meters, sorted by distance
+        """
+        rings = int(math.ceil(radius_m / self.cell_size_m))
+        if self._all_within_rings(lat, lon, rings):
+            candidates = np.arange(len(self.lats))
+        else:
+            candidates = self._candidates(lat, lon, rings)
+        distances = haversine_m(lat, lon, self.lats[candidates], self.lons[candidates])
+        inside = distances <= radius_m
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind="stable")
+        return self.positions[candidates[order]], distances[order]
+
+    def query_knn(self, lat: float, lon: float, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k stations nearest to a point.
+
+        Rings of grid cells are added around the point until the k-th
+        closest candidate is guaranteed to be closer than any station
+        outside the searched rings.
+
+        Args:
+            lat: Latitude of the point
+            lon: Longitude of the point
+            k: Number of stations to return
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Source-list positions and distances
+            in meters, sorted by distance
+        """
+        k = min(k, len(self.lats))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        rings = 1
+        while True:
+            if self._all_within_rings(lat, lon, rings):
+                candidates = np.arange(len(self.lats))
+                complete = True
+            else:
+                candidates = self._candidates(lat, lon, rings)
+                complete = False
+
+            if len(candidates) >= k:
+                distances = haversine_m(lat, lon, self.lats[candidates], self.lons[candidates])
+                nearest = np.argpartition(distances, k - 1)[:k]
+                nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+                # Anything outside the rings is at least rings * cell_size away
+                if complete or distances[nearest[-1]] <= rings * self.cell_size_m:
+                    return self.positions[candidates[nearest]], distances[nearest]
+                rings = max(rings + 1, int(math.ceil(distances[nearest[-1]] / self.cell_size_m)))
+            else:
+                rings *= 2
+
+    def query_knn_batch(self, lats, lons, k: int,
+                        mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k nearest stations for several points at once.
+
+        All point-to-station distances are computed as one NumPy broadcast
+        of shape (points, stations), which for a few points over the whole
+        network is cheaper than walking the grid once per point.
+
+        Args:
+            lats: Latitudes of the query points
+            lons: Longitudes of the query points
+            k: Number of stations per point
+            mask: Optional boolean array over the indexed stations; only
+                stations where it is True are eligible
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Arrays of shape (points, k) with the
+            source-list positions and distances in meters, sorted by distance.
+            Missing neighbours (fewer than k eligible stations) have position
+            -1 and distance inf.
+        """
+        point_lats = np.asarray(lats, dtype=np.float64)[:, None]
+        point_lons = np.asarray(lons, dtype=np.float64)[:, None]
+        distances = haversine_m(point_lats, point_lons, self.lats[None, :], self.lons[None, :])
+        if mask is not None:
+            distances = np.where(np.asarray(mask, dtype=bool)[None, :], distances, np.inf)
+
+        n_points, n_stations = distances.shape
+        k = min(k, n_stations)
+        if k <= 0:
+            return np.empty((n_points, 0), dtype=np.int64), np.empty((n_points, 0))
+
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+        order = np.argsort(nearest_distances, axis=1, kind="stable")
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+
+        positions = np.where(np.isfinite(nearest_distances), self.positions[nearest], -1)
+        return positions, nearest_distances
+
+
+# Index of the last station store, rebuilt only when the stations change
+# (renewed snapshots of an unchanged list share their store)
+_index_cache = {
+    "store": None,
+    "index": None
+}
+_index_lock = threading.Lock()
+
+
+def get_spatial_index(snapshot) -> StationSpatialIndex:
+    """
+    Return the spatial index of a station snapshot, building it once.
+
+    Args:
+        snapshot: StationSnapshot from the station cache
+
+    Returns:
+        StationSpatialIndex: Index over the rows of snapshot.store
+    """
+    with _index_lock:
+        if _index_cache["store"] is not snapshot.store:
+            store = snapshot.store
+            positions = np.flatnonzero(store.has_coordinates())
+            _index_cache["index"] = StationSpatialIndex(
+                store.lats[positions], store.lons[positions], positions
+            )
+            _index_cache["store"] = store
+        return _index_cache["index"]
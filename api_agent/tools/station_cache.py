@@ -0,0 +1,307 @@
+"""In-process cache of the BiciMAD station list.
+
+Downloading the whole station list on every tool call costs hundreds of
+milliseconds. StationSnapshotCache keeps the last snapshot in memory with a
+configurable TTL:
+
+- While the snapshot is fresh it is returned directly.
+- Once the TTL has passed, callers still get the stale snapshot immediately
+  while a single background thread downloads a new one
+  (stale-while-revalidate).
+- Only the very first call (no snapshot yet) waits for the network, and
+  concurrent first calls share one download.
+- Loads never overlap: the first download, the background refresh and an
+  explicit refresh() (e.g. from the poller) take turns, and a caller that
+  waited for another load gets that load's snapshot instead of downloading
+  again. Snapshots are installed, and their listeners run, one at a time.
+- A loader may return SNAPSHOT_UNCHANGED when the station list did not
+  change (HTTP 304 or an identical body): the new snapshot then shares the
+  columns of the previous one instead of parsing the payload again. It may
+  also return a ready StationSnapshot (e.g. parsed while streaming).
+"""
+
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, List, Optional
+
+from .station_store import StationStore
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotUnavailableError(Exception):
+    """Raised by a snapshot loader when the station list cannot be fetched."""
+
+
+# Returned by a loader when the station list is identical to the cached one
+SNAPSHOT_UNCHANGED = object()
+
+
+class StationSnapshot:
+    """
+    Immutable view of one download of the station list.
+
+    Attributes:
+        meta: Top-level fields of the EMT response ("code", "description")
+        store: Columnar StationStore holding the stations
+        fetched_at: Wall-clock time of the download (epoch seconds)
+        version: Increasing number identifying the snapshot
+    """
+
+    _versions = itertools.count(1)
+
+    def __init__(self, payload: dict, store: Optional[StationStore] = None):
+        """
+        Args:
+            payload: EMT response; its "data" list is parsed into columns
+            store: Already parsed columns to reuse instead of payload["data"]
+        """
+        # The raw station dicts are parsed once into columns and not kept
+        self.meta = {key: value for key, value in payload.items() if key != "data"}
+        if store is None:
+            store = StationStore.from_records(payload.get("data") or [])
+        self.store = store
+        self.fetched_at = time.time()
+        self.version = next(self._versions)
+        self._monotonic = time.monotonic()
+
+    def age(self) -> float:
+        """Seconds elapsed since the snapshot was downloaded."""
+        return time.monotonic() - self._monotonic
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def get(self, station_id) -> Optional[dict]:
+        """Look up a station by id."""
+        position = self.store.position_of(station_id)
+        return self.store.record(position) if position is not None else None
+
+    def renewed(self) -> "StationSnapshot":
+        """A newer snapshot with the same stations, sharing this one's columns."""
+        return StationSnapshot(self.meta, store=self.store)
+
+
+class StationSnapshotCache:
+    """
+    TTL cache with stale-while-revalidate for the BiciMAD station list.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[], dict],
+        async_loader: Optional[Callable[[], Awaitable[dict]]] = None,
+        ttl: float = 60.0,
+        history_size: int = 10,
+    ):
+        """
+        Initialize an empty cache.
+
+        Args:
+            loader: Blocking function returning the raw EMT payload (or a
+                StationSnapshot, or SNAPSHOT_UNCHANGED), or raising
+                SnapshotUnavailableError
+            async_loader: Coroutine function with the same contract, used by
+                aget() for the first download so it does not block the loop
+            ttl: Seconds a snapshot is considered fresh
+            history_size: Number of recent snapshots kept for diffing
+        """
+        self.loader = loader
+        self.async_loader = async_loader
+        self.ttl = ttl
+
+        self._snapshot: Optional[StationSnapshot] = None
+        self._history: "deque[StationSnapshot]" = deque(maxlen=history_size)
+        self._listeners: List[Callable[[StationSnapshot], None]] = []
+        self._lock = threading.Lock()
+        # Held for a whole load (download + install); _install_lock for installs only
+        self._load_lock = threading.Lock()
+        self._install_lock = threading.Lock()
+        self._installs = 0
+        self._refreshing = False
+        self._async_lock: Optional[asyncio.Lock] = None
+        self._async_lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats = {"hits": 0, "stale_hits": 0, "loads": 0, "unchanged_loads": 0, "failed_loads": 0}
+
+    def peek(self) -> Optional[StationSnapshot]:
+        """Return the current snapshot, whatever its age, without loading."""
+        return self._snapshot
+
+    def history(self) -> List[StationSnapshot]:
+        """Return the retained snapshots, oldest first."""
+        return list(self._history)
+
+    def subscribe(self, listener: Callable[[StationSnapshot], None]) -> None:
+        """
+        Register a function called with every new snapshot.
+
+        Listeners run in the thread that downloaded the snapshot; errors
+        are logged and do not affect the cache.
+
+        Args:
+            listener: Function receiving the new StationSnapshot
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def _install(self, payload) -> StationSnapshot:
+        with self._install_lock:
+            if payload is SNAPSHOT_UNCHANGED:
+                if self._snapshot is None:
+                    raise SnapshotUnavailableError("Station list reported unchanged but none is cached")
+                snapshot = self._snapshot.renewed()
+                self._stats["unchanged_loads"] += 1
+            elif isinstance(payload, StationSnapshot):
+                if self._snapshot is not None and payload.version < self._snapshot.version:
+                    # Parsed before the current snapshot: keep the versions in order
+                    return self._snapshot
+                snapshot = payload
+            else:
+                snapshot = StationSnapshot(payload)
+            self._history.append(snapshot)
+            self._snapshot = snapshot
+            self._installs += 1
+            self._stats["loads"] += 1
+            logger.info("Cached BiciMAD snapshot v%d with %d stations",
+                        snapshot.version, len(snapshot))
+            for listener in list(self._listeners):
+                try:
+                    listener(snapshot)
+                except Exception as err:
+                    logger.warning("Snapshot listener %r failed: %s", listener, str(err))
+            return snapshot
+
+    def _load(self, if_missing: bool = False) -> StationSnapshot:
+        """
+        Run the loader and install its result, one load at a time.
+
+        Args:
+            if_missing: Only load if there is no snapshot yet
+
+        Returns:
+            StationSnapshot: The new snapshot, or the one installed by a load
+            that finished while this caller waited for its turn
+        """
+        installs = self._installs
+        with self._load_lock:
+            if self._snapshot is not None and (if_missing or self._installs != installs):
+                return self._snapshot
+            try:
+                return self._install(self.loader())
+            except Exception:
+                self._stats["failed_loads"] += 1
+                raise
+
+    def _serve(self, snapshot: StationSnapshot) -> StationSnapshot:
+        """Return a cached snapshot, kicking off a refresh if it is stale."""
+        if snapshot.age() < self.ttl:
+            self._stats["hits"] += 1
+        else:
+            self._stats["stale_hits"] += 1
+            self.refresh_in_background()
+        return snapshot
+
+    def get(self) -> StationSnapshot:
+        """
+        Return the current snapshot, downloading it only on the first call.
+
+        Returns:
+            StationSnapshot: The cached (possibly stale) snapshot
+
+        Raises:
+            SnapshotUnavailableError: If there is no snapshot and the download fails
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return self._serve(snapshot)
+        return self._load(if_missing=True)
+
+    async def aget(self) -> StationSnapshot:
+        """
+        Async version of get().
+
+        Returns:
+            StationSnapshot: The cached (possibly stale) snapshot
+
+        Raises:
+            SnapshotUnavailableError: If there is no snapshot and the download fails
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return self._serve(snapshot)
+
+        if self.async_loader is None:
+            return await asyncio.to_thread(self.get)
+
+        loop = asyncio.get_running_loop()
+        if self._async_lock_loop is not loop:
+            self._async_lock = asyncio.Lock()
+            self._async_lock_loop = loop
+
+        async with self._async_lock:
+            if self._snapshot is not None:
+                return self._serve(self._snapshot)
+            # The load lock is held for the whole download, like _load() does;
+            # if a blocking load has it, wait for that one in a thread
+            if not self._load_lock.acquire(blocking=False):
+                return await asyncio.to_thread(self.get)
+            try:
+                if self._snapshot is not None:
+                    return self._serve(self._snapshot)
+                payload = await self.async_loader()
+                # Parsing and the listeners (index builds, disk appends) stay off the loop
+                return await asyncio.to_thread(self._install, payload)
+            except Exception:
+                self._stats["failed_loads"] += 1
+                raise
+            finally:
+                self._load_lock.release()
+
+    def refresh_in_background(self) -> None:
+        """Start one background download unless one is already running."""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name="bicimad-snapshot-refresh", daemon=True).start()
+
+    def refresh(self) -> StationSnapshot:
+        """
+        Download a new snapshot now, in the calling thread.
+
+        If another load is running, waits for it and returns its snapshot
+        instead of downloading a second time.
+
+        Returns:
+            StationSnapshot: The new snapshot
+
+        Raises:
+            SnapshotUnavailableError: If the download fails
+        """
+        return self._load()
+
+    def _refresh(self) -> None:
+        try:
+            self.refresh()
+        except Exception as err:
+            logger.warning("Background refresh of BiciMAD stations failed: %s", str(err))
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def stats(self) -> dict:
+        """
+        Return cache counters and the age of the current snapshot.
+
+        Returns:
+            dict: Cache counters
+        """
+        stats = dict(self._stats)
+        snapshot = self._snapshot
+        stats["snapshot_version"] = snapshot.version if snapshot else None
+        stats["snapshot_age"] = snapshot.age() if snapshot else None
+        return stats
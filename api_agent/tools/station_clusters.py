@@ -0,0 +1,106 @@
+"""Grid clustering of the stations for the map, one level per zoom.
+
+Drawing one Leaflet marker per station stalls the browser with thousands of
+stations. The clusters are therefore computed here, vectorized over the
+StationStore columns, and embedded in the page: at each zoom level the
+stations are bucketed into square cells of CELL_PIXELS screen pixels in
+Web Mercator, and every cell becomes one cluster with its centroid and
+summed bike and dock counts. A cell at zoom z+1 is one quarter of a cell
+at zoom z, so the levels nest like Leaflet's own tiles.
+"""
+
+import math
+from typing import Iterable, Iterator, Tuple
+
+import numpy as np
+
+# Leaflet zoom levels drawn as clusters; above them stations are drawn one by one
+CLUSTER_ZOOMS = tuple(range(10, 16))
+
+# Side of a cluster cell in screen pixels
+CELL_PIXELS = 64
+
+# Web Mercator is undefined at the poles
+_MAX_LATITUDE = 85.05112878
+
+# Columns of a cluster row: centroid, counts, and the row of one member station
+# (the station itself when the cluster holds a single station)
+CLUSTER_FIELDS = (
+    "latitude", "longitude", "stations", "active", "bikes", "free_docks", "total_docks", "station",
+)
+
+
+def mercator_fractions(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+    Project coordinates onto the unit Web Mercator square.
+
+    Args:
+        lats: Latitudes in degrees
+        lons: Longitudes in degrees
+
+    Returns:
+        np.ndarray: (N, 2) array of x, y in [0, 1), y growing southwards
+    """
+    sin_lat = np.sin(np.radians(np.clip(lats, -_MAX_LATITUDE, _MAX_LATITUDE)))
+    x = (np.asarray(lons, dtype=np.float64) + 180.0) / 360.0
+    y = 0.5 - np.log((1.0 + sin_lat) / (1.0 - sin_lat)) / (4.0 * math.pi)
+    return np.clip(np.column_stack((x, y)), 0.0, np.nextafter(1.0, 0.0))
+
+
+def grid_clusters(store, zoom: int, fractions: np.ndarray, positions: np.ndarray,
+                  cell_pixels: int = CELL_PIXELS) -> np.ndarray:
+    """
+    Cluster stations into the grid cells of one zoom level.
+
+    Args:
+        store: StationStore of the snapshot
+        zoom: Leaflet zoom level
+        fractions: mercator_fractions() of the stations in `positions`
+        positions: Rows of the stations to cluster (those with coordinates)
+        cell_pixels: Side of a cell in screen pixels at this zoom
+
+    Returns:
+        np.ndarray: (clusters, len(CLUSTER_FIELDS)) float64 rows, ordered by cell
+    """
+    cells_per_side = max(int((256 << zoom) // cell_pixels), 1)
+    cells = np.floor(fractions * cells_per_side).astype(np.int64)
+    keys = cells[:, 0] * cells_per_side + cells[:, 1]
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+
+    def total(values: np.ndarray) -> np.ndarray:
+        return np.bincount(inverse, weights=values, minlength=len(first))
+
+    counts = total(np.ones(len(positions)))
+    active = (store.activate[positions] == 1) & (store.no_available[positions] == 0)
+    return np.column_stack((
+        total(store.lats[positions]) / counts,
+        total(store.lons[positions]) / counts,
+        counts,
+        total(active.astype(np.float64)),
+        total(store.dock_bikes[positions].astype(np.float64)),
+        total(store.free_bases[positions].astype(np.float64)),
+        total(store.total_bases[positions].astype(np.float64)),
+        positions[first],
+    ))
+
+
+def cluster_levels(store, zooms: Iterable[int] = CLUSTER_ZOOMS,
+                   cell_pixels: int = CELL_PIXELS) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Cluster the stations at every zoom level, one level at a time.
+
+    The Mercator projection is computed once and shared by all levels.
+
+    Args:
+        store: StationStore of the snapshot
+        zooms: Leaflet zoom levels to cluster
+        cell_pixels: Side of a cell in screen pixels
+
+    Yields:
+        Tuple[int, np.ndarray]: Zoom level and its cluster rows (see grid_clusters)
+    """
+    positions = np.flatnonzero(store.has_coordinates())
+    fractions = mercator_fractions(store.lats[positions], store.lons[positions])
+    for zoom in zooms:
+        yield zoom, grid_clusters(store, zoom, fractions, positions, cell_pixels)
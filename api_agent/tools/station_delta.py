@@ -0,0 +1,130 @@
+"""Differences between two BiciMAD station snapshots.
+
+Consecutive snapshots differ in only a few stations. Instead of handing the
+whole list to the model again, diff_snapshots() aligns two columnar stores
+by station id and reports only the stations whose bikes, docks or
+activation changed, plus stations that appeared or disappeared.
+"""
+
+from datetime import datetime
+from typing import List
+
+import numpy as np
+
+# Columns whose change makes a station "changed"
+DELTA_COLUMNS = ("dock_bikes", "free_bases", "activate", "no_available")
+
+
+class SnapshotDelta:
+    """
+    Result of comparing an older snapshot with a newer one.
+
+    Attributes:
+        old: The older StationSnapshot
+        new: The newer StationSnapshot
+        changed_new: Rows in new.store of stations that changed
+        changed_old: Matching rows in old.store
+        added: Rows in new.store of stations missing from the old snapshot
+        removed: Rows in old.store of stations missing from the new snapshot
+        unchanged: Number of stations present in both and unchanged
+    """
+
+    def __init__(self, old, new, changed_new, changed_old, added, removed, unchanged: int):
+        self.old = old
+        self.new = new
+        self.changed_new = changed_new
+        self.changed_old = changed_old
+        self.added = added
+        self.removed = removed
+        self.unchanged = unchanged
+
+    def changes(self) -> List[dict]:
+        """
+        Describe each changed station with its new values and deltas.
+
+        Returns:
+            List[dict]: One compact entry per changed station
+        """
+        old_store, new_store = self.old.store, self.new.store
+        changes = []
+        for new_row, old_row in zip(self.changed_new, self.changed_old):
+            bikes = int(new_store.dock_bikes[new_row])
+            docks = int(new_store.free_bases[new_row])
+            change = {
+                "id": int(new_store.ids[new_row]),
+                "name": new_store.names[new_row],
+                "dock_bikes": bikes,
+                "dock_bikes_change": bikes - int(old_store.dock_bikes[old_row]),
+                "free_bases": docks,
+                "free_bases_change": docks - int(old_store.free_bases[old_row]),
+            }
+            for column in ("activate", "no_available"):
+                before = int(getattr(old_store, column)[old_row])
+                after = int(getattr(new_store, column)[new_row])
+                if before != after:
+                    change[column] = after
+                    change[f"previous_{column}"] = before
+            changes.append(change)
+        return changes
+
+    def to_dict(self) -> dict:
+        """
+        Build the tool payload of the delta.
+
+        Returns:
+            dict: Versions, timestamps, changed/added/removed stations
+        """
+        new_store, old_store = self.new.store, self.old.store
+        return {
+            "from_version": self.old.version,
+            "to_version": self.new.version,
+            "from_time": datetime.fromtimestamp(self.old.fetched_at).isoformat(timespec="seconds"),
+            "to_time": datetime.fromtimestamp(self.new.fetched_at).isoformat(timespec="seconds"),
+            "changed": self.changes(),
+            "added": [
+                {"id": int(new_store.ids[row]), "name": new_store.names[row]} for row in self.added
+            ],
+            "removed": [
+                {"id": int(old_store.ids[row]), "name": old_store.names[row]} for row in self.removed
+            ],
+            "unchanged_count": self.unchanged,
+        }
+
+
+def diff_snapshots(old, new) -> SnapshotDelta:
+    """
+    Compare two snapshots column by column.
+
+    Args:
+        old: The older StationSnapshot
+        new: The newer StationSnapshot
+
+    Returns:
+        SnapshotDelta: Stations that changed, appeared or disappeared
+    """
+    old_store, new_store = old.store, new.store
+    if old_store is new_store:
+        # Renewed snapshot of an unchanged station list
+        empty = np.empty(0, dtype=np.int64)
+        return SnapshotDelta(old, new, empty, empty, empty, empty, unchanged=len(new_store))
+
+    _, new_rows, old_rows = np.intersect1d(
+        new_store.ids, old_store.ids, assume_unique=False, return_indices=True
+    )
+
+    changed = np.zeros(len(new_rows), dtype=bool)
+    for column in DELTA_COLUMNS:
+        changed |= getattr(new_store, column)[new_rows] != getattr(old_store, column)[old_rows]
+
+    # Keep the changed stations in the order of the new snapshot
+    order = np.argsort(new_rows[changed], kind="stable")
+    changed_new = new_rows[changed][order]
+    changed_old = old_rows[changed][order]
+
+    added = np.flatnonzero(~np.isin(new_store.ids, old_store.ids))
+    removed = np.flatnonzero(~np.isin(old_store.ids, new_store.ids))
+
+    return SnapshotDelta(
+        old, new, changed_new, changed_old, added, removed,
+        unchanged=int(len(new_rows) - changed.sum()),
+    )
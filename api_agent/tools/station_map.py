@@ -0,0 +1,384 @@
+"""Streaming HTML renderer of the BiciMAD station map.
+
+The map page used to be one Python string holding the whole page: CSS,
+JavaScript and a json.dumps() of every station, rebuilt on every call and
+held in memory three times (the station dicts, their JSON and the page).
+The page is now split into static files under templates/:
+
+    bicimad_map.html  the shell, with {{CSS}}, {{JS}}, {{FIELDS}}, {{STATIONS}},
+                      {{CLUSTERS}} and {{SOURCE}} slots
+    bicimad_map.css   styles
+    bicimad_map.js    stats, virtualized station list, search and Leaflet map
+
+The shell is read and split once per process. CSS and JS are copied next
+to the generated pages under a content-hashed name, so they are written
+once and cached by the browser. Only the station data is produced per
+call, a block of rows at a time straight from the StationStore columns,
+so rendering memory does not grow with the number of stations. The
+per-zoom marker clusters (station_clusters.py) are embedded the same way.
+
+Pages are content-addressed: the file name is a hash of the snapshot
+columns and of the template, so asking again for an unchanged snapshot
+returns the existing file without rendering or writing anything. The
+directory is capped by page count and total size, least recently used
+pages first.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Iterable, List, Optional, TextIO, Tuple
+
+import numpy as np
+
+from .station_clusters import CELL_PIXELS, CLUSTER_ZOOMS, cluster_levels
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+# Fields embedded in the page (coordinates flattened for the JavaScript)
+MAP_FIELDS = (
+    "id", "number", "name", "address", "dock_bikes", "free_bases", "total_bases",
+    "activate", "latitude", "longitude",
+)
+
+# Stations serialized per write
+_CHUNK_ROWS = 1000
+
+# Bump when the data written into the page changes shape
+_PAGE_FORMAT = 1
+
+_ASSETS = {"CSS": "bicimad_map.css", "JS": "bicimad_map.js"}
+
+# Generated pages kept in the output directory (least recently used evicted first)
+DEFAULT_MAX_FILES = 20
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+_PAGE_PREFIX = "bicimad_stations_"
+
+# Files being written are named with this prefix until renamed into place;
+# ones older than _STALE_PARTIAL_SECONDS were left behind by a crash
+PARTIAL_PREFIX = ".partial_"
+_STALE_PARTIAL_SECONDS = 3600
+
+_template_lock = threading.Lock()
+_template = {"parts": None, "assets": None, "version": None}
+_prepared_dirs = set()
+
+# {{NAME}} slots filled per page; the others are resolved when the shell is loaded
+_DATA_SLOT = re.compile(r"\{\{(STATIONS|CLUSTERS|SOURCE)\}\}")
+
+
+def default_output_dir() -> str:
+    """Directory of the generated pages (BICIMAD_VISUALIZATION_DIR or a temp dir)."""
+    return os.getenv("BICIMAD_VISUALIZATION_DIR") or os.path.join(
+        tempfile.gettempdir(), "bicimad_maps"
+    )
+
+
+def _load_template() -> Tuple[List[str], dict]:
+    """
+    Read the shell and the assets once.
+
+    Returns:
+        Tuple[List[str], dict]: The shell split around its data slots (static
+            text at even indexes, slot names at odd ones), and
+            {relative asset path: content}
+    """
+    if _template["parts"] is not None:
+        return _template["parts"], _template["assets"]
+
+    with _template_lock:
+        if _template["parts"] is None:
+            with open(os.path.join(TEMPLATE_DIR, "bicimad_map.html"), encoding="utf-8") as file:
+                shell = file.read()
+            assets = {}
+            for slot, filename in _ASSETS.items():
+                with open(os.path.join(TEMPLATE_DIR, filename), "rb") as file:
+                    content = file.read()
+                stem, extension = os.path.splitext(filename)
+                digest = hashlib.blake2b(content, digest_size=6).hexdigest()
+                relative = f"assets/{stem}.{digest}{extension}"
+                assets[relative] = content
+                shell = shell.replace("{{" + slot + "}}", relative)
+            shell = shell.replace("{{FIELDS}}", json.dumps(MAP_FIELDS))
+            # Everything besides the snapshot that shapes the page
+            version = hashlib.blake2b(digest_size=8)
+            for item in (shell, json.dumps(CLUSTER_ZOOMS), str(CELL_PIXELS), str(_PAGE_FORMAT)):
+                version.update(item.encode("utf-8"))
+            _template.update(parts=_DATA_SLOT.split(shell), assets=assets, version=version.hexdigest())
+    return _template["parts"], _template["assets"]
+
+
+def _prepare_assets(output_dir: str, assets: dict) -> None:
+    """Write the hashed CSS/JS files into output_dir unless already there."""
+    if output_dir in _prepared_dirs:
+        return
+    for relative, content in assets.items():
+        path = os.path.join(output_dir, relative)
+        if os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a private name first so a concurrent reader never sees half a file
+        partial = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(partial, "wb") as file:
+            file.write(content)
+        os.replace(partial, path)
+    _prepared_dirs.add(output_dir)
+
+
+def _script_safe(text: str) -> str:
+    # "<" never appears unescaped, so station names cannot close the <script>
+    return text.replace("<", "\\u003c")
+
+
+def station_rows(store, positions: np.ndarray) -> list:
+    """Station rows as lists ordered like MAP_FIELDS, built column by column."""
+    index = positions.tolist()
+    lats = np.round(store.lats[positions], 6)
+    lons = np.round(store.lons[positions], 6)
+    missing = np.isnan(lats) | np.isnan(lons)
+    columns = (
+        store.ids[positions].tolist(),
+        [store.numbers[position] for position in index],
+        [store.names[position] for position in index],
+        [store.addresses[position] for position in index],
+        store.dock_bikes[positions].tolist(),
+        store.free_bases[positions].tolist(),
+        store.total_bases[positions].tolist(),
+        store.activate[positions].tolist(),
+        np.where(missing, 0.0, lats).tolist(),
+        np.where(missing, 0.0, lons).tolist(),
+    )
+    rows = [list(row) for row in zip(*columns)]
+    for row_index in np.flatnonzero(missing).tolist():
+        rows[row_index][-2:] = [None, None]
+    return rows
+
+
+def write_station_data(file: TextIO, store, positions: Optional[np.ndarray] = None,
+                       chunk_rows: int = _CHUNK_ROWS) -> int:
+    """
+    Write the stations as a JSON array of rows, one block of rows at a time.
+
+    Each station is an array ordered like MAP_FIELDS rather than an object,
+    so field names are not repeated per station; the page script turns
+    the rows back into objects.
+
+    Args:
+        file: Text file receiving the array
+        store: StationStore of the snapshot
+        positions: Rows to write (all rows if None)
+        chunk_rows: Stations serialized per write
+
+    Returns:
+        int: Number of stations written
+    """
+    if positions is None:
+        positions = np.arange(len(store))
+    file.write("[")
+    for start in range(0, len(positions), chunk_rows):
+        rows = station_rows(store, positions[start:start + chunk_rows])
+        block = json.dumps(rows, ensure_ascii=False, separators=(",", ":"))[1:-1]
+        if start:
+            file.write(",")
+        file.write(_script_safe(block))
+    file.write("]")
+    return len(positions)
+
+
+def write_cluster_data(file: TextIO, levels: Iterable[Tuple[int, np.ndarray]],
+                       chunk_rows: int = _CHUNK_ROWS) -> int:
+    """
+    Write the cluster levels as {"zoom": [cluster row, ...], ...}.
+
+    Args:
+        file: Text file receiving the object
+        levels: (zoom, cluster rows) pairs, see station_clusters.cluster_levels
+        chunk_rows: Clusters serialized per write
+
+    Returns:
+        int: Number of clusters written over all levels
+    """
+    file.write("{")
+    written = 0
+    for index, (zoom, clusters) in enumerate(levels):
+        file.write(f'{"," if index else ""}"{zoom}":[')
+        for start in range(0, len(clusters), chunk_rows):
+            block = clusters[start:start + chunk_rows]
+            # Coordinates rounded to ~10 cm, counts and the member row as integers
+            rows = zip(
+                np.round(block[:, 0], 6).tolist(),
+                np.round(block[:, 1], 6).tolist(),
+                *block[:, 2:].astype(np.int64).T.tolist(),
+            )
+            if start:
+                file.write(",")
+            file.write(json.dumps(list(rows), separators=(",", ":"))[1:-1])
+        file.write("]")
+        written += len(clusters)
+    file.write("}")
+    return written
+
+
+def write_station_map(file: TextIO, store, source: Optional[dict] = None) -> int:
+    """
+    Write the whole map page to a text stream.
+
+    Args:
+        file: Text stream receiving the page (a file or an HTTP response)
+        store: StationStore of the snapshot
+        source: Where the page gets live updates from, e.g.
+            {"version": 12, "events": "/events"}; None for a static page
+
+    Returns:
+        int: Number of stations written
+    """
+    parts, _ = _load_template()
+    count = 0
+    for index, part in enumerate(parts):
+        if index % 2 == 0:
+            file.write(part)
+        elif part == "STATIONS":
+            count = write_station_data(file, store)
+        elif part == "CLUSTERS":
+            write_cluster_data(file, cluster_levels(store))
+        else:
+            file.write(_script_safe(json.dumps(source)))
+    return count
+
+
+def asset(relative_path: str) -> Optional[bytes]:
+    """Content of a hashed asset referenced by the page, e.g. "assets/bicimad_map.<hash>.js"."""
+    return _load_template()[1].get(relative_path)
+
+
+def page_key(store) -> str:
+    """
+    Content address of the page of a snapshot.
+
+    Args:
+        store: StationStore of the snapshot
+
+    Returns:
+        str: Hash of the station data and of the template and render options
+    """
+    _load_template()
+    key = hashlib.blake2b(digest_size=12)
+    key.update(store.digest().encode("ascii"))
+    key.update(_template["version"].encode("ascii"))
+    return key.hexdigest()
+
+
+def evict_pages(output_dir: str, max_files: int = DEFAULT_MAX_FILES,
+                max_bytes: int = DEFAULT_MAX_BYTES, keep: Optional[str] = None,
+                prefix: str = _PAGE_PREFIX, suffix: str = ".html") -> int:
+    """
+    Delete the least recently used pages beyond a count and size budget.
+
+    Pages are touched whenever they are served from the cache, so the file
+    modification time orders them by last use. Partial files of the same
+    suffix left behind by an interrupted write are removed too.
+
+    Args:
+        output_dir: Directory of the pages
+        max_files: Maximum number of pages kept
+        max_bytes: Maximum total size of the pages
+        keep: Path never evicted (the page just returned)
+        prefix: File name prefix of the cached files
+        suffix: File name suffix of the cached files
+
+    Returns:
+        int: Number of pages deleted
+    """
+    pages, stale = [], []
+    stale_before = time.time() - _STALE_PARTIAL_SECONDS
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith(suffix):
+                continue
+            is_page = entry.name.startswith(prefix)
+            if not is_page and not entry.name.startswith(PARTIAL_PREFIX):
+                continue
+            try:
+                info = entry.stat()
+            except FileNotFoundError:
+                continue
+            if is_page:
+                pages.append((info.st_mtime, info.st_size, entry.path))
+            elif info.st_mtime < stale_before:
+                # A partial file still being written is younger than that
+                stale.append(entry.path)
+
+    for path in stale:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    # Most recently used first; everything past the budget goes
+    pages.sort(reverse=True)
+    kept_files, kept_bytes, deleted = 0, 0, 0
+    for _, size, path in pages:
+        if path == keep or (kept_files < max_files and kept_bytes + size <= max_bytes):
+            kept_files += 1
+            kept_bytes += size
+            continue
+        try:
+            os.remove(path)
+            deleted += 1
+        except FileNotFoundError:
+            pass
+    return deleted
+
+
+def render_station_map(store, output_dir: Optional[str] = None,
+                       max_files: int = DEFAULT_MAX_FILES,
+                       max_bytes: int = DEFAULT_MAX_BYTES) -> Tuple[str, int, bool]:
+    """
+    Return the map page of a snapshot, rendering it only if not cached.
+
+    Pages are named after page_key(), so an unchanged snapshot maps to the
+    page already on disk and is neither rendered nor written again.
+
+    Args:
+        store: StationStore of the snapshot
+        output_dir: Directory of the page and its assets (default_output_dir() if None)
+        max_files: Maximum number of pages kept in output_dir
+        max_bytes: Maximum total size of the pages in output_dir
+
+    Returns:
+        Tuple[str, int, bool]: Path of the HTML file, number of stations, and
+            whether an existing page was reused
+    """
+    output_dir = output_dir or default_output_dir()
+    path = os.path.join(output_dir, f"{_PAGE_PREFIX}{page_key(store)}.html")
+    try:
+        # Mark as recently used for the eviction order
+        os.utime(path)
+        return path, len(store), True
+    except FileNotFoundError:
+        pass
+
+    _, assets = _load_template()
+    os.makedirs(output_dir, exist_ok=True)
+    _prepare_assets(output_dir, assets)
+
+    # Written under a temporary name and renamed, so a page is never seen half written
+    file = tempfile.NamedTemporaryFile(
+        mode="w", dir=output_dir, prefix=PARTIAL_PREFIX, suffix=".html",
+        delete=False, encoding="utf-8",
+    )
+    try:
+        with file:
+            count = write_station_map(file, store)
+        os.replace(file.name, path)
+    except BaseException:
+        if os.path.exists(file.name):
+            os.remove(file.name)
+        raise
+    evict_pages(output_dir, max_files, max_bytes, keep=path)
+    return path, count, False
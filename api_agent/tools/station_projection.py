@@ -0,0 +1,293 @@
+"""Compact station output for the model: projection, ordering, summaries.
+
+The full EMT list is several hundred kilobytes of JSON, most of which the
+model never reads. These helpers build tool output directly from the
+StationStore columns:
+
+    project_stations()  only the requested fields of the selected rows
+    order_positions()   vectorized sort_by / limit on the columns
+    summarize_stations() network totals plus the top-N relevant stations
+    fit_to_budget()     truncates lists so the JSON stays under a byte cap
+"""
+
+import json
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Fields a caller may request; "latitude"/"longitude" are flattened from geometry
+STATION_FIELDS = (
+    "id", "number", "name", "address", "dock_bikes", "free_bases", "total_bases",
+    "reservations_count", "activate", "no_available", "light", "latitude", "longitude",
+    "geometry",
+)
+
+# Fields returned when none are requested but the output has to be lean
+DEFAULT_FIELDS = ("id", "name", "dock_bikes", "free_bases", "total_bases", "activate")
+
+# Numeric columns usable in sort_by, plus the derived occupancy ratio
+SORT_KEYS = (
+    "id", "dock_bikes", "free_bases", "total_bases", "reservations_count",
+    "activate", "no_available", "light", "occupancy",
+)
+
+DEFAULT_MAX_RESPONSE_BYTES = 32000
+
+# Advice added to a response whose lists were cut to the byte budget
+BUDGET_HINT = "Use fields=, limit=, sort_by= or summary=True for a smaller answer."
+
+# Bytes of the "truncated", "returned_count", "total_count" and "hint" keys (hint text excluded)
+_TRUNCATION_OVERHEAD = 96
+
+_STRING_COLUMNS = {"number": "numbers", "name": "names", "address": "addresses"}
+
+
+def parse_fields(fields) -> Optional[List[str]]:
+    """
+    Validate a fields selection.
+
+    Args:
+        fields: List of field names, a comma-separated string, or None
+
+    Returns:
+        Optional[List[str]]: The fields in request order, or None for all
+
+    Raises:
+        ValueError: If a field is unknown
+    """
+    if fields is None or fields == "" or fields == []:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    fields = [str(field).strip() for field in fields if str(field).strip()]
+    unknown = [field for field in fields if field not in STATION_FIELDS]
+    if unknown:
+        raise ValueError(
+            f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(STATION_FIELDS)}"
+        )
+    return list(dict.fromkeys(fields))
+
+
+def _sort_column(store, key: str) -> np.ndarray:
+    if key == "occupancy":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratio = store.dock_bikes / np.maximum(store.total_bases, 1)
+        return ratio.astype(np.float64)
+    return getattr(store, key if key != "id" else "ids")
+
+
+def order_positions(store, positions: Optional[np.ndarray] = None,
+                    sort_by: Optional[str] = None, limit: Optional[int] = None) -> np.ndarray:
+    """
+    Sort and cut a selection of rows using the store columns.
+
+    Args:
+        store: StationStore of the snapshot
+        positions: Rows to order (all rows if None)
+        sort_by: Column name, prefixed with "-" for descending order
+        limit: Maximum number of rows kept
+
+    Returns:
+        np.ndarray: Selected rows in output order
+
+    Raises:
+        ValueError: If sort_by is not a sortable column
+    """
+    if positions is None:
+        positions = np.arange(len(store))
+    if sort_by:
+        key = sort_by.strip()
+        descending = key.startswith("-")
+        key = key.lstrip("-+")
+        if key not in SORT_KEYS:
+            raise ValueError(f"Cannot sort by '{key}'. Available: {', '.join(SORT_KEYS)}")
+        values = _sort_column(store, key)[positions]
+        if descending:
+            values = -values.astype(np.float64)
+        # Stable sort on the column, station id as the tie breaker
+        order = np.lexsort((store.ids[positions], values))
+        positions = positions[order]
+    if limit is not None and limit >= 0:
+        positions = positions[:int(limit)]
+    return positions
+
+
+def project_stations(store, positions: Sequence[int],
+                     fields: Optional[Sequence[str]] = None) -> List[dict]:
+    """
+    Build station dicts holding only the requested fields.
+
+    Args:
+        store: StationStore of the snapshot
+        positions: Rows to output, in order
+        fields: Field names from STATION_FIELDS (all EMT fields if None)
+
+    Returns:
+        List[dict]: One dict per row
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    if fields is None:
+        return store.to_records(positions)
+
+    # Column-wise extraction: one tolist() per field instead of per-row lookups
+    columns: Dict[str, list] = {}
+    for field in fields:
+        if field in _STRING_COLUMNS:
+            values = getattr(store, _STRING_COLUMNS[field])
+            columns[field] = [values[position] for position in positions.tolist()]
+        elif field == "latitude":
+            columns[field] = [None if np.isnan(v) else v for v in store.lats[positions].tolist()]
+        elif field == "longitude":
+            columns[field] = [None if np.isnan(v) else v for v in store.lons[positions].tolist()]
+        elif field == "geometry":
+            columns[field] = [
+                None if np.isnan(lat) else {"type": "Point", "coordinates": [lon, lat]}
+                for lat, lon in zip(store.lats[positions].tolist(), store.lons[positions].tolist())
+            ]
+        else:
+            columns[field] = getattr(store, field if field != "id" else "ids")[positions].tolist()
+    return [dict(zip(fields, row)) for row in zip(*(columns[field] for field in fields))]
+
+
+def project_record(station: dict, fields: Optional[Sequence[str]] = None) -> dict:
+    """
+    Project one raw EMT station dict (used for API fallbacks).
+
+    Args:
+        station: Station as returned by the EMT API
+        fields: Field names from STATION_FIELDS (unchanged if None)
+
+    Returns:
+        dict: The projected station
+    """
+    if fields is None:
+        return station
+    coordinates = (station.get("geometry") or {}).get("coordinates") or [None, None]
+    flattened = dict(station, longitude=coordinates[0], latitude=coordinates[1])
+    return {field: flattened.get(field) for field in fields}
+
+
+def summarize_stations(store, top: int = 5, fields: Optional[Sequence[str]] = None) -> dict:
+    """
+    Aggregate the network state and pick the stations worth mentioning.
+
+    Args:
+        store: StationStore of the snapshot
+        top: Number of stations per highlight list
+        fields: Fields of the highlighted stations (DEFAULT_FIELDS if None)
+
+    Returns:
+        dict: Totals and the top stations by bikes, plus empty and full stations
+    """
+    fields = list(fields or DEFAULT_FIELDS)
+    active = store.activate.astype(bool) & (store.no_available == 0)
+    bikes = store.dock_bikes.astype(np.int64)
+    docks = store.free_bases.astype(np.int64)
+    total = store.total_bases.astype(np.int64)
+    empty = active & (bikes == 0)
+    full = active & (docks == 0)
+
+    def highlight(mask: np.ndarray, sort_by: str) -> List[dict]:
+        rows = order_positions(store, np.flatnonzero(mask), sort_by, top)
+        return project_stations(store, rows, fields)
+
+    capacity = int(total[active].sum())
+    return {
+        "totals": {
+            "stations": int(len(store)),
+            "active_stations": int(active.sum()),
+            "inactive_stations": int(len(store) - active.sum()),
+            "available_bikes": int(bikes[active].sum()),
+            "free_docks": int(docks[active].sum()),
+            "total_docks": capacity,
+            "occupancy_pct": round(100 * int(bikes[active].sum()) / capacity) if capacity else 0,
+            "empty_stations": int(empty.sum()),
+            "full_stations": int(full.sum()),
+        },
+        "top_stations": {
+            "most_bikes": highlight(active, "-dock_bikes"),
+            "most_free_docks": highlight(active, "-free_bases"),
+            "empty": highlight(empty, "-total_bases"),
+            "full": highlight(full, "-total_bases"),
+        },
+    }
+
+
+def fit_to_budget(result: dict, container: dict, key: str, items: List[dict],
+                  max_bytes: int, hint: str = BUDGET_HINT) -> dict:
+    """
+    Store `items` under container[key], dropping trailing items beyond a byte budget.
+
+    Sizes are measured once per item, so the cut is found without
+    re-serializing the whole response.
+
+    Args:
+        result: The whole response dict (what the budget applies to)
+        container: Dict inside `result` receiving the list (may be `result`)
+        key: Key of the list in `container`
+        items: List to include
+        max_bytes: Upper bound of the JSON-encoded response
+        hint: Advice stored in the response when items were dropped
+
+    Returns:
+        dict: `result`, with truncation metadata if items were dropped
+    """
+    return fit_lists_to_budget(result, [(container, key, items)], max_bytes, hint)
+
+
+def fit_lists_to_budget(result: dict, lists: Sequence[Tuple[dict, str, List[dict]]],
+                        max_bytes: int, hint: str = BUDGET_HINT) -> dict:
+    """
+    Store several lists in `result`, cutting them to a common length so the
+    JSON-encoded response stays under a byte budget.
+
+    Args:
+        result: The whole response dict (what the budget applies to)
+        lists: (container, key, items) triples; each container is `result`
+            or a dict inside it, receiving container[key] = items
+        max_bytes: Upper bound of the JSON-encoded response
+        hint: Advice stored in the response when items were dropped
+
+    Returns:
+        dict: `result`, with truncation metadata if items were dropped
+        ("returned_count" and "total_count" add up all the lists)
+    """
+    for container, key, _ in lists:
+        container[key] = []
+    # ASCII-escaped JSON is never shorter than UTF-8, so the bound holds either way
+    base = len(json.dumps(result))
+    # Size of the first n items of each list (plus a separator each) is cumulative[n]
+    cumulative = [
+        np.concatenate(([0], np.cumsum(np.fromiter(
+            (len(json.dumps(item)) + 2 for item in items), dtype=np.int64, count=len(items)
+        ))))
+        for _, _, items in lists
+    ]
+    if base + sum(int(sizes[-1]) for sizes in cumulative) <= max_bytes:
+        for container, key, items in lists:
+            container[key] = items
+        return result
+
+    def size(count: int) -> int:
+        return sum(int(sizes[min(count, len(sizes) - 1)]) for sizes in cumulative)
+
+    # Room for the truncation metadata added below
+    room = max_bytes - base - _TRUNCATION_OVERHEAD - len(json.dumps(hint))
+    # Largest common length that fits (size() grows with the length)
+    low, high = 0, max(len(items) for _, _, items in lists)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if size(middle) <= room:
+            low = middle
+        else:
+            high = middle - 1
+
+    returned = 0
+    for container, key, items in lists:
+        container[key] = items[:low]
+        returned += len(container[key])
+    result["truncated"] = True
+    result["returned_count"] = returned
+    result["total_count"] = sum(len(items) for _, _, items in lists)
+    result["hint"] = hint
+    return result
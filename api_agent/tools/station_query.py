@@ -0,0 +1,223 @@
+"""Attribute-indexed queries over the station snapshot.
+
+Questions such as "active stations with at least 5 bikes in this area,
+ordered by free docks" are answered from the StationStore columns instead
+of handing the whole list to the model. Every filterable column is kept
+sorted once per snapshot (an argsort plus the sorted values), so a range
+predicate is two binary searches. A query starts from the narrowest range,
+checks the other predicates on those rows only and orders the matches by
+precomputed ranks, keeping just the first `limit` rows.
+"""
+
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .station_projection import SORT_KEYS, _sort_column
+
+# Range-filterable columns: query name -> StationStore attribute
+RANGE_COLUMNS = {
+    "dock_bikes": "dock_bikes",
+    "free_bases": "free_bases",
+    "total_bases": "total_bases",
+    "latitude": "lats",
+    "longitude": "lons",
+}
+
+# Sort keys ranked when the index is built
+_PRERANKED = ("dock_bikes", "free_bases")
+
+
+class StationQueryIndex:
+    """
+    Sorted column indexes of one StationStore.
+
+    Attributes:
+        store: The indexed StationStore
+        active: Boolean mask of the stations in service
+    """
+
+    def __init__(self, store):
+        """
+        Sort the range columns of a store.
+
+        Args:
+            store: StationStore of the snapshot
+        """
+        self.store = store
+        self.active = (store.activate == 1) & (store.no_available == 0)
+        self._orders: Dict[str, np.ndarray] = {}
+        self._sorted: Dict[str, np.ndarray] = {}
+        for name, attribute in RANGE_COLUMNS.items():
+            values = getattr(store, attribute)
+            # NaN coordinates sort last and never fall inside a finite range
+            order = np.argsort(values, kind="stable")
+            self._orders[name] = order
+            self._sorted[name] = values[order]
+        # Sort ranks per (key, descending); the usual ones are ranked up front,
+        # off the query path, the others on first use
+        self._ranks: Dict[Tuple[str, bool], np.ndarray] = {}
+        for key in _PRERANKED:
+            self.rank(key, False)
+            self.rank(key, True)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def range_bounds(self, column: str, low: Optional[float], high: Optional[float]) -> Tuple[int, int]:
+        """
+        Locate the rows with low <= value <= high in the sorted column.
+
+        Args:
+            column: One of RANGE_COLUMNS
+            low: Inclusive lower bound (unbounded if None)
+            high: Inclusive upper bound (unbounded if None)
+
+        Returns:
+            Tuple[int, int]: Slice of the column's sort order holding the rows
+        """
+        values = self._sorted[column]
+        start = 0 if low is None else int(np.searchsorted(values, low, side="left"))
+        # An open upper end still stops before the NaNs of the coordinate columns
+        stop = int(np.searchsorted(values, np.inf if high is None else high, side="right"))
+        return start, max(start, stop)
+
+    def rank(self, key: str, descending: bool = False) -> np.ndarray:
+        """
+        Position of every row in the order of a sort key (station id breaks ties).
+
+        Args:
+            key: One of SORT_KEYS
+            descending: Rank the largest values first
+
+        Returns:
+            np.ndarray: Rank per row
+        """
+        ranks = self._ranks.get((key, descending))
+        if ranks is None:
+            values = _sort_column(self.store, key).astype(np.float64)
+            order = np.lexsort((self.store.ids, -values if descending else values))
+            ranks = np.empty(len(order), dtype=np.int64)
+            ranks[order] = np.arange(len(order))
+            self._ranks[(key, descending)] = ranks
+        return ranks
+
+    def query(self, ranges: Dict[str, Tuple[Optional[float], Optional[float]]],
+              active: Optional[bool] = True, sort_by: Optional[str] = None,
+              limit: Optional[int] = None) -> Tuple[np.ndarray, int]:
+        """
+        Select the rows matching every predicate.
+
+        Args:
+            ranges: Column name -> (low, high) inclusive bounds, None for open ends
+            active: True for stations in service only, False for those out of
+                service only, None for both
+            sort_by: Key from SORT_KEYS, prefixed with "-" for descending order
+            limit: Maximum number of rows returned
+
+        Returns:
+            Tuple[np.ndarray, int]: Matching rows in output order, and the
+            number of matches before the limit
+
+        Raises:
+            ValueError: If a column or the sort key is unknown
+        """
+        unknown = [column for column in ranges if column not in RANGE_COLUMNS]
+        if unknown:
+            raise ValueError(f"Cannot filter on {', '.join(unknown)}. Available: {', '.join(RANGE_COLUMNS)}")
+
+        bounds = {column: self.range_bounds(column, *limits) for column, limits in ranges.items()}
+        if bounds:
+            # Start from the most selective predicate, check the others on its rows
+            narrowest = min(bounds, key=lambda column: bounds[column][1] - bounds[column][0])
+            start, stop = bounds[narrowest]
+            positions = self._orders[narrowest][start:stop]
+            mask = np.ones(len(positions), dtype=bool)
+            for column, (low, high) in ranges.items():
+                if column == narrowest:
+                    continue
+                values = getattr(self.store, RANGE_COLUMNS[column])[positions]
+                if low is not None:
+                    mask &= values >= low
+                if high is not None:
+                    mask &= values <= high
+        else:
+            positions = np.arange(len(self.store))
+            mask = np.ones(len(positions), dtype=bool)
+        if active is not None:
+            mask &= self.active[positions] == bool(active)
+        positions = positions[mask]
+        total = len(positions)
+
+        if limit is not None:
+            limit = max(int(limit), 0)
+        if sort_by:
+            key = sort_by.strip()
+            descending = key.startswith("-")
+            key = key.lstrip("-+")
+            if key not in SORT_KEYS:
+                raise ValueError(f"Cannot sort by '{key}'. Available: {', '.join(SORT_KEYS)}")
+            ranks = self.rank(key, descending)[positions]
+            if limit is not None and limit < len(positions):
+                # Only the first `limit` rows need a full sort
+                keep = np.argpartition(ranks, limit - 1)[:limit] if limit else np.empty(0, dtype=np.int64)
+                positions, ranks = positions[keep], ranks[keep]
+            positions = positions[np.argsort(ranks)]
+        else:
+            positions = np.sort(positions)
+        if limit is not None:
+            positions = positions[:limit]
+        return positions, total
+
+
+def parse_bbox(bbox: Optional[Sequence[float]]) -> Dict[str, Tuple[float, float]]:
+    """
+    Turn a bounding box into latitude and longitude ranges.
+
+    Args:
+        bbox: [south, west, north, east] in degrees, or None
+
+    Returns:
+        Dict[str, Tuple[float, float]]: Ranges for StationQueryIndex.query()
+
+    Raises:
+        ValueError: If the box is malformed
+    """
+    if bbox is None:
+        return {}
+    try:
+        south, west, north, east = (float(value) for value in bbox)
+    except (TypeError, ValueError):
+        raise ValueError("bbox must be [south, west, north, east] in degrees")
+    if south > north or west > east:
+        raise ValueError("bbox must be [south, west, north, east] with south <= north and west <= east")
+    return {"latitude": (south, north), "longitude": (west, east)}
+
+
+# Query index of the last station store, rebuilt only when the stations change
+_query_cache = {
+    "store": None,
+    "index": None
+}
+_query_lock = threading.Lock()
+
+
+def get_query_index(snapshot) -> StationQueryIndex:
+    """
+    Return the query index of a station snapshot, building it once.
+
+    Also usable as a StationSnapshotCache listener to build the index as
+    soon as a snapshot arrives.
+
+    Args:
+        snapshot: StationSnapshot from the station cache
+
+    Returns:
+        StationQueryIndex: Index over the rows of snapshot.store
+    """
+    with _query_lock:
+        if _query_cache["store"] is not snapshot.store:
+            _query_cache["index"] = StationQueryIndex(snapshot.store)
+            _query_cache["store"] = snapshot.store
+        return _query_cache["index"]
@@ -0,0 +1,249 @@
+"""Accent- and case-insensitive text search over station names and addresses.
+
+Users name stations loosely ("Sol", "atocha", "glorieta de bilbao"). The
+names, addresses and street numbers of the snapshot are folded (accents
+stripped, lower-cased, punctuation removed), split into words and indexed:
+
+    inverted index   word -> stations holding it (CSR arrays per field)
+    sorted words     prefix lookups ("atoc" -> "atocha") by binary search,
+                     a flattened prefix trie over the vocabulary
+    trigrams         trigram -> words, for misspellings ("bilvao")
+
+A query scores every station with the IDF of the words it matches, name
+matches weighing more than address matches. The index depends only on the
+text columns, so snapshots where just the bike counts changed reuse it.
+TextIndex is the same index over any texts (the gazetteer uses it too).
+"""
+
+import bisect
+import hashlib
+import math
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Weight of a match per field: name words count more than address words
+_FIELD_WEIGHTS = (("names", 1.0), ("addresses", 0.5), ("numbers", 1.5))
+
+# Weight of a word matched by prefix or by trigram similarity (times the similarity)
+_PREFIX_WEIGHT = 0.7
+_FUZZY_WEIGHT = 0.6
+# Minimum trigram (Dice) similarity for a fuzzy match
+_MIN_SIMILARITY = 0.5
+# Prefix matches expand to at most this many words
+_MAX_PREFIX_WORDS = 64
+
+# Spanish function words, which do not identify a station or a place
+STOP_WORDS = frozenset((
+    "a", "al", "c", "con", "de", "del", "el", "en", "la", "las", "los", "n", "no", "s", "y",
+))
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def fold(text: str) -> str:
+    """
+    Fold text for matching: strip accents, lower-case, keep letters and digits.
+
+    Args:
+        text: Any text
+
+    Returns:
+        str: Folded words separated by single spaces
+    """
+    decomposed = unicodedata.normalize("NFKD", str(text).casefold())
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return _NON_WORD.sub(" ", stripped).strip()
+
+
+def _words(text: str) -> List[str]:
+    return [word for word in fold(text).split() if word not in STOP_WORDS]
+
+
+def _trigrams(word: str) -> set:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TextIndex:
+    """
+    Folded-word index over a few text fields of the same rows.
+
+    Attributes:
+        size: Number of rows indexed
+        vocabulary: Sorted list of the indexed words
+    """
+
+    def __init__(self, fields: Sequence[Tuple[Sequence[str], float]], size: int):
+        """
+        Index the text fields of `size` rows.
+
+        Args:
+            fields: (texts, weight) per field, one text per row
+            size: Number of rows
+        """
+        self.size = size
+        postings: Dict[str, Dict[int, float]] = {}
+        for texts, weight in fields:
+            for position, text in enumerate(texts):
+                for word in set(_words(text)):
+                    rows = postings.setdefault(word, {})
+                    # A word in several fields counts once, with its best weight
+                    if rows.get(position, 0.0) < weight:
+                        rows[position] = weight
+
+        self.vocabulary: List[str] = sorted(postings)
+        # CSR layout: the rows holding word i are rows[offsets[i]:offsets[i + 1]]
+        counts = [len(postings[word]) for word in self.vocabulary]
+        self._offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self._offsets[1:])
+        self._rows = np.fromiter(
+            (row for word in self.vocabulary for row in postings[word]),
+            dtype=np.int64, count=int(self._offsets[-1]),
+        )
+        self._weights = np.fromiter(
+            (weight for word in self.vocabulary for weight in postings[word].values()),
+            dtype=np.float64, count=int(self._offsets[-1]),
+        )
+        # Rare words identify a row better than "calle" or "plaza"
+        self._idf = np.log1p(max(self.size, 1) / np.maximum(np.asarray(counts, dtype=np.float64), 1.0))
+
+        self._trigram_words: Dict[str, List[int]] = {}
+        for word_id, word in enumerate(self.vocabulary):
+            for trigram in _trigrams(word):
+                self._trigram_words.setdefault(trigram, []).append(word_id)
+
+    def _prefix_range(self, prefix: str) -> Tuple[int, int]:
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        stop = bisect.bisect_left(self.vocabulary, prefix + "\uffff", start)
+        return start, stop
+
+    def _fuzzy_words(self, word: str) -> List[Tuple[int, float]]:
+        trigrams = _trigrams(word)
+        shared: Dict[int, int] = {}
+        for trigram in trigrams:
+            for word_id in self._trigram_words.get(trigram, ()):
+                shared[word_id] = shared.get(word_id, 0) + 1
+        matches = []
+        for word_id, common in shared.items():
+            # Dice coefficient over the trigram sets
+            similarity = 2.0 * common / (len(trigrams) + len(_trigrams(self.vocabulary[word_id])))
+            if similarity >= _MIN_SIMILARITY:
+                matches.append((word_id, similarity))
+        return matches
+
+    def _word_matches(self, word: str) -> List[Tuple[int, float]]:
+        """Vocabulary words matching one query word, with their match weight."""
+        start, stop = self._prefix_range(word)
+        if start < stop:
+            matches = []
+            for word_id in range(start, min(stop, start + _MAX_PREFIX_WORDS)):
+                matches.append((word_id, 1.0 if self.vocabulary[word_id] == word else _PREFIX_WEIGHT))
+            return matches
+        # Neither the word nor a longer word starting with it: assume a typo
+        return [(word_id, _FUZZY_WEIGHT * similarity) for word_id, similarity in self._fuzzy_words(word)]
+
+    def search(self, text: str, limit: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rank the rows matching a text.
+
+        Args:
+            text: Words to look for (whole, prefixes or misspelt)
+            limit: Maximum number of rows returned
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The best rows and their scores
+            (0..1, the share of the query matched), best first
+        """
+        words = list(dict.fromkeys(_words(text))) or fold(text).split()
+        if not words or not self.size:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        scores = np.zeros(self.size)
+        total_idf = 0.0
+        for word in words:
+            matches = self._word_matches(word)
+            best = np.zeros(self.size)
+            for word_id, weight in matches:
+                start, stop = self._offsets[word_id], self._offsets[word_id + 1]
+                rows = self._rows[start:stop]
+                # Only the best variant of a query word counts for each row
+                # (rows are unique within a posting list)
+                best[rows] = np.maximum(best[rows], weight * self._weights[start:stop] * self._idf[word_id])
+            # The best possible score of the word: its own IDF when indexed,
+            # the rarest variant otherwise (or a unique word if nothing matched)
+            exact = [word_id for word_id, weight in matches if weight == 1.0]
+            total_idf += float(self._idf[exact[0]]) if exact else max(
+                (float(self._idf[word_id]) for word_id, _ in matches), default=math.log1p(self.size)
+            )
+            scores += best
+
+        matched = np.flatnonzero(scores > 0)
+        if not len(matched):
+            return matched, np.empty(0)
+        # Best score first, lowest row as the tie breaker
+        order = np.lexsort((matched, -scores[matched]))[:max(int(limit), 0)]
+        rows = matched[order]
+        # An exact match of every word in a weight-1 field scores 1
+        return rows, np.minimum(scores[rows] / total_idf, 1.0)
+
+
+class StationSearchIndex(TextIndex):
+    """Text index over the names, addresses and numbers of one StationStore."""
+
+    def __init__(self, store):
+        """
+        Index the text columns of a store.
+
+        Args:
+            store: StationStore of the snapshot
+        """
+        super().__init__([(getattr(store, attribute), weight) for attribute, weight in _FIELD_WEIGHTS],
+                         len(store))
+
+
+def _text_key(store) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(store.ids.tobytes())
+    for attribute, _ in _FIELD_WEIGHTS:
+        digest.update("\x00".join(getattr(store, attribute)).encode("utf-8"))
+        digest.update(b"\x01")
+    return digest.hexdigest()
+
+
+# Search index of the last station texts, rebuilt only when names or addresses change
+_search_cache = {
+    "store": None,
+    "key": None,
+    "index": None
+}
+_search_lock = threading.Lock()
+
+
+def get_search_index(snapshot) -> StationSearchIndex:
+    """
+    Return the text index of a station snapshot, building it only when the
+    station ids, names, addresses or numbers changed.
+
+    Also usable as a StationSnapshotCache listener to rebuild the index as
+    soon as a snapshot arrives.
+
+    Args:
+        snapshot: StationSnapshot from the station cache
+
+    Returns:
+        StationSearchIndex: Index over the rows of snapshot.store
+    """
+    with _search_lock:
+        store = snapshot.store
+        if _search_cache["store"] is not store:
+            key = _text_key(store)
+            if key != _search_cache["key"]:
+                _search_cache["index"] = StationSearchIndex(store)
+                _search_cache["key"] = key
+            _search_cache["store"] = store
+        index: Optional[StationSearchIndex] = _search_cache["index"]
+        return index
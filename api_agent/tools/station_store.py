@@ -0,0 +1,276 @@
+"""Compact columnar store for one BiciMAD station snapshot.
+
+The EMT API returns the stations as a list of nested JSON dicts. Keeping
+that list around costs several hundred bytes per station and every scan
+has to walk the dicts again. StationStore parses a snapshot once into a
+struct-of-arrays layout: one NumPy column per numeric field and interned
+strings for names and addresses. Filters and aggregations become vectorized
+operations on the columns; station dicts are only rebuilt for the rows a
+tool actually returns.
+
+StationStoreBuilder fills a store one station at a time, for payloads that
+are parsed while they stream in and whose size is not known in advance.
+"""
+
+import hashlib
+import sys
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .spatial_index import station_coordinates
+
+# Numeric columns and their NumPy types
+_INT_COLUMNS = {
+    "dock_bikes": np.int16,
+    "free_bases": np.int16,
+    "total_bases": np.int16,
+    "reservations_count": np.int16,
+    "activate": np.int8,
+    "no_available": np.int8,
+    "light": np.int8,
+}
+
+
+def _as_int(value, default: int = 0) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _intern(value) -> str:
+    return sys.intern(str(value)) if value is not None else ""
+
+
+class StationStore:
+    """
+    Struct-of-arrays view of a station list.
+
+    Attributes:
+        ids: Station ids (int64, -1 if the id is not numeric)
+        lats: Latitudes (float64, NaN if unknown)
+        lons: Longitudes (float64, NaN if unknown)
+        dock_bikes: Available bikes
+        free_bases: Free docks
+        total_bases: Total docks
+        reservations_count: Active reservations
+        activate: 1 if the station is active
+        no_available: 1 if the station is flagged as unavailable
+        light: EMT occupancy light (0 green .. 3 red)
+        numbers: Station numbers as shown on the street (interned strings)
+        names: Station names (interned strings)
+        addresses: Station addresses (interned strings)
+    """
+
+    def __init__(self, size: int):
+        """
+        Allocate empty columns for `size` stations.
+
+        Args:
+            size: Number of stations
+        """
+        self.ids = np.full(size, -1, dtype=np.int64)
+        self.lats = np.full(size, np.nan, dtype=np.float64)
+        self.lons = np.full(size, np.nan, dtype=np.float64)
+        for column, dtype in _INT_COLUMNS.items():
+            setattr(self, column, np.zeros(size, dtype=dtype))
+        self.numbers: List[str] = [""] * size
+        self.names: List[str] = [""] * size
+        self.addresses: List[str] = [""] * size
+        # Sorted view of `ids` for binary-search lookups, see finalize()
+        self._id_order = np.empty(0, dtype=np.int64)
+        self._sorted_ids = np.empty(0, dtype=np.int64)
+        # Only the (rare) non-numeric ids need a dict entry
+        self._other_ids: Dict[str, int] = {}
+        self._digest: Optional[str] = None
+
+    def set_row(self, position: int, station: dict) -> None:
+        """
+        Write one EMT station dict into the columns.
+
+        Args:
+            position: Row to write
+            station: Station as returned by the EMT API
+        """
+        station_id = station.get("id")
+        self.ids[position] = _as_int(station_id, -1)
+        if self.ids[position] == -1:
+            self._other_ids[str(station_id)] = position
+        coordinates = station_coordinates(station)
+        if coordinates is not None:
+            self.lats[position], self.lons[position] = coordinates
+        for column in _INT_COLUMNS:
+            getattr(self, column)[position] = _as_int(station.get(column))
+        self.numbers[position] = _intern(station.get("number", station_id))
+        self.names[position] = _intern(station.get("name"))
+        self.addresses[position] = _intern(station.get("address"))
+
+    def finalize(self) -> "StationStore":
+        """
+        Build the id lookup index once every row has been written.
+
+        Returns:
+            StationStore: self, for chaining
+        """
+        self._id_order = np.argsort(self.ids, kind="stable")
+        self._sorted_ids = self.ids[self._id_order]
+        self._digest = None
+        return self
+
+    @classmethod
+    def from_records(cls, stations: List[dict]) -> "StationStore":
+        """
+        Build a store from a list of EMT station dicts.
+
+        Args:
+            stations: Stations as returned by the EMT API
+
+        Returns:
+            StationStore: The columnar store
+        """
+        store = cls(len(stations))
+        for position, station in enumerate(stations):
+            store.set_row(position, station)
+        return store.finalize()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def position_of(self, station_id) -> Optional[int]:
+        """
+        Return the row of a station id, or None if unknown.
+
+        Args:
+            station_id: Station id (int or string)
+        """
+        numeric_id = _as_int(station_id, -1)
+        if numeric_id == -1 or str(station_id).strip() != str(numeric_id):
+            return self._other_ids.get(str(station_id))
+
+        index = int(np.searchsorted(self._sorted_ids, numeric_id))
+        if index < len(self._sorted_ids) and self._sorted_ids[index] == numeric_id:
+            return int(self._id_order[index])
+        return None
+
+    def has_coordinates(self) -> np.ndarray:
+        """Boolean mask of the rows with known coordinates."""
+        return ~(np.isnan(self.lats) | np.isnan(self.lons))
+
+    def record(self, position: int) -> dict:
+        """
+        Rebuild the EMT-style dict of one station.
+
+        Args:
+            position: Row of the station
+
+        Returns:
+            dict: Station with the same keys as the EMT API response
+        """
+        station = {
+            "id": int(self.ids[position]),
+            "number": self.numbers[position],
+            "name": self.names[position],
+            "address": self.addresses[position],
+        }
+        for column in _INT_COLUMNS:
+            station[column] = int(getattr(self, column)[position])
+        if not np.isnan(self.lats[position]):
+            station["geometry"] = {
+                "type": "Point",
+                "coordinates": [float(self.lons[position]), float(self.lats[position])]
+            }
+        return station
+
+    def to_records(self, positions: Optional[Iterable[int]] = None) -> List[dict]:
+        """
+        Rebuild the EMT-style dicts of several stations.
+
+        Args:
+            positions: Rows to rebuild, all rows if None
+
+        Returns:
+            List[dict]: Stations in the requested order
+        """
+        if positions is None:
+            positions = range(len(self))
+        return [self.record(int(position)) for position in positions]
+
+    def nbytes(self) -> int:
+        """Approximate memory used by the columns and string references."""
+        arrays = [self.ids, self.lats, self.lons] + [getattr(self, c) for c in _INT_COLUMNS]
+        # One pointer per string reference; interned strings are shared
+        return sum(a.nbytes for a in arrays) + 3 * 8 * len(self)
+
+    def digest(self) -> str:
+        """
+        Hash of every column, computed once per store.
+
+        Stores are not modified after finalize(), so two snapshots with the
+        same digest hold the same stations.
+
+        Returns:
+            str: Hex digest
+        """
+        if self._digest is None:
+            content = hashlib.blake2b(digest_size=16)
+            for array in [self.ids, self.lats, self.lons] + [getattr(self, c) for c in _INT_COLUMNS]:
+                content.update(array.tobytes())
+            for values in (self.numbers, self.names, self.addresses):
+                content.update("\0".join(values).encode("utf-8", "surrogatepass"))
+            self._digest = content.hexdigest()
+        return self._digest
+
+    def _resize(self, size: int) -> None:
+        """Grow or shrink every column to `size` rows, keeping existing rows."""
+        kept = min(size, len(self))
+        for column, fill in [("ids", -1), ("lats", np.nan), ("lons", np.nan)] + \
+                [(column, 0) for column in _INT_COLUMNS]:
+            old = getattr(self, column)
+            new = np.full(size, fill, dtype=old.dtype)
+            new[:kept] = old[:kept]
+            setattr(self, column, new)
+        for column in ("numbers", "names", "addresses"):
+            values = getattr(self, column)[:kept]
+            values.extend([""] * (size - kept))
+            setattr(self, column, values)
+
+
+class StationStoreBuilder:
+    """
+    Appends stations to a StationStore whose final size is unknown.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        """
+        Args:
+            capacity: Rows preallocated (e.g. the size of the previous snapshot)
+        """
+        self._store = StationStore(max(int(capacity), 1))
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, station: dict) -> None:
+        """
+        Write one EMT station dict into the next row.
+
+        Args:
+            station: Station as returned by the EMT API
+        """
+        if self._count == len(self._store):
+            self._store._resize(2 * len(self._store))
+        self._store.set_row(self._count, station)
+        self._count += 1
+
+    def build(self) -> StationStore:
+        """
+        Trim the columns to the appended rows and build the id index.
+
+        Returns:
+            StationStore: The finished store
+        """
+        if self._count != len(self._store):
+            self._store._resize(self._count)
+        return self._store.finalize()
@@ -0,0 +1,198 @@
+"""Incremental parser of the EMT station list.
+
+`json.loads(response.read().decode())` keeps the raw bytes, the decoded
+string and the whole tree of station dicts alive at the same time.
+StationStreamParser is fed the decompressed body chunk by chunk while it is
+downloaded. It walks the top-level object by hand, decodes one station of
+the "data" array at a time with json.JSONDecoder.raw_decode and writes it
+straight into a StationStoreBuilder, so only the unparsed tail of the
+current chunk and the growing columns are held in memory.
+
+The body is hashed while it is parsed. A 200 answer identical to the last
+body is therefore still decoded: its bytes are gone by the time the hash is
+known, and keeping them to parse afterwards would bring back the peak
+memory this parser avoids. What the hash saves is everything after the
+parse: finish(), the new snapshot and the work of its listeners.
+"""
+
+import codecs
+import hashlib
+import json
+import re
+from typing import Tuple
+
+from .station_store import StationStore, StationStoreBuilder
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# Characters that may continue a number ("12" of "12.5e3" decodes on its own)
+_NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+
+# Consumed text is dropped from the buffer once it exceeds this many characters
+_COMPACT_AFTER = 64 * 1024
+
+
+class StationStreamParser:
+    """
+    Streaming parser of an EMT payload {"code": ..., "data": [station, ...]}.
+
+    Attributes:
+        meta: Top-level members other than "data"
+        bytes_read: Number of body bytes fed so far
+    """
+
+    def __init__(self, capacity: int = 1024):
+        """
+        Args:
+            capacity: Expected number of stations (rows preallocated)
+        """
+        self.meta = {}
+        self.bytes_read = 0
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._decoder = json.JSONDecoder()
+        self._hash = hashlib.blake2b(digest_size=16)
+        self._stations = StationStoreBuilder(capacity)
+        self._buffer = ""
+        self._position = 0
+        self._state = "object"
+        self._key = None
+        self._error = None
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Parse the next chunk of the (decompressed) body.
+
+        Args:
+            chunk: Raw bytes, possibly cutting a character or token in half
+        """
+        self.bytes_read += len(chunk)
+        self._hash.update(chunk)
+        if self._error is not None:
+            return
+        # Errors are raised by finish(), not inside the HTTP client's read loop
+        try:
+            self._append(self._text.decode(chunk))
+            self._parse(final=False)
+        except ValueError as err:
+            self._error = err
+            self._buffer = ""
+
+    def finish(self) -> Tuple[dict, StationStore]:
+        """
+        Parse whatever is left and return the result.
+
+        Returns:
+            Tuple[dict, StationStore]: The top-level metadata and the stations
+
+        Raises:
+            ValueError: If the payload is not valid JSON or is truncated
+                (json.JSONDecodeError is a ValueError)
+        """
+        if self._error is not None:
+            raise self._error
+        self._append(self._text.decode(b"", final=True))
+        self._parse(final=True)
+        if self._state != "done":
+            raise ValueError("Truncated station payload")
+        return self.meta, self._stations.build()
+
+    def digest(self) -> bytes:
+        """Hash of the bytes fed so far."""
+        return self._hash.digest()
+
+    def _append(self, text: str) -> None:
+        if self._position > _COMPACT_AFTER:
+            self._buffer = self._buffer[self._position:]
+            self._position = 0
+        self._buffer += text
+
+    def _skip_whitespace(self) -> bool:
+        """Skip whitespace; False if the buffer is exhausted."""
+        self._position = _WHITESPACE.match(self._buffer, self._position).end()
+        return self._position < len(self._buffer)
+
+    def _expect(self, char: str) -> None:
+        if self._buffer[self._position] != char:
+            raise ValueError(
+                f"Expected '{char}' at offset {self._position} of the station payload"
+            )
+        self._position += 1
+
+    def _value(self, final: bool):
+        """
+        Decode one JSON value at the current position.
+
+        Returns:
+            tuple: (True, value), or (False, None) if more input is needed
+        """
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._position)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return False, None
+        # A number running up to the end of the buffer may continue in the next chunk
+        if not final and isinstance(value, (int, float)) \
+                and _NUMBER_TAIL.match(self._buffer, end).end() >= len(self._buffer):
+            return False, None
+        self._position = end
+        return True, value
+
+    def _parse(self, final: bool) -> None:
+        while self._skip_whitespace():
+            char = self._buffer[self._position]
+            state = self._state
+
+            if state == "object":
+                self._expect("{")
+                self._state = "first_key"
+
+            elif state in ("first_key", "key"):
+                if char == "}" and state == "first_key":
+                    self._position += 1
+                    self._state = "done"
+                    continue
+                if char != '"':
+                    raise ValueError(f"Expected a member name at offset {self._position} of the station payload")
+                complete, self._key = self._value(final)
+                if not complete:
+                    return
+                self._state = "colon"
+
+            elif state == "colon":
+                self._expect(":")
+                self._state = "value"
+
+            elif state == "value":
+                if self._key == "data" and char == "[":
+                    self._position += 1
+                    self._state = "first_item"
+                    continue
+                complete, value = self._value(final)
+                if not complete:
+                    return
+                self.meta[self._key] = value
+                self._state = "after_value"
+
+            elif state == "after_value":
+                self._expect("," if char != "}" else "}")
+                self._state = "key" if char == "," else "done"
+
+            elif state in ("first_item", "item"):
+                if char == "]" and state == "first_item":
+                    self._position += 1
+                    self._state = "after_value"
+                    continue
+                complete, station = self._value(final)
+                if not complete:
+                    return
+                if isinstance(station, dict):
+                    self._stations.append(station)
+                self._state = "after_item"
+
+            elif state == "after_item":
+                self._expect("," if char != "]" else "]")
+                self._state = "item" if char == "," else "after_value"
+
+            else:
+                raise ValueError("Unexpected data after the station payload")
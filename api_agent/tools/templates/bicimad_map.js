@@ -0,0 +1,432 @@
+function readJson(id) {
+    return JSON.parse(document.getElementById(id).textContent);
+}
+
+// Stations are embedded as arrays ordered like stationFields
+const stationFields = readJson('stationFields');
+
+function stationFromRow(row) {
+    const station = {};
+    stationFields.forEach((field, i) => { station[field] = row[i]; });
+    // Lower-cased text matched by the search box
+    station.searchText = [station.id || station.number || '', station.name || '', station.address || '']
+        .join('\n').toLowerCase();
+    return station;
+}
+
+let stationsData = readJson('stationRows').map(stationFromRow);
+
+// Clusters per zoom level, rows ordered like CLUSTER_FIELDS in station_clusters.py:
+// [latitude, longitude, stations, active, bikes, free_docks, total_docks, station row]
+const stationClusters = readJson('stationClusters');
+const clusterZooms = Object.keys(stationClusters).map(Number).sort((a, b) => a - b);
+const MIN_CLUSTER_ZOOM = clusterZooms.length ? clusterZooms[0] : 0;
+const MAX_CLUSTER_ZOOM = clusterZooms.length ? clusterZooms[clusterZooms.length - 1] : -1;
+
+// The single-station row of each cluster is replaced by the station itself
+clusterZooms.forEach(zoom => stationClusters[zoom].forEach(cluster => { cluster[7] = stationsData[cluster[7]]; }));
+
+// Set when the page is served by the live map server: {version, events}
+const mapSource = readJson('mapSource');
+
+// Virtualized station list: keep in sync with .station-card / .stations-grid in the stylesheet
+const CARD_HEIGHT = 300;
+const CARD_GAP = 20;
+const CARD_MIN_WIDTH = 350;
+const GRID_PADDING = 10;
+const OVERSCAN_ROWS = 2;
+
+let listStations = stationsData;
+let renderedRange = null;
+let searchTerm = '';
+let redrawMap = () => {};
+
+function escapeHtml(text) {
+    return String(text).replace(/[&<>"']/g, char => ({
+        '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+    })[char]);
+}
+
+function calculateStats(stations) {
+    let totalStations = stations.length;
+    let activeStations = 0;
+    let totalBikes = 0;
+    let totalDocks = 0;
+
+    stations.forEach(station => {
+        if (station.activate === 1) activeStations++;
+        totalBikes += station.dock_bikes || 0;
+        totalDocks += station.free_bases || 0;
+    });
+
+    return {
+        totalStations,
+        activeStations,
+        totalBikes,
+        totalDocks
+    };
+}
+
+function renderStats() {
+    const stats = calculateStats(stationsData);
+    const statsHTML = `
+        <div class="stat-card">
+            <div class="stat-value">${stats.totalStations}</div>
+            <div class="stat-label">Estaciones Totales</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-value">${stats.activeStations}</div>
+            <div class="stat-label">Estaciones Activas</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-value">${stats.totalBikes}</div>
+            <div class="stat-label">Bicis Disponibles</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-value">${stats.totalDocks}</div>
+            <div class="stat-label">Anclajes Libres</div>
+        </div>
+    `;
+    document.getElementById('stats').innerHTML = statsHTML;
+}
+
+function stationCard(station) {
+    const stationId = escapeHtml(station.id || station.number || 'N/A');
+    const stationName = escapeHtml(station.name || 'Estación sin nombre');
+    const address = escapeHtml(station.address || '');
+    const bikes = station.dock_bikes || 0;
+    const freeDocks = station.free_bases || 0;
+    const totalDocks = station.total_bases || (bikes + freeDocks);
+    const isActive = station.activate === 1;
+
+    const bikesPercent = totalDocks > 0 ? (bikes / totalDocks * 100) : 0;
+    const docksPercent = totalDocks > 0 ? (freeDocks / totalDocks * 100) : 0;
+
+    const statusClass = isActive ? 'status-active' : 'status-inactive';
+
+    return `
+        <div class="station-card ${statusClass}">
+            <div class="station-id">ID: ${stationId}</div>
+            <div class="station-name" title="${stationName}">${stationName}</div>
+            <div class="station-address">${address}</div>
+
+            <div class="availability">
+                <div class="availability-item">
+                    <div class="availability-label">
+                        <span>🚲 Bicis disponibles</span>
+                        <span><strong>${bikes}</strong> / ${totalDocks}</span>
+                    </div>
+                    <div class="progress-bar">
+                        <div class="progress-fill bikes-fill" style="width: ${bikesPercent}%">
+                            ${bikesPercent > 15 ? bikes : ''}
+                        </div>
+                    </div>
+                </div>
+
+                <div class="availability-item">
+                    <div class="availability-label">
+                        <span>🅿️ Anclajes libres</span>
+                        <span><strong>${freeDocks}</strong> / ${totalDocks}</span>
+                    </div>
+                    <div class="progress-bar">
+                        <div class="progress-fill docks-fill" style="width: ${docksPercent}%">
+                            ${docksPercent > 15 ? freeDocks : ''}
+                        </div>
+                    </div>
+                </div>
+            </div>
+        </div>
+    `;
+}
+
+// Only the rows of cards inside the scrolled viewport (plus a margin) are in the DOM
+function renderVisibleStations(force) {
+    const viewport = document.getElementById('stationsViewport');
+    const spacer = document.getElementById('stationsSpacer');
+    const grid = document.getElementById('stationsGrid');
+
+    if (listStations.length === 0) {
+        spacer.style.height = '0px';
+        grid.style.transform = '';
+        grid.innerHTML = '<p style="color: white; text-align: center; padding: 40px; grid-column: 1/-1;">No se encontraron estaciones</p>';
+        renderedRange = null;
+        return;
+    }
+
+    const width = viewport.clientWidth - 2 * GRID_PADDING;
+    const columns = Math.max(1, Math.floor((width + CARD_GAP) / (CARD_MIN_WIDTH + CARD_GAP)));
+    const rowHeight = CARD_HEIGHT + CARD_GAP;
+    const totalRows = Math.ceil(listStations.length / columns);
+    const firstRow = Math.max(0, Math.floor(viewport.scrollTop / rowHeight) - OVERSCAN_ROWS);
+    const lastRow = Math.min(totalRows, Math.ceil((viewport.scrollTop + viewport.clientHeight) / rowHeight) + OVERSCAN_ROWS);
+
+    const range = `${firstRow}:${lastRow}:${columns}`;
+    if (!force && range === renderedRange) return;
+    renderedRange = range;
+
+    spacer.style.height = `${totalRows * rowHeight + 2 * GRID_PADDING}px`;
+    grid.style.gridTemplateColumns = `repeat(${columns}, 1fr)`;
+    grid.style.transform = `translateY(${firstRow * rowHeight + GRID_PADDING}px)`;
+    grid.innerHTML = listStations.slice(firstRow * columns, lastRow * columns).map(stationCard).join('');
+}
+
+function renderStations(stations) {
+    listStations = stations;
+    document.getElementById('stationsViewport').scrollTop = 0;
+    renderVisibleStations(true);
+}
+
+let listFramePending = false;
+function scheduleListRender() {
+    if (listFramePending) return;
+    listFramePending = true;
+    requestAnimationFrame(() => {
+        listFramePending = false;
+        renderVisibleStations(false);
+    });
+}
+
+document.getElementById('stationsViewport').addEventListener('scroll', scheduleListRender);
+window.addEventListener('resize', scheduleListRender);
+
+// Search functionality
+function filteredStations() {
+    return searchTerm ? stationsData.filter(station => station.searchText.includes(searchTerm)) : stationsData;
+}
+
+document.getElementById('searchInput').addEventListener('input', function(e) {
+    searchTerm = e.target.value.toLowerCase();
+    renderStations(filteredStations());
+});
+
+// Choose marker color based on occupancy percentage
+function occupancyColor(bikes, totalDocks, isActive) {
+    if (!isActive || totalDocks <= 0) {
+        return '#9E9E9E'; // Gray for inactive or no data
+    }
+    const occupancyPercent = (bikes / totalDocks) * 100;
+    if (occupancyPercent === 0) return '#D32F2F'; // Dark red - no bikes
+    if (occupancyPercent < 20) return '#F44336'; // Red - very low
+    if (occupancyPercent < 40) return '#FF9800'; // Orange - low
+    if (occupancyPercent < 60) return '#FFC107'; // Amber - medium
+    if (occupancyPercent < 80) return '#8BC34A'; // Light green - good
+    return '#4CAF50'; // Green - excellent
+}
+
+function stationPopup(station, markerColor) {
+    const stationId = escapeHtml(station.id || station.number || 'N/A');
+    const stationName = escapeHtml(station.name || 'Estación sin nombre');
+    const bikes = station.dock_bikes || 0;
+    const freeDocks = station.free_bases || 0;
+    const totalDocks = station.total_bases || (bikes + freeDocks);
+    const isActive = station.activate === 1;
+    const occupancyPercent = totalDocks > 0 ? Math.round((bikes / totalDocks) * 100) : 0;
+
+    return `
+        <div style="min-width: 200px;">
+            <h3 style="margin: 0 0 10px 0; color: #333;">${stationName}</h3>
+            <p style="margin: 5px 0; color: #666;"><strong>ID:</strong> ${stationId}</p>
+            <p style="margin: 5px 0; color: #666;"><strong>Estado:</strong> ${isActive ? '✅ Activa' : '❌ Inactiva'}</p>
+            <p style="margin: 5px 0; color: #666; font-size: 0.9em;"><strong>📍 Coordenadas:</strong> ${station.latitude.toFixed(6)}, ${station.longitude.toFixed(6)}</p>
+            <hr style="margin: 10px 0; border: none; border-top: 1px solid #eee;">
+            <p style="margin: 5px 0;"><strong>🚲 Bicis:</strong> ${bikes} / ${totalDocks} <span style="color: ${markerColor}; font-weight: bold;">(${occupancyPercent}%)</span></p>
+            <p style="margin: 5px 0;"><strong>🅿️ Anclajes libres:</strong> ${freeDocks}</p>
+        </div>
+    `;
+}
+
+function stationMarker(station) {
+    const bikes = station.dock_bikes || 0;
+    const freeDocks = station.free_bases || 0;
+    const totalDocks = station.total_bases || (bikes + freeDocks);
+    const markerColor = occupancyColor(bikes, totalDocks, station.activate === 1);
+
+    const markerIcon = L.divIcon({
+        className: 'custom-marker',
+        html: `<div style="background-color: ${markerColor}; width: 30px; height: 30px; border-radius: 50%; border: 3px solid white; box-shadow: 0 2px 5px rgba(0,0,0,0.3); display: flex; align-items: center; justify-content: center; color: white; font-weight: bold; font-size: 12px;">${bikes}</div>`,
+        iconSize: [30, 30],
+        iconAnchor: [15, 15]
+    });
+
+    const marker = L.marker([station.latitude, station.longitude], { icon: markerIcon });
+    // Popup content is only built when the popup is opened
+    marker.bindPopup(() => stationPopup(station, markerColor));
+    return marker;
+}
+
+function clusterMarker(map, cluster) {
+    const [lat, lng, count, active, bikes, freeDocks, totalDocks] = cluster;
+    const markerColor = occupancyColor(bikes, totalDocks, active > 0);
+    const size = Math.round(36 + 8 * Math.log10(count));
+
+    const markerIcon = L.divIcon({
+        className: 'cluster-marker',
+        html: `<div style="background-color: ${markerColor}; width: ${size}px; height: ${size}px;">${count}<small>🚲 ${bikes}</small></div>`,
+        iconSize: [size, size],
+        iconAnchor: [size / 2, size / 2]
+    });
+
+    const marker = L.marker([lat, lng], { icon: markerIcon });
+    marker.bindTooltip(`${count} estaciones · ${bikes} bicis · ${freeDocks} anclajes libres`);
+    marker.on('click', () => map.setView([lat, lng], Math.min(map.getZoom() + 2, map.getMaxZoom())));
+    return marker;
+}
+
+// Clusters of the current zoom level, or single stations once zoomed in; only what is in view
+function visibleMarkers(map) {
+    const zoom = map.getZoom();
+    const bounds = map.getBounds().pad(0.25);
+    const markers = [];
+
+    if (zoom <= MAX_CLUSTER_ZOOM) {
+        stationClusters[Math.max(zoom, MIN_CLUSTER_ZOOM)].forEach(cluster => {
+            if (!bounds.contains([cluster[0], cluster[1]])) return;
+            if (cluster[2] === 0) return;
+            const single = cluster[2] === 1 && !cluster[7].removed;
+            markers.push(single ? stationMarker(cluster[7]) : clusterMarker(map, cluster));
+        });
+        return markers;
+    }
+
+    stationsData.forEach(station => {
+        if (station.latitude === null || station.longitude === null) return;
+        if (bounds.contains([station.latitude, station.longitude])) {
+            markers.push(stationMarker(station));
+        }
+    });
+    return markers;
+}
+
+// Initialize map
+function initMap() {
+    // Center on Madrid
+    const madridCenter = [40.4168, -3.7038];
+    const map = L.map('map', { minZoom: MIN_CLUSTER_ZOOM }).setView(madridCenter, 13);
+
+    // Add OpenStreetMap tile layer
+    L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+        attribution: '© <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+        maxZoom: 19
+    }).addTo(map);
+
+    // Markers are rebuilt in one layer group whenever the view settles
+    let markerLayer = L.layerGroup().addTo(map);
+    function drawMarkers() {
+        map.removeLayer(markerLayer);
+        markerLayer = L.layerGroup(visibleMarkers(map)).addTo(map);
+    }
+    map.on('moveend', drawMarkers);
+    drawMarkers();
+    redrawMap = drawMarkers;
+
+    // Add legend
+    const legend = L.control({position: 'bottomright'});
+
+    legend.onAdd = function (map) {
+        const div = L.DomUtil.create('div', 'legend');
+        div.innerHTML = `
+            <h4>📊 Ocupación de Bicis</h4>
+            <i style="background: #4CAF50"></i> 80-100% (Excelente)<br>
+            <i style="background: #8BC34A"></i> 60-80% (Buena)<br>
+            <i style="background: #FFC107"></i> 40-60% (Media)<br>
+            <i style="background: #FF9800"></i> 20-40% (Baja)<br>
+            <i style="background: #F44336"></i> 1-20% (Muy baja)<br>
+            <i style="background: #D32F2F"></i> 0% (Sin bicis)<br>
+            <i style="background: #9E9E9E"></i> Inactiva
+        `;
+        return div;
+    };
+
+    legend.addTo(map);
+
+    return map;
+}
+
+// Live updates: cluster cells are recomputed here with the same Web Mercator
+// grid as station_clusters.py, so a station's counts can be moved in and out
+const CELL_PIXELS = 64;
+const clusterIndex = {};
+
+function cellKey(lat, lng, zoom) {
+    const cellsPerSide = Math.max(Math.floor((256 * Math.pow(2, zoom)) / CELL_PIXELS), 1);
+    const sinLat = Math.sin(Math.max(Math.min(lat, 85.05112878), -85.05112878) * Math.PI / 180);
+    const x = (lng + 180) / 360;
+    const y = 0.5 - Math.log((1 + sinLat) / (1 - sinLat)) / (4 * Math.PI);
+    return `${Math.floor(x * cellsPerSide)}:${Math.floor(y * cellsPerSide)}`;
+}
+
+function stationCluster(station, zoom) {
+    if (!clusterIndex[zoom]) {
+        // Built on the first update only; a centroid always lies in its own cell
+        clusterIndex[zoom] = new Map(stationClusters[zoom].map(cluster => [cellKey(cluster[0], cluster[1], zoom), cluster]));
+    }
+    const key = cellKey(station.latitude, station.longitude, zoom);
+    let cluster = clusterIndex[zoom].get(key);
+    if (!cluster) {
+        cluster = [station.latitude, station.longitude, 0, 0, 0, 0, 0, station];
+        clusterIndex[zoom].set(key, cluster);
+        stationClusters[zoom].push(cluster);
+    }
+    return cluster;
+}
+
+// Add (sign 1) or remove (sign -1) a station's counts from its clusters
+function countInClusters(station, sign) {
+    if (station.latitude === null || station.longitude === null) return;
+    clusterZooms.forEach(zoom => {
+        const cluster = stationCluster(station, zoom);
+        cluster[2] += sign;
+        cluster[3] += sign * (station.activate === 1 ? 1 : 0);
+        cluster[4] += sign * (station.dock_bikes || 0);
+        cluster[5] += sign * (station.free_bases || 0);
+        cluster[6] += sign * (station.total_bases || 0);
+        if (sign > 0 && cluster[2] === 1) cluster[7] = station;
+    });
+}
+
+function applyDelta(delta) {
+    const byId = new Map(stationsData.map(station => [station.id, station]));
+
+    delta.stations.forEach(row => {
+        const updated = stationFromRow(row);
+        const station = byId.get(updated.id);
+        if (station) {
+            countInClusters(station, -1);
+            Object.assign(station, updated);
+            countInClusters(station, 1);
+        } else {
+            stationsData.push(updated);
+            countInClusters(updated, 1);
+        }
+    });
+
+    if (delta.removed.length) {
+        const removed = new Set(delta.removed);
+        stationsData.forEach(station => {
+            if (!removed.has(station.id)) return;
+            countInClusters(station, -1);
+            station.removed = true;
+        });
+        stationsData = stationsData.filter(station => !station.removed);
+    }
+
+    mapSource.version = delta.version;
+    renderStats();
+    listStations = filteredStations();
+    renderVisibleStations(true);
+    redrawMap();
+}
+
+function listenForUpdates() {
+    if (!mapSource) return;
+    const events = new EventSource(`${mapSource.events}?since=${mapSource.version}`);
+    events.addEventListener('delta', e => applyDelta(JSON.parse(e.data)));
+    // The server no longer has the deltas this page needs
+    events.addEventListener('reload', () => window.location.reload());
+}
+
+// Initial render
+renderStats();
+renderStations(stationsData);
+initMap();
+listenForUpdates();
@@ -0,0 +1,122 @@
+"""Pickup and drop-off station choice for a bike trip between two points.
+
+A trip is walk -> ride -> walk. The nearest stations with a bike around the
+origin and with a free dock around the destination are taken from the
+spatial index, and every pickup/drop-off pair is scored at once as a small
+NumPy matrix of estimated minutes:
+
+    walk to the pickup + ride between the stations + walk from the drop-off
+    + a penalty per bike (dock) short of a safe margin
+
+so a station with a single bike left loses against one a little further
+away with plenty. The choice is deterministic (ties go to the lower station
+id) and needs no API call.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .spatial_index import get_spatial_index, haversine_m
+
+# Average speeds in meters per minute (4.8 km/h walking, 15 km/h riding)
+WALK_M_PER_MIN = 80.0
+RIDE_M_PER_MIN = 250.0
+
+# Streets are not straight lines
+DETOUR_FACTOR = 1.3
+
+# Bikes at the pickup (free docks at the drop-off) below which a station is
+# penalized, and the penalty in minutes per missing unit
+SAFE_MARGIN = 3
+MARGIN_PENALTY_MIN = 2.0
+
+# Stations considered around each end
+DEFAULT_CANDIDATES = 8
+
+
+def _station_summary(store, position: int, distance_m: float) -> dict:
+    return {
+        "id": int(store.ids[position]),
+        "name": store.names[position],
+        "address": store.addresses[position],
+        "dock_bikes": int(store.dock_bikes[position]),
+        "free_bases": int(store.free_bases[position]),
+        "latitude": float(store.lats[position]),
+        "longitude": float(store.lons[position]),
+        "walk_m": round(distance_m),
+        "walk_min": round(distance_m * DETOUR_FACTOR / WALK_M_PER_MIN, 1),
+    }
+
+
+def plan_trip(snapshot, origin: Tuple[float, float], destination: Tuple[float, float],
+              candidates: int = DEFAULT_CANDIDATES) -> Optional[dict]:
+    """
+    Pick the best pickup and drop-off stations for a trip.
+
+    Args:
+        snapshot: StationSnapshot from the station cache
+        origin: (latitude, longitude) where the trip starts
+        destination: (latitude, longitude) where it ends
+        candidates: Stations considered around each end
+
+    Returns:
+        Optional[dict]: Pickup, drop-off, estimated minutes and the runner-up
+        stations, or None if no station has a bike or no station a free dock
+    """
+    store = snapshot.store
+    index = get_spatial_index(snapshot)
+    active = (store.activate[index.positions] == 1) & (store.no_available[index.positions] == 0)
+    with_bikes = active & (store.dock_bikes[index.positions] > 0)
+    with_docks = active & (store.free_bases[index.positions] > 0)
+
+    (pickups,), (pickup_m,) = index.query_knn_batch([origin[0]], [origin[1]], candidates, with_bikes)
+    (dropoffs,), (dropoff_m,) = index.query_knn_batch([destination[0]], [destination[1]], candidates, with_docks)
+    found_pickups, found_dropoffs = pickups >= 0, dropoffs >= 0
+    pickups, pickup_m = pickups[found_pickups], pickup_m[found_pickups]
+    dropoffs, dropoff_m = dropoffs[found_dropoffs], dropoff_m[found_dropoffs]
+    if not len(pickups) or not len(dropoffs):
+        return None
+
+    walk_in = pickup_m * DETOUR_FACTOR / WALK_M_PER_MIN
+    walk_out = dropoff_m * DETOUR_FACTOR / WALK_M_PER_MIN
+    ride_m = haversine_m(
+        store.lats[pickups][:, None], store.lons[pickups][:, None],
+        store.lats[dropoffs][None, :], store.lons[dropoffs][None, :],
+    ) * DETOUR_FACTOR
+    short_bikes = np.maximum(SAFE_MARGIN - store.dock_bikes[pickups].astype(np.float64), 0.0)
+    short_docks = np.maximum(SAFE_MARGIN - store.free_bases[dropoffs].astype(np.float64), 0.0)
+
+    minutes = walk_in[:, None] + ride_m / RIDE_M_PER_MIN + walk_out[None, :]
+    cost = minutes + MARGIN_PENALTY_MIN * (short_bikes[:, None] + short_docks[None, :])
+    # Docking where the bike was taken is not a trip
+    cost[pickups[:, None] == dropoffs[None, :]] = np.inf
+    if not np.isfinite(cost).any():
+        return None
+
+    # Lowest cost, then lowest pickup id, then lowest drop-off id
+    flat = np.lexsort((
+        np.repeat(store.ids[dropoffs][None, :], len(pickups), axis=0).ravel(),
+        np.repeat(store.ids[pickups][:, None], len(dropoffs), axis=1).ravel(),
+        cost.ravel(),
+    ))[0]
+    best_pickup, best_dropoff = np.unravel_index(flat, cost.shape)
+
+    def runners_up(best: int, costs: np.ndarray, positions: np.ndarray, distances: np.ndarray) -> list:
+        order = [i for i in np.lexsort((store.ids[positions], costs)) if i != best and np.isfinite(costs[i])]
+        return [_station_summary(store, positions[i], distances[i]) for i in order[:2]]
+
+    walk_only_m = float(haversine_m(origin[0], origin[1], destination[0], destination[1])) * DETOUR_FACTOR
+    return {
+        "pickup": _station_summary(store, pickups[best_pickup], pickup_m[best_pickup]),
+        "dropoff": _station_summary(store, dropoffs[best_dropoff], dropoff_m[best_dropoff]),
+        "ride_m": round(float(ride_m[best_pickup, best_dropoff])),
+        "ride_min": round(float(ride_m[best_pickup, best_dropoff]) / RIDE_M_PER_MIN, 1),
+        "total_min": round(float(minutes[best_pickup, best_dropoff]), 1),
+        "walk_only_min": round(walk_only_m / WALK_M_PER_MIN, 1),
+        "alternatives": {
+            # Other pickups with the chosen drop-off, and vice versa
+            "pickup": runners_up(best_pickup, cost[:, best_dropoff], pickups, pickup_m),
+            "dropoff": runners_up(best_dropoff, cost[best_pickup, :], dropoffs, dropoff_m),
+        },
+    }
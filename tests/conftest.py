@@ -0,0 +1,45 @@
+"""Shared fixtures: synthetic EMT station lists around Madrid."""
+
+import random
+
+import pytest
+
+from api_agent.tools.station_cache import StationSnapshot
+
+# Rough extent of the BiciMAD network
+SOUTH, WEST, NORTH, EAST = 40.38, -3.73, 40.48, -3.66
+
+
+def station_dicts(count: int = 200, seed: int = 1) -> list:
+    """EMT-style station dicts with random positions and occupancy."""
+    rnd = random.Random(seed)
+    stations = []
+    for station_id in range(1, count + 1):
+        total = rnd.randint(15, 30)
+        bikes = rnd.randint(0, total)
+        stations.append({
+            "id": station_id,
+            "number": str(station_id),
+            "name": f"Estación {station_id}",
+            "address": f"Calle de Prueba nº {station_id}",
+            "activate": 1,
+            "no_available": 0,
+            "dock_bikes": bikes,
+            "free_bases": total - bikes,
+            "total_bases": total,
+            "reservations_count": 0,
+            "light": 0,
+            "geometry": {
+                "type": "Point",
+                "coordinates": [rnd.uniform(WEST, EAST), rnd.uniform(SOUTH, NORTH)],
+            },
+        })
+    return stations
+
+
+@pytest.fixture
+def make_snapshot():
+    """Build a StationSnapshot from station dicts (default: 200 random stations)."""
+    def make(stations=None, **kwargs):
+        return StationSnapshot({"code": "00", "data": station_dicts(**kwargs) if stations is None else stations})
+    return make
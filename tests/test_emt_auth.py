@@ -0,0 +1,109 @@
+"""Tests for the EMT token manager (no network: the login is replaced)."""
+
+import threading
+
+import pytest
+
+from api_agent.tools import emt_auth
+from api_agent.tools.emt_auth import EMTTokenManager
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    manager = EMTTokenManager(retry_delay=30.0)
+    manager.scheduled = []
+    monkeypatch.setattr(manager, "_schedule_refresh", manager.scheduled.append)
+    return manager
+
+
+def test_refresh_before_expiry(manager, monkeypatch):
+    monkeypatch.setattr(manager, "_login", lambda: ("token", 24 * 3600.0))
+    assert manager.get_token() == "token"
+    # 10% of the lifetime before expiry
+    assert manager.scheduled == [pytest.approx(24 * 3600 * 0.9)]
+
+
+@pytest.mark.parametrize("lifetime", [120.0, 300.0, 320.0])
+def test_short_lifetime_refresh_waits_retry_delay(manager, monkeypatch, lifetime):
+    monkeypatch.setattr(manager, "_login", lambda: ("token", lifetime))
+    assert manager.get_token() == "token"
+    assert manager.scheduled == [30.0]
+
+
+@pytest.mark.parametrize("lifetime", [1.0, 29.0])
+def test_refresh_never_after_expiry(manager, monkeypatch, lifetime):
+    monkeypatch.setattr(manager, "_login", lambda: ("token", lifetime))
+    assert manager.get_token() == "token"
+    assert manager.scheduled == [lifetime]
+
+
+def test_background_refresh_does_not_loop(manager, monkeypatch):
+    logins = []
+
+    def login():
+        logins.append(1)
+        return "token", 60.0
+
+    monkeypatch.setattr(manager, "_login", login)
+    manager.get_token()
+    manager._background_refresh()
+    assert len(logins) == 2
+    assert manager.scheduled == [30.0, 30.0]
+
+
+def test_concurrent_callers_share_one_login(monkeypatch):
+    manager = EMTTokenManager()
+    monkeypatch.setattr(manager, "_schedule_refresh", lambda delay: None)
+    release = threading.Event()
+    logins = []
+
+    def login():
+        logins.append(1)
+        release.wait(5)
+        return "token", 3600.0
+
+    monkeypatch.setattr(manager, "_login", login)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(manager.get_token())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == ["token"] * 8
+    assert len(logins) == 1
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeClient:
+    def __init__(self, data):
+        self.data = data
+
+    def request(self, method, path, headers=None):
+        return FakeResponse(self.data)
+
+
+@pytest.mark.parametrize("data", [
+    [], "error", None, {"code": "01", "data": {"accessToken": "x"}}, {"code": "01", "data": ["x"]},
+    {"code": "80", "data": [{"accessToken": "x"}]},
+])
+def test_login_rejects_malformed_responses(monkeypatch, data):
+    monkeypatch.setenv("EMT_EMAIL", "user@example.com")
+    monkeypatch.setenv("EMT_PASSWORD", "secret")
+    monkeypatch.setattr(emt_auth, "get_emt_client", lambda: FakeClient(data))
+    assert EMTTokenManager()._login() == (None, 0.0)
+
+
+def test_login_reads_token_and_lifetime(monkeypatch):
+    monkeypatch.setenv("EMT_EMAIL", "user@example.com")
+    monkeypatch.setenv("EMT_PASSWORD", "secret")
+    data = {"code": "01", "data": [{"accessToken": "token", "tokenSecExpiration": 86399}]}
+    monkeypatch.setattr(emt_auth, "get_emt_client", lambda: FakeClient(data))
+    assert EMTTokenManager()._login() == ("token", 86399.0)
@@ -0,0 +1,95 @@
+"""Tests for the pooled EMT HTTP clients against a local plain-HTTP server."""
+
+import asyncio
+import gzip
+import http.client
+import http.server
+import threading
+import time
+
+import pytest
+
+from api_agent.tools.emt_client import AsyncEMTClient, EMTClient, EMTConnectionError
+
+BODY = b'{"code": "00", "data": [1, 2, 3]}'
+
+RESPONSES = {
+    "/ok": gzip.compress(BODY),
+    "/corrupt": b"this is not a gzip stream",
+    "/truncated": gzip.compress(BODY)[:12],
+}
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = RESPONSES[self.path]
+        self.send_response(200)
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def client(server, monkeypatch):
+    # The sync client speaks HTTPS; point it at the plain-HTTP test server
+    monkeypatch.setattr(http.client, "HTTPSConnection", http.client.HTTPConnection)
+    client = EMTClient(host=f"127.0.0.1:{server}", pool_size=1)
+    yield client
+    client.close()
+
+
+def test_gzip_body_is_decoded(client):
+    response = client.request("GET", "/ok")
+    assert response.body == BODY
+    assert response.decoded_bytes == len(BODY)
+    assert response.wire_bytes == len(RESPONSES["/ok"])
+
+
+@pytest.mark.parametrize("path", ["/corrupt", "/truncated"])
+def test_bad_gzip_body_raises_connection_error(client, path):
+    with pytest.raises(EMTConnectionError):
+        client.request("GET", path)
+    # The connection was discarded, the next request still works
+    assert client.request("GET", "/ok").body == BODY
+
+
+def test_zero_timeout_is_not_the_default(client):
+    client._slots.acquire()
+    try:
+        started = time.monotonic()
+        with pytest.raises(EMTConnectionError):
+            client.request("GET", "/ok", connect_timeout=0)
+        assert time.monotonic() - started < 1.0
+    finally:
+        client._slots.release()
+
+
+@pytest.mark.parametrize("path", ["/corrupt", "/truncated"])
+def test_async_bad_gzip_body_raises_connection_error(server, path):
+    client = AsyncEMTClient(host="127.0.0.1", port=server, use_ssl=False)
+
+    async def run():
+        with pytest.raises(EMTConnectionError):
+            await client.request("GET", path)
+        try:
+            return await client.request("GET", "/ok")
+        finally:
+            client.close()
+
+    assert asyncio.run(run()).body == BODY
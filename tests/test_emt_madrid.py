@@ -0,0 +1,348 @@
+"""Tests for the BiciMAD tool layer that need no EMT connection."""
+
+import json
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from api_agent.tools import emt_madrid
+from api_agent.tools.emt_client import EMTResponse
+from api_agent.tools.history_rollups import TieredHistory
+from api_agent.tools.history_store import HistoryStore
+from api_agent.tools.station_cache import SNAPSHOT_UNCHANGED, SnapshotUnavailableError, StationSnapshotCache
+from api_agent.tools.station_projection import STATION_FIELDS
+from api_agent.tools.station_stream import StationStreamParser
+
+from conftest import station_dicts
+
+
+@pytest.mark.parametrize("value", ["abc", "0", "-5", "nan", "inf"])
+def test_invalid_poll_interval_is_ignored(value):
+    assert emt_madrid._poll_interval(value) is None
+
+
+def test_poll_interval():
+    assert emt_madrid._poll_interval(None) is None
+    assert emt_madrid._poll_interval("") is None
+    assert emt_madrid._poll_interval("90") == 90.0
+
+
+@pytest.fixture
+def snapshot(make_snapshot):
+    return make_snapshot()
+
+
+@pytest.mark.parametrize("latitude,longitude", [
+    (float("nan"), -3.7), (40.4, float("nan")), (float("inf"), -3.7), ("north", -3.7), (None, -3.7),
+])
+def test_local_queries_reject_non_finite_coordinates(snapshot, latitude, longitude):
+    for result in (emt_madrid._local_poi(snapshot, latitude, longitude, 500),
+                   emt_madrid._local_nearest(snapshot, latitude, longitude, 3)):
+        assert result["status"] == "ERROR"
+        assert "Invalid coordinates" in result["message"]
+
+
+def test_local_queries(snapshot):
+    nearest = emt_madrid._local_nearest(snapshot, 40.4168, -3.7038, 3)
+    stations = nearest["data"]["data"]
+    assert len(stations) == 3
+    assert [station["distance"] for station in stations] == sorted(station["distance"] for station in stations)
+    poi = emt_madrid._local_poi(snapshot, 40.4168, -3.7038, stations[-1]["distance"] + 1)
+    assert [station["id"] for station in poi["data"]["data"]][:3] == [station["id"] for station in stations]
+    assert emt_madrid._local_poi(snapshot, 40.4168, -3.7038, float("nan"))["status"] == "ERROR"
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """Replace the tools' station cache with one serving the given payloads in turn."""
+    def install(*station_lists):
+        payloads = iter({"code": "00", "data": stations} for stations in station_lists)
+        cache = StationSnapshotCache(lambda: next(payloads), ttl=3600)
+        monkeypatch.setattr(emt_madrid, "_station_cache", cache)
+        return cache
+    return install
+
+
+def json_size(result) -> int:
+    return len(json.dumps(result))
+
+
+def test_changes_are_cut_to_the_byte_budget(cache):
+    stations = station_dicts(1500)
+    moved = [dict(station, dock_bikes=station["dock_bikes"] + 1) for station in stations[:1400]]
+    moved += [dict(station, id=station["id"] + 10_000) for station in stations[1400:]]
+    cached = cache(stations, moved)
+    cached.get()
+    cached.refresh()
+
+    result = emt_madrid.get_bicimad_changes()
+    assert result["status"] == "success"
+    assert json_size(result) <= emt_madrid._MAX_RESPONSE_BYTES
+    assert result["truncated"] and result["total_count"] == 1400 + 100 + 100
+    assert 0 < len(result["changed"]) < 1400
+    assert len(result["added"]) == len(result["removed"]) == min(100, len(result["changed"]))
+    assert result["unchanged_count"] == 0
+
+
+def test_small_changes_are_not_truncated(cache):
+    stations = station_dicts(50)
+    cached = cache(stations, [dict(stations[0], dock_bikes=stations[0]["dock_bikes"] + 1)] + stations[1:])
+    cached.get()
+    cached.refresh()
+    result = emt_madrid.get_bicimad_changes()
+    assert "truncated" not in result
+    assert [change["id"] for change in result["changed"]] == [1]
+
+
+def test_trend_and_forecast_without_history(monkeypatch):
+    # What the tools see when BICIMAD_HISTORY_DIR is not set
+    monkeypatch.setattr(emt_madrid, "_tiered_history", None)
+    monkeypatch.setattr(emt_madrid, "_forecaster", None)
+    for result in (emt_madrid.get_bicimad_station_trend("1"), emt_madrid.forecast_bicimad_availability("1")):
+        assert result["status"] == "ERROR" and "BICIMAD_HISTORY_DIR" in result["message"]
+
+
+def test_summary_with_all_fields_fits_the_byte_budget(cache):
+    stations = station_dicts(1000)
+    for station in stations[:250]:
+        station.update(dock_bikes=0, free_bases=station["total_bases"])
+    for station in stations[250:500]:
+        station.update(dock_bikes=station["total_bases"], free_bases=0)
+    cache(stations)
+
+    result = emt_madrid.get_bicimad_stations(summary=True, limit=50, fields=list(STATION_FIELDS))
+    assert result["status"] == "success"
+    assert json_size(result) <= emt_madrid._MAX_RESPONSE_BYTES
+    assert result["truncated"] and result["total_count"] == 4 * 50
+    highlights = result["top_stations"]
+    assert len({len(stations) for stations in highlights.values()}) == 1
+    assert 0 < len(highlights["empty"]) < 50
+
+
+def test_nearby_stations_fit_the_byte_budget(cache):
+    cache(station_dicts(1000))
+    result = emt_madrid.get_bicimad_station_poi(40.43, -3.695, 20000)
+    assert json_size(result) <= emt_madrid._MAX_RESPONSE_BYTES
+    assert result["truncated"] and result["total_count"] == 1000
+    distances = [station["distance"] for station in result["data"]["data"]]
+    assert distances == sorted(distances)
+
+
+@pytest.mark.parametrize("summary", [False, True])
+def test_invalid_limit_is_an_error(cache, summary):
+    cache(station_dicts(20))
+    result = emt_madrid.get_bicimad_stations(limit="x", summary=summary)
+    assert result == {"status": "ERROR", "message": "Invalid limit: x"}
+    assert len(emt_madrid.get_bicimad_stations(limit="3")["data"]["data"]) == 3
+
+
+def streamed(body: bytes) -> StationStreamParser:
+    parser = StationStreamParser()
+    parser.feed(body)
+    return parser
+
+
+def test_validators_are_kept_only_for_a_parsed_body(cache, monkeypatch):
+    monkeypatch.setattr(emt_madrid, "_stations_validators", dict.fromkeys(("etag", "last_modified", "body_hash")))
+    cache(station_dicts(5)).get()
+    response = EMTResponse(200, "OK", {"etag": '"v1"', "last-modified": "Fri, 17 Oct 2025 08:00:00 GMT"}, b"")
+
+    broken = b'{"code": "00", "data": [{"id": 1}'
+    with pytest.raises(SnapshotUnavailableError):
+        emt_madrid._stations_payload(response, streamed(broken))
+    assert emt_madrid._conditional_headers() == {}
+    # The same broken body is parsed (and rejected) again, not skipped as unchanged
+    with pytest.raises(SnapshotUnavailableError):
+        emt_madrid._stations_payload(response, streamed(broken))
+
+    body = json.dumps({"code": "00", "data": station_dicts(5)}).encode()
+    snapshot = emt_madrid._stations_payload(response, streamed(body))
+    assert len(snapshot) == 5
+    assert emt_madrid._conditional_headers() == {
+        "If-None-Match": '"v1"', "If-Modified-Since": "Fri, 17 Oct 2025 08:00:00 GMT",
+    }
+    assert emt_madrid._stations_payload(response, streamed(body)) is SNAPSHOT_UNCHANGED
+
+
+def test_heatmap_zones(snapshot):
+    result = emt_madrid._heatmap_result(snapshot, "availability", "array", "3")
+    assert result["status"] == "success" and len(result["scarce_areas"]) == 3
+    availability = [area["availability_pct"] for area in result["scarce_areas"]]
+    assert availability == sorted(availability)
+    assert len(emt_madrid._heatmap_result(snapshot, "availability", "array", 10_000)["scarce_areas"]) <= 50
+    for zones in ("many", None, float("nan")):
+        result = emt_madrid._heatmap_result(snapshot, "availability", "array", zones)
+        assert result == {"status": "ERROR", "message": f"Invalid zones: {zones}"}
+
+
+def test_query_keeps_the_limit_hint_unless_the_budget_cuts(snapshot):
+    limited = emt_madrid._query_result(snapshot, None, None, None, None, None, None, None, 5, None)
+    assert len(limited["stations"]) == 5 and limited["hint"] == f"Showing 5 of {len(snapshot)}; narrow the filters or raise limit."
+    assert "truncated" not in limited
+
+    cut = emt_madrid._query_result(snapshot, None, None, None, None, None, None, None, 200,
+                                   list(STATION_FIELDS))
+    assert cut["truncated"] and json_size(cut) <= emt_madrid._MAX_RESPONSE_BYTES
+    assert cut["hint"] == f"{len(snapshot)} stations match; narrow the filters or request fewer fields."
+
+
+def test_search_limit(snapshot):
+    assert len(emt_madrid._search_result(snapshot, "Estación", "3")["matches"]) == 3
+    assert len(emt_madrid._search_result(snapshot, "Estación", 500)["matches"]) == 20
+    assert emt_madrid._search_result(snapshot, "Estación", "some") == {"status": "ERROR", "message": "Invalid limit: some"}
+
+
+@pytest.mark.parametrize("end", ["nan,nan", "inf,-3.7", "40.4,-inf", [float("nan"), -3.7], "48.85,2.35",
+                                 {"latitude": 0, "longitude": 0}])
+def test_trip_ends_must_be_finite_points_in_madrid(snapshot, end):
+    for origin, destination in ((end, "40.4168,-3.7038"), ("40.4168,-3.7038", end)):
+        result = emt_madrid._trip_result(snapshot, origin, destination)
+        assert result["status"] == "ERROR" and result["message"].startswith("Invalid trip end")
+
+
+def test_trip_between_coordinates(snapshot):
+    result = emt_madrid._trip_result(snapshot, "40.40,-3.72", [40.46, -3.67])
+    assert result["status"] == "success"
+    assert result["origin"]["resolved_from"] == result["destination"]["resolved_from"] == "coordinates"
+    assert result["pickup"]["id"] != result["dropoff"]["id"]
+
+
+def test_rebalancing_arguments(snapshot):
+    result = emt_madrid._rebalancing_result(snapshot, "3", 20, None)
+    assert result["status"] == "success" and len(result["moves"]) == min(3, result["total_moves"])
+    assert emt_madrid._rebalancing_result(snapshot, "lots", 20, None) == {
+        "status": "ERROR", "message": "Invalid max_moves: lots"}
+    for max_distance_km in (float("nan"), -1, 0):
+        assert emt_madrid._rebalancing_result(snapshot, 5, 20, max_distance_km)["status"] == "ERROR"
+    assert emt_madrid._rebalancing_result(snapshot, 5, float("inf"), None)["status"] == "ERROR"
+
+
+def test_nearest_count(snapshot):
+    assert len(emt_madrid._local_nearest(snapshot, 40.4168, -3.7038, "5")["data"]["data"]) == 5
+    assert len(emt_madrid._local_nearest(snapshot, 40.4168, -3.7038, 10_000)["data"]["data"]) == 50
+    assert len(emt_madrid._local_nearest(snapshot, 40.4168, -3.7038, -3)["data"]["data"]) == 1
+    for count in ("five", None, float("inf")):
+        assert emt_madrid._local_nearest(snapshot, 40.4168, -3.7038, count) == {
+            "status": "ERROR", "message": f"Invalid count: {count}"}
+
+
+def test_stations_near_points(snapshot):
+    points = [{"latitude": 40.4168, "longitude": -3.7038, "label": "origin"}, [40.45, -3.69]]
+    result = emt_madrid._stations_near_points(snapshot, points, "2", "docks")
+    assert result["status"] == "success"
+    assert [entry["label"] for entry in result["results"]] == ["origin", "point 2"]
+    for entry in result["results"]:
+        stations = entry["stations"]
+        assert len(stations) == 2 and all(station["free_bases"] > 0 for station in stations)
+        assert stations[0]["distance"] <= stations[1]["distance"]
+        nearest = emt_madrid._local_nearest(snapshot, entry["latitude"], entry["longitude"], 1)
+        assert stations[0]["distance"] >= nearest["data"]["data"][0]["distance"]
+
+
+@pytest.mark.parametrize("points,count", [
+    ([[float("nan"), -3.7]], 3),
+    ([{"latitude": 40.4, "longitude": float("inf")}], 3),
+    ([[40.4, -3.7]], "two"),
+    ([[40.4, -3.7]] * 26, 3),
+    ([], 3),
+    ("40.4,-3.7", 3),
+])
+def test_stations_near_points_rejects_bad_arguments(snapshot, points, count):
+    assert emt_madrid._stations_near_points(snapshot, points, count, "bikes")["status"] == "ERROR"
+
+
+def test_query_limit(snapshot):
+    def query(limit):
+        return emt_madrid._query_result(snapshot, None, None, None, None, None, None, None, limit, ["id"])
+    assert len(query("4")["stations"]) == 4
+    assert len(query(-2)["stations"]) == 1
+    for limit in (float("inf"), "many"):
+        assert query(limit) == {"status": "ERROR", "message": f"Invalid limit: {limit}"}
+
+
+def test_station_history_arguments(monkeypatch):
+    occupancy = emt_madrid.OccupancyRingBuffer(capacity=50)
+    monkeypatch.setattr(emt_madrid, "_occupancy", occupancy)
+    now = time.time()
+    for step in range(40):
+        snapshot = emt_madrid.StationSnapshot({"code": "00", "data": station_dicts(3, seed=step)})
+        snapshot.fetched_at = now - 600 + step * 10
+        occupancy.append(snapshot)
+    result = emt_madrid.get_bicimad_station_history("1", minutes="30", max_points="10")
+    assert result["status"] == "success" and len(result["samples"]) == 10
+    assert result["summary"]["samples"] == 40
+    assert emt_madrid.get_bicimad_station_history("1", max_points="x") == {
+        "status": "ERROR", "message": "Invalid max_points: x"}
+    assert emt_madrid.get_bicimad_station_history("1", minutes="x") == {
+        "status": "ERROR", "message": "Invalid minutes: x"}
+    assert emt_madrid.get_bicimad_station_history("one")["message"] == "Invalid station_id: one"
+
+
+def test_trend_arguments(tmp_path, monkeypatch):
+    raw = HistoryStore(str(tmp_path))
+    now = int(time.time())
+    for step in range(12):
+        snapshot = emt_madrid.StationSnapshot({"code": "00", "data": station_dicts(3)})
+        snapshot.fetched_at = now - 3600 + step * 300
+        raw.append_snapshot(snapshot)
+    monkeypatch.setattr(emt_madrid, "_tiered_history", TieredHistory(raw))
+
+    result = emt_madrid.get_bicimad_station_trend("1", hours="2", bucket_minutes="30")
+    assert result["status"] == "success" and result["samples"] == 12
+    assert result["hours"] == 2.0 and result["bucket_minutes"] == 30
+    assert emt_madrid.get_bicimad_station_trend("1", bucket_minutes="x") == {
+        "status": "ERROR", "message": "Invalid bucket_minutes: x"}
+    for hours in ("x", float("nan"), float("inf"), 0, -5):
+        assert emt_madrid.get_bicimad_station_trend("1", hours=hours) == {
+            "status": "ERROR", "message": f"Invalid hours: {hours}"}
+
+
+def test_emt_error_code_is_not_an_empty_snapshot(cache, monkeypatch):
+    monkeypatch.setattr(emt_madrid, "_stations_validators", dict.fromkeys(("etag", "last_modified", "body_hash")))
+    invalidated = []
+    monkeypatch.setattr(emt_madrid.get_token_manager(), "invalidate", lambda token=None: invalidated.append(token))
+    cache(station_dicts(5)).get()
+    response = EMTResponse(200, "OK", {"etag": '"v2"'}, b"")
+
+    body = b'{"code": "80", "description": "Token expired", "data": []}'
+    with pytest.raises(SnapshotUnavailableError, match="EMT API error 80: Token expired"):
+        emt_madrid._stations_payload(response, streamed(body))
+    assert invalidated == [None]
+    assert emt_madrid._conditional_headers() == {}
+
+
+def test_changes_since_a_version(cache):
+    stations = station_dicts(10)
+    cached = cache(*[[dict(station, dock_bikes=step) for station in stations] for step in range(3)])
+    first = cached.get()
+    second = cached.refresh()
+    # Another snapshot elsewhere takes a version: versions are not consecutive
+    emt_madrid.StationSnapshot({"code": "00", "data": []})
+    third = cached.refresh()
+
+    def changes(since):
+        return emt_madrid._changes_result(third, since)
+
+    assert changes(str(second.version))["from_version"] == second.version
+    assert changes(str(third.version - 1))["from_version"] == second.version
+    future = changes(str(third.version + 100))
+    assert future["from_version"] == third.version and future["changed"] == []
+    assert "message" not in future
+    if first.version > 1:
+        assert "older than the retained history" in changes(str(first.version - 1))["message"]
+    assert changes("yesterday")["status"] == "ERROR"
+    assert changes("2025-13-45T99:00")["status"] == "ERROR"
+
+
+@pytest.mark.skipif(emt_madrid.MADRID_TZ is None, reason="no tz database")
+def test_naive_since_is_madrid_time(cache):
+    stations = station_dicts(10)
+    cached = cache(*[[dict(station, dock_bikes=step) for station in stations] for step in range(3)])
+    snapshots = [cached.get(), cached.refresh(), cached.refresh()]
+    # 07:30, 08:30 and 09:30 UTC; 10:00 in Madrid (summer time) is 08:00 UTC
+    for snapshot, hour in zip(snapshots, (7, 8, 9)):
+        snapshot.fetched_at = datetime(2025, 5, 1, hour, 30, tzinfo=timezone.utc).timestamp()
+    result = emt_madrid._changes_result(snapshots[2], "2025-05-01T10:00:00")
+    assert result["from_version"] == snapshots[0].version
+    assert emt_madrid._changes_result(snapshots[2], "2025-05-01T10:00:00+00:00")["from_version"] == snapshots[2].version
@@ -0,0 +1,83 @@
+"""Tests for the background-fitted availability forecaster."""
+
+import threading
+import time
+
+import numpy as np
+
+from api_agent.tools.forecast import AvailabilityForecaster, hour_of_week
+from api_agent.tools.history_rollups import ROLLUP_DTYPE
+
+# Monday 2025-05-05 08:00:00 UTC
+T0 = 1746432000
+
+
+class FakeHistory:
+    """TieredHistory stand-in counting queries; a query blocks until `release` is set."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def query(self, station_id, start, end, bucket_seconds):
+        self.queries += 1
+        self.release.wait(5)
+        return self.rows, "1h"
+
+
+def hourly_rows(station_id=7, bikes=6.0, weeks=3):
+    rows = np.zeros(weeks, dtype=ROLLUP_DTYPE)
+    rows["ts"] = T0 + np.arange(weeks) * 7 * 86400
+    rows["station_id"] = station_id
+    rows["samples"] = 12
+    rows["mean_bikes"] = bikes
+    return rows
+
+
+def wait_for_fit(forecaster):
+    deadline = time.monotonic() + 5
+    while forecaster._running and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not forecaster._running
+
+
+def test_lookups_never_wait_for_a_fit():
+    history = FakeHistory(hourly_rows())
+    history.release.clear()
+    forecaster = AvailabilityForecaster(history, tz=None)
+    started = time.monotonic()
+    assert forecaster.forecast(7, T0) is None
+    assert time.monotonic() - started < 1.0
+    history.release.set()
+    wait_for_fit(forecaster)
+
+    profile = forecaster.forecast(7, T0)
+    assert profile["mean_bikes"] == 6.0 and profile["weeks"] == 3
+    assert profile["hour_of_week"] == hour_of_week(T0, None)
+    assert history.queries == 1
+
+
+def test_stale_tables_are_served_while_refitting():
+    history = FakeHistory(hourly_rows(bikes=6.0))
+    forecaster = AvailabilityForecaster(history, refit_interval=0, tz=None)
+    forecaster.fit()
+    history.rows = hourly_rows(bikes=9.0)
+    history.release.clear()
+    assert forecaster.forecast(7, T0)["mean_bikes"] == 6.0
+    history.release.set()
+    wait_for_fit(forecaster)
+    assert forecaster.forecast(7, T0)["mean_bikes"] == 9.0
+
+
+def test_empty_history_is_not_queried_again_on_every_call():
+    history = FakeHistory(np.empty(0, dtype=ROLLUP_DTYPE))
+    forecaster = AvailabilityForecaster(history, tz=None)
+    assert not forecaster.attempted
+    forecaster.maybe_refit_in_background()
+    wait_for_fit(forecaster)
+    assert forecaster.attempted
+    for _ in range(20):
+        assert forecaster.forecast(7, T0) is None
+    assert history.queries == 1
@@ -0,0 +1,56 @@
+"""Tests for the offline gazetteer of Madrid places."""
+
+import pytest
+
+from api_agent.tools.gazetteer import PLACE_KINDS, Gazetteer, Place, get_gazetteer
+
+PLACES = [
+    (Place("landmark", "Parque del Retiro", 40.4153, -3.6845), "Retiro|El Retiro"),
+    (Place("landmark", "Glorieta de Bilbao", 40.4289, -3.7022), ""),
+    (Place("metro", "Retiro", 40.4207, -3.6859), ""),
+    (Place("metro", "Bilbao", 40.4289, -3.7022), ""),
+    (Place("barrio", "Retiro", 40.4110, -3.6760), "Distrito Retiro"),
+    (Place("barrio", "Salamanca", 40.4300, -3.6780), "Barrio de Salamanca"),
+]
+
+
+@pytest.fixture
+def gazetteer():
+    return Gazetteer([place for place, _ in PLACES], [aliases for _, aliases in PLACES])
+
+
+def best(gazetteer, text):
+    matches = gazetteer.resolve(text, limit=1)
+    return (matches[0][0].kind, matches[0][0].name) if matches else None
+
+
+def test_landmarks_win_ties(gazetteer):
+    assert best(gazetteer, "Retiro") == ("landmark", "Parque del Retiro")
+
+
+def test_kind_words_prefer_that_kind(gazetteer):
+    assert best(gazetteer, "metro Retiro") == ("metro", "Retiro")
+    assert best(gazetteer, "metro Bilbao") == ("metro", "Bilbao")
+    assert best(gazetteer, "distrito Retiro") == ("barrio", "Retiro")
+    assert best(gazetteer, "barrio de Salamanca") == ("barrio", "Salamanca")
+
+
+def test_filler_words_and_accents_are_ignored(gazetteer):
+    assert best(gazetteer, "cerca del Retiro") == ("landmark", "Parque del Retiro")
+    assert best(gazetteer, "near GLORIETA de bilbáo") == ("landmark", "Glorieta de Bilbao")
+
+
+def test_scores_and_limit(gazetteer):
+    matches = gazetteer.resolve("Retiro", limit=3)
+    assert len(matches) == 3 and all(0 < score <= 1 for _, score in matches)
+    assert matches[0][1] == 1.0
+    assert gazetteer.resolve("Chamartín") == []
+
+
+def test_shipped_places_load_once():
+    gazetteer = get_gazetteer()
+    assert get_gazetteer() is gazetteer and len(gazetteer) > 100
+    assert {place.kind for place in gazetteer.places} <= set(PLACE_KINDS)
+    place, score = gazetteer.resolve("Puerta del Sol", limit=1)[0]
+    assert place.name == "Puerta del Sol" and score == 1.0
+    assert 40.3 < place.latitude < 40.6 and -3.9 < place.longitude < -3.5
@@ -0,0 +1,87 @@
+"""Tests for the 15-minute / hourly rollups of the occupancy history."""
+
+import numpy as np
+import pytest
+
+from api_agent.tools.history_rollups import ROLLUP_DTYPE, TieredHistory, merge_rollups, rollup_raw, rollup_summary
+from api_agent.tools.history_store import RECORD_DTYPE, HistoryStore
+
+# 2025-05-01 00:00:00 UTC
+T0 = 1746057600
+
+
+def records(ts, station_id, bikes, docks=5):
+    rows = np.zeros(len(ts), dtype=RECORD_DTYPE)
+    rows["ts"] = ts
+    rows["station_id"] = station_id
+    rows["dock_bikes"] = bikes
+    rows["free_bases"] = docks
+    return rows
+
+
+def test_rollup_raw():
+    rows = np.concatenate([
+        records([T0, T0 + 300, T0 + 600], 1, [0, 4, 8]),
+        records([T0 + 900], 1, [2], docks=0),
+        records([T0 + 60], 2, [3]),
+    ])
+    rollups = rollup_raw(rows, 900)
+    assert rollups["ts"].tolist() == [T0, T0, T0 + 900]
+    assert rollups["station_id"].tolist() == [1, 2, 1]
+    first = rollups[0]
+    assert (first["samples"], first["empty"], first["full"]) == (3, 1, 0)
+    assert (first["min_bikes"], first["max_bikes"]) == (0, 8)
+    assert first["mean_bikes"] == pytest.approx(4.0)
+    assert rollups[2]["full"] == 1
+    assert rollup_raw(np.empty(0, dtype=RECORD_DTYPE), 900).dtype == ROLLUP_DTYPE
+
+
+def test_merge_is_sample_weighted_and_matches_a_direct_rollup():
+    rng = np.random.default_rng(3)
+    ts = T0 + np.sort(rng.integers(0, 7200, 300))
+    rows = records(ts, rng.integers(1, 4, 300), rng.integers(0, 20, 300))
+    merged = merge_rollups(rollup_raw(rows, 900), 3600)
+    direct = rollup_raw(rows, 3600)
+    for field in ("ts", "station_id", "samples", "empty", "full", "min_bikes", "max_bikes"):
+        assert merged[field].tolist() == direct[field].tolist()
+    np.testing.assert_allclose(merged["mean_bikes"], direct["mean_bikes"], rtol=1e-5)
+
+
+def test_compact_and_query(tmp_path):
+    raw = HistoryStore(str(tmp_path))
+    # One sample per station every 5 minutes for 3 hours
+    for step in range(36):
+        ts = T0 + step * 300
+        raw.append(ts, records([ts, ts], [1, 2], [step, 10]))
+    history = TieredHistory(raw)
+    written = history.compact(now=T0 + 3 * 3600)
+    assert written == {"15min": 24, "1h": 6}
+    # Compaction resumes after the last bucket
+    assert history.compact(now=T0 + 3 * 3600) == {"15min": 0, "1h": 0}
+
+    hourly, tier = history.query(1, T0, T0 + 3 * 3600 - 1, 3600)
+    assert tier == "1h"
+    assert hourly["samples"].tolist() == [12, 12, 12]
+    assert hourly["mean_bikes"].tolist() == pytest.approx([5.5, 17.5, 29.5])
+
+    quarter, tier = history.query(2, T0, T0 + 3600 - 1, 900)
+    assert tier == "15min" and quarter["mean_bikes"].tolist() == [10.0] * 4
+
+    # A not-yet-compacted tail is filled from the raw records
+    ts = T0 + 3 * 3600
+    raw.append(ts, records([ts], [1], [40]))
+    hourly, _ = history.query(1, T0, ts, 3600)
+    assert hourly["samples"].tolist() == [12, 12, 12, 1]
+
+    summary = rollup_summary(hourly, 3600)
+    assert summary[-1]["mean_bikes"] == 40.0 and summary[0]["empty_pct"] == 8
+
+
+def test_retention(tmp_path):
+    raw = HistoryStore(str(tmp_path))
+    day = 86400
+    for offset in (0, 10 * day):
+        raw.append(T0 + offset, records([T0 + offset], [1], [1]))
+    history = TieredHistory(raw, {"raw": 5})
+    history.apply_retention(now=T0 + 10 * day)
+    assert raw.partitions() == ["20250511"]
@@ -0,0 +1,106 @@
+"""Tests for the append-only, mmap-read occupancy history store."""
+
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from api_agent.tools.history_store import INDEX_DTYPE, RECORD_DTYPE, HistoryStore, partition_keys
+
+DAY = 86400
+# 2025-05-01 00:00:00 UTC
+T0 = 1746057600
+
+
+def block(ts, station_ids, bikes=5):
+    records = np.zeros(len(station_ids), dtype=RECORD_DTYPE)
+    records["ts"] = ts
+    records["station_id"] = station_ids
+    records["dock_bikes"] = bikes
+    return records
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path))
+
+
+def test_append_and_query_across_partitions(store):
+    for hour in range(0, 48, 6):
+        store.append(T0 + hour * 3600, block(T0 + hour * 3600, [1, 2, 3], bikes=hour))
+    assert store.partitions() == ["20250501", "20250502"]
+    assert store.time_range() == (T0, T0 + 42 * 3600)
+
+    rows = store.query(T0 + 6 * 3600, T0 + 30 * 3600)
+    assert sorted(set(rows["ts"].tolist())) == [T0 + h * 3600 for h in (6, 12, 18, 24, 30)]
+    station = store.query(T0, T0 + 2 * DAY, station_id=2)
+    assert station["station_id"].tolist() == [2] * 8
+    assert station["dock_bikes"].tolist() == list(range(0, 48, 6))
+    assert len(store.query(T0 + 3 * DAY, T0 + 4 * DAY)) == 0
+
+
+def test_delete_before(store):
+    store.append(T0, block(T0, [1]))
+    store.append(T0 + DAY, block(T0 + DAY, [1]))
+    assert store.delete_before(T0 + DAY + 10) == ["20250501"]
+    assert store.partitions() == ["20250502"]
+    assert store.disk_usage() == RECORD_DTYPE.itemsize + INDEX_DTYPE.itemsize
+
+
+def test_records_without_index_entry_are_never_read(store):
+    store.append(T0, block(T0, [1, 2]))
+    bin_path = os.path.join(store.directory, "20250501.bin")
+    # Crash after writing the records of a block, before its index entry
+    with open(bin_path, "ab") as handle:
+        handle.write(block(T0 + 60, [1, 2, 3], bikes=99).tobytes())
+    assert store.query(T0, T0 + 3600)["dock_bikes"].tolist() == [5, 5]
+
+    # The next append cuts the orphans off
+    store.append(T0 + 120, block(T0 + 120, [1, 2], bikes=7))
+    rows = store.query(T0, T0 + 3600)
+    assert rows["dock_bikes"].tolist() == [5, 5, 7, 7]
+    assert os.path.getsize(bin_path) == 4 * RECORD_DTYPE.itemsize
+
+
+def test_torn_writes_are_dropped(store):
+    store.append(T0, block(T0, [1, 2]))
+    with open(os.path.join(store.directory, "20250501.bin"), "ab") as handle:
+        handle.write(b"\x01\x02\x03")
+    with open(os.path.join(store.directory, "20250501.idx"), "ab") as handle:
+        handle.write(b"\x01\x02\x03\x04\x05")
+    store.append(T0 + 60, block(T0 + 60, [1, 2], bikes=8))
+    assert store.query(T0, T0 + 3600)["dock_bikes"].tolist() == [5, 5, 8, 8]
+
+
+def test_gaps_between_indexed_blocks_are_skipped(store):
+    # Layout a crash could leave before orphans were cut off on append
+    records = np.concatenate([block(T0, [1]), block(T0 + 30, [9], bikes=99), block(T0 + 60, [1], bikes=6)])
+    index = np.array([(T0, 1, 0), (T0 + 60, 1, 2)], dtype=INDEX_DTYPE)
+    os.makedirs(store.directory)
+    records.tofile(os.path.join(store.directory, "20250501.bin"))
+    index.tofile(os.path.join(store.directory, "20250501.idx"))
+    rows = store.query(T0, T0 + 3600)
+    assert rows["dock_bikes"].tolist() == [5, 6]
+    assert store.query(T0, T0 + 3600, station_id=9).size == 0
+
+
+def test_snapshot_is_appended_once(store, make_snapshot):
+    snapshot = make_snapshot(count=20)
+    snapshot.fetched_at = T0 + 10
+    threads = [threading.Thread(target=store.append_snapshot, args=(snapshot,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    rows = store.query(T0, T0 + 60)
+    assert len(rows) == 20
+    assert rows["station_id"].tolist() == sorted(rows["station_id"].tolist())
+    # Older snapshots are ignored
+    snapshot.fetched_at = T0
+    store.append_snapshot(snapshot)
+    assert len(store.query(T0, T0 + 60)) == 20
+
+
+def test_partition_keys():
+    assert partition_keys(T0 - 1, T0 + DAY) == ["20250430", "20250501", "20250502"]
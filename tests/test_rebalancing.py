@@ -0,0 +1,58 @@
+"""Tests for the greedy truck rebalancing plan."""
+
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from api_agent.tools.rebalancing import plan_rebalancing, station_imbalance
+
+from conftest import station_dicts
+
+
+@pytest.fixture
+def snapshot(make_snapshot):
+    stations = station_dicts(400, seed=9)
+    for station in stations[::10]:
+        station["activate"] = 0
+    return make_snapshot(stations)
+
+
+def test_imbalance_flags_only_active_stations_outside_the_band(snapshot):
+    store = snapshot.store
+    surplus, deficit, target_fill = station_imbalance(store)
+    fill = store.dock_bikes / store.total_bases
+    active = store.activate == 1
+    assert 0 < target_fill < 1
+    assert np.all((surplus > 0) <= (active & (fill > 0.75)))
+    assert np.all((deficit > 0) <= (active & (fill < 0.25)))
+    assert not np.any((surplus > 0) & (deficit > 0))
+    assert np.all(surplus[~active] == 0) and np.all(deficit[~active] == 0)
+
+
+def test_moves_respect_surplus_and_deficit(snapshot):
+    surplus, deficit, _ = station_imbalance(snapshot.store)
+    plan = plan_rebalancing(snapshot)
+    sent, received = Counter(), Counter()
+    for source, target, bikes, meters in plan["moves"]:
+        assert bikes > 0 and meters >= 0
+        sent[source] += bikes
+        received[target] += bikes
+    assert all(bikes <= surplus[source] for source, bikes in sent.items())
+    assert all(bikes <= deficit[target] for target, bikes in received.items())
+    moved = sum(sent.values())
+    assert 0 < moved <= min(plan["surplus_bikes"], plan["deficit_bikes"])
+    assert plan["unmet_deficit"] == plan["deficit_bikes"] - moved
+
+
+def test_plan_is_deterministic_and_honours_max_distance(snapshot):
+    assert plan_rebalancing(snapshot)["moves"] == plan_rebalancing(snapshot)["moves"]
+    short = plan_rebalancing(snapshot, max_distance_m=500)
+    assert all(meters <= 500 for _, _, _, meters in short["moves"])
+    assert short["unmet_deficit"] >= plan_rebalancing(snapshot)["unmet_deficit"]
+
+
+def test_balanced_network_needs_no_moves(make_snapshot):
+    stations = [dict(station, dock_bikes=10, free_bases=10, total_bases=20) for station in station_dicts(50)]
+    plan = plan_rebalancing(make_snapshot(stations))
+    assert plan["moves"] == [] and plan["surplus_bikes"] == plan["deficit_bikes"] == 0
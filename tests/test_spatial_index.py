@@ -0,0 +1,87 @@
+"""Tests for the grid spatial index against brute-force haversine scans."""
+
+import math
+
+import numpy as np
+import pytest
+
+from api_agent.tools.spatial_index import StationSpatialIndex, get_spatial_index, haversine_m
+
+
+@pytest.fixture(scope="module")
+def points():
+    rng = np.random.default_rng(7)
+    lats = rng.uniform(40.38, 40.48, 500)
+    lons = rng.uniform(-3.73, -3.66, 500)
+    # Positions in the source list need not be 0..n-1
+    positions = np.arange(500) * 3 + 1
+    return lats, lons, positions, StationSpatialIndex(lats, lons, positions, cell_size_m=400.0)
+
+
+QUERIES = [(40.4168, -3.7038), (40.38, -3.73), (40.50, -3.60), (39.0, -4.0)]
+
+
+def test_haversine_known_distance():
+    # Puerta del Sol to Atocha station, about 1.6 km
+    assert float(haversine_m(40.4169, -3.7035, 40.4066, -3.6892)) == pytest.approx(1690, rel=0.02)
+    assert float(haversine_m(40.0, -3.0, 40.0, -3.0)) == 0.0
+
+
+@pytest.mark.parametrize("lat,lon", QUERIES)
+@pytest.mark.parametrize("radius", [0, 250, 1000, 5000])
+def test_query_radius_matches_brute_force(points, lat, lon, radius):
+    lats, lons, positions, index = points
+    found, distances = index.query_radius(lat, lon, radius)
+    brute = haversine_m(lat, lon, lats, lons)
+    expected = positions[np.flatnonzero(brute <= radius)]
+    assert sorted(found.tolist()) == sorted(expected.tolist())
+    assert np.all(np.diff(distances) >= 0)
+    assert np.all(distances <= radius)
+
+
+@pytest.mark.parametrize("lat,lon", QUERIES)
+@pytest.mark.parametrize("k", [1, 5, 40])
+def test_query_knn_matches_brute_force(points, lat, lon, k):
+    lats, lons, positions, index = points
+    found, distances = index.query_knn(lat, lon, k)
+    brute = np.sort(haversine_m(lat, lon, lats, lons))[:k]
+    assert len(found) == k
+    np.testing.assert_allclose(distances, brute)
+
+
+def test_query_knn_more_than_indexed(points):
+    _, _, positions, index = points
+    found, _ = index.query_knn(40.4, -3.7, 10_000)
+    assert sorted(found.tolist()) == positions.tolist()
+
+
+def test_query_knn_batch_with_mask(points):
+    lats, lons, positions, index = points
+    mask = np.zeros(len(lats), dtype=bool)
+    mask[::50] = True
+    found, distances = index.query_knn_batch([40.41, 40.45], [-3.70, -3.68], 15, mask)
+    assert found.shape == (2, 15)
+    # Only 10 eligible stations: the rest is padded
+    assert set(found[:, :10].ravel()) <= set(positions[mask].tolist())
+    assert np.all(found[:, 10:] == -1) and np.all(np.isinf(distances[:, 10:]))
+
+
+def test_empty_index():
+    index = StationSpatialIndex(np.empty(0), np.empty(0), np.empty(0, dtype=np.int64))
+    assert len(index.query_knn(40.4, -3.7, 3)[0]) == 0
+    assert len(index.query_radius(40.4, -3.7, 1000)[0]) == 0
+
+
+def test_snapshot_index_skips_stations_without_coordinates(make_snapshot):
+    stations = [
+        {"id": 1, "geometry": {"type": "Point", "coordinates": [-3.70, 40.41]}},
+        {"id": 2},
+        {"id": 3, "geometry": {"type": "Point", "coordinates": [-3.69, 40.42]}},
+    ]
+    snapshot = make_snapshot(stations)
+    index = get_spatial_index(snapshot)
+    assert index.positions.tolist() == [0, 2]
+    assert get_spatial_index(snapshot.renewed()) is index
+    found, _ = index.query_knn(40.41, -3.70, 5)
+    assert found.tolist() == [0, 2]
+    assert not math.isnan(index.lats.sum())
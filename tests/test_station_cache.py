@@ -0,0 +1,200 @@
+"""Tests for the TTL / stale-while-revalidate station snapshot cache."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from api_agent.tools.station_cache import (
+    SNAPSHOT_UNCHANGED,
+    SnapshotUnavailableError,
+    StationSnapshot,
+    StationSnapshotCache,
+)
+
+from conftest import station_dicts
+
+
+def payload(count=5, seed=1):
+    return {"code": "00", "data": station_dicts(count, seed)}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_fresh_snapshot_is_served_from_memory():
+    calls = []
+    cache = StationSnapshotCache(lambda: calls.append(1) or payload(), ttl=60)
+    first = cache.get()
+    assert cache.get() is first
+    assert len(calls) == 1
+    assert len(first) == 5 and first.get(3)["id"] == 3
+    assert cache.stats()["hits"] == 1
+
+
+def test_stale_snapshot_is_served_while_refreshing():
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        if len(calls) > 1:
+            release.wait(5)
+        return payload(seed=len(calls))
+
+    cache = StationSnapshotCache(loader, ttl=0)
+    first = cache.get()
+    # Stale: returned at once, a single background download starts
+    assert cache.get() is first
+    assert cache.get() is first
+    release.set()
+    wait_for(lambda: cache.peek() is not first)
+    assert len(calls) == 2
+    assert cache.peek().version > first.version
+    assert [s.version for s in cache.history()] == [first.version, cache.peek().version]
+
+
+def test_unchanged_load_shares_columns():
+    payloads = iter([payload(), SNAPSHOT_UNCHANGED])
+    cache = StationSnapshotCache(lambda: next(payloads), ttl=60)
+    first = cache.get()
+    second = cache.refresh()
+    assert second is not first and second.version > first.version
+    assert second.store is first.store
+    assert cache.stats()["unchanged_loads"] == 1
+
+
+def test_unchanged_without_snapshot_fails():
+    cache = StationSnapshotCache(lambda: SNAPSHOT_UNCHANGED)
+    with pytest.raises(SnapshotUnavailableError):
+        cache.get()
+    assert cache.stats()["failed_loads"] == 1
+
+
+def test_failing_listener_does_not_break_the_cache():
+    seen = []
+    cache = StationSnapshotCache(payload)
+    cache.subscribe(lambda snapshot: 1 / 0)
+    cache.subscribe(seen.append)
+    snapshot = cache.get()
+    assert seen == [snapshot]
+
+
+def test_concurrent_first_calls_share_one_download():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return payload()
+
+    cache = StationSnapshotCache(loader)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert len({id(snapshot) for snapshot in results}) == 1
+
+
+def test_aget_installs_off_the_event_loop():
+    listener_threads = []
+
+    async def async_loader():
+        return payload()
+
+    cache = StationSnapshotCache(payload, async_loader)
+    cache.subscribe(lambda snapshot: listener_threads.append(threading.get_ident()))
+
+    async def run():
+        snapshot = await cache.aget()
+        return snapshot, threading.get_ident()
+
+    snapshot, loop_thread = asyncio.run(run())
+    assert len(snapshot) == 5
+    assert listener_threads and loop_thread not in listener_threads
+
+
+def test_loads_never_overlap_and_waiters_share_the_result():
+    running, overlaps, calls = [], [], []
+    gate = threading.Event()
+
+    def loader():
+        calls.append(1)
+        running.append(1)
+        overlaps.append(len(running))
+        gate.wait(5)
+        running.pop()
+        return payload(seed=len(calls))
+
+    cache = StationSnapshotCache(loader, ttl=0)
+    gate.set()
+    cache.get()
+    gate.clear()
+    # A poller refresh and a stale-triggered background refresh at the same time
+    results = []
+    poller = threading.Thread(target=lambda: results.append(cache.refresh()))
+    poller.start()
+    wait_for(lambda: len(calls) == 2)
+    cache.get()
+    waiter = threading.Thread(target=lambda: results.append(cache.refresh()))
+    waiter.start()
+    time.sleep(0.05)
+    gate.set()
+    poller.join(5)
+    waiter.join(5)
+    wait_for(lambda: not cache._refreshing)
+
+    assert max(overlaps) == 1
+    # The background refresh and the second refresh() reused the poller's download
+    assert len(calls) == 2
+    assert results[0] is results[1] is cache.peek()
+
+
+def test_older_snapshot_is_not_installed_over_a_newer_one():
+    cache = StationSnapshotCache(payload)
+    older = StationSnapshot(payload(seed=2))
+    current = cache.get()
+    assert cache._install(older) is current
+    assert cache.peek() is current and len(cache.history()) == 1
+
+
+def test_async_first_load_excludes_blocking_loads():
+    sync_calls = []
+    download_started = threading.Event()
+    release = threading.Event()
+
+    def loader():
+        sync_calls.append(1)
+        return payload(seed=2)
+
+    async def async_loader():
+        download_started.set()
+        await asyncio.to_thread(release.wait, 5)
+        return payload()
+
+    cache = StationSnapshotCache(loader, async_loader)
+    results = []
+
+    async def run():
+        first = asyncio.ensure_future(cache.aget())
+        await asyncio.to_thread(download_started.wait, 5)
+        # A poller refresh while the async download is in flight waits for it
+        poller = threading.Thread(target=lambda: results.append(cache.refresh()))
+        poller.start()
+        await asyncio.sleep(0.05)
+        assert not sync_calls
+        release.set()
+        snapshot = await first
+        await asyncio.to_thread(poller.join, 5)
+        return snapshot
+
+    snapshot = asyncio.run(run())
+    assert not sync_calls and results == [snapshot] and cache.peek() is snapshot
@@ -0,0 +1,67 @@
+"""Tests for the grid clustering of the station map."""
+
+import numpy as np
+
+from api_agent.tools.station_clusters import CLUSTER_FIELDS, CLUSTER_ZOOMS, cluster_levels
+from api_agent.tools.station_store import StationStore
+from conftest import station_dicts
+
+FIELD = {name: index for index, name in enumerate(CLUSTER_FIELDS)}
+
+
+def station(station_id, lon, lat, bikes, total, activate=1):
+    return {
+        "id": station_id, "number": str(station_id), "name": f"Estación {station_id}",
+        "activate": activate, "no_available": 0, "dock_bikes": bikes,
+        "free_bases": total - bikes, "total_bases": total,
+        "geometry": None if lon is None else {"type": "Point", "coordinates": [lon, lat]},
+    }
+
+
+def fixed_store():
+    return StationStore.from_records([
+        station(1, -3.7038, 40.4168, 5, 20),
+        station(2, -3.7010, 40.4180, 7, 24),
+        station(3, -3.6000, 40.5000, 2, 18),
+        station(4, None, None, 9, 30),
+        station(5, -3.7060, 40.4150, 0, 15, activate=0),
+    ])
+
+
+def test_cluster_membership_and_totals():
+    store = fixed_store()
+    levels = dict(cluster_levels(store, zooms=(10, 18)))
+
+    # Zoom 10 cells are ~7 km wide: the three central stations share one
+    central, far = levels[10]
+    if central[FIELD["stations"]] == 1:
+        central, far = far, central
+    assert central[FIELD["stations"]] == 3 and central[FIELD["active"]] == 2
+    assert central[FIELD["bikes"]] == 12 and central[FIELD["total_docks"]] == 59
+    assert central[FIELD["free_docks"]] == 47
+    assert int(central[FIELD["station"]]) in (0, 1, 4)
+    assert np.isclose(central[FIELD["latitude"]], (40.4168 + 40.4180 + 40.4150) / 3)
+    assert np.isclose(central[FIELD["longitude"]], (-3.7038 - 3.7010 - 3.7060) / 3)
+
+    # A lone station is its own cluster, at its own position
+    assert far[FIELD["stations"]] == 1 and int(far[FIELD["station"]]) == 2
+    assert np.isclose(far[FIELD["latitude"]], 40.5) and np.isclose(far[FIELD["longitude"]], -3.6)
+
+    # Zoom 18 cells are ~30 m wide: every located station stands alone
+    members = sorted(int(row[FIELD["station"]]) for row in levels[18])
+    assert members == [0, 1, 2, 4]
+    assert (levels[18][:, FIELD["stations"]] == 1).all()
+
+
+def test_every_level_accounts_for_every_located_station():
+    store = StationStore.from_records(station_dicts(500, seed=3))
+    previous = 0
+    for zoom, clusters in cluster_levels(store):
+        assert zoom in CLUSTER_ZOOMS
+        assert clusters.shape[1] == len(CLUSTER_FIELDS)
+        assert clusters[:, FIELD["stations"]].sum() == 500
+        assert clusters[:, FIELD["bikes"]].sum() == store.dock_bikes.sum()
+        assert clusters[:, FIELD["total_docks"]].sum() == store.total_bases.sum()
+        # Cells split in four from one zoom to the next, so clusters never merge
+        assert len(clusters) >= previous
+        previous = len(clusters)
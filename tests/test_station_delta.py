@@ -0,0 +1,42 @@
+"""Tests for the snapshot delta engine."""
+
+from api_agent.tools.station_delta import diff_snapshots
+
+from conftest import station_dicts
+
+
+def test_changed_added_removed(make_snapshot):
+    stations = station_dicts(10)
+    old = make_snapshot(stations)
+    new_stations = [dict(station) for station in stations[1:]]
+    new_stations[0]["dock_bikes"] += 2
+    new_stations[0]["free_bases"] -= 2
+    new_stations[4]["activate"] = 0
+    new_stations.append(dict(stations[0], id=99, name="Nueva"))
+    new = make_snapshot(new_stations)
+
+    delta = diff_snapshots(old, new)
+    changes = delta.changes()
+    assert [change["id"] for change in changes] == [2, 6]
+    assert changes[0]["dock_bikes_change"] == 2 and changes[0]["free_bases_change"] == -2
+    assert changes[1]["activate"] == 0 and changes[1]["previous_activate"] == 1
+    assert "activate" not in changes[0]
+
+    payload = delta.to_dict()
+    assert payload["added"] == [{"id": 99, "name": "Nueva"}]
+    assert payload["removed"] == [{"id": 1, "name": "Estación 1"}]
+    assert payload["unchanged_count"] == 7
+    assert (payload["from_version"], payload["to_version"]) == (old.version, new.version)
+
+
+def test_station_order_does_not_matter(make_snapshot):
+    stations = station_dicts(20)
+    delta = diff_snapshots(make_snapshot(stations), make_snapshot(list(reversed(stations))))
+    assert delta.changes() == [] and delta.unchanged == 20
+
+
+def test_renewed_snapshot_has_no_changes(make_snapshot):
+    old = make_snapshot()
+    payload = diff_snapshots(old, old.renewed()).to_dict()
+    assert payload["changed"] == payload["added"] == payload["removed"] == []
+    assert payload["unchanged_count"] == len(old)
@@ -0,0 +1,82 @@
+"""Tests for the cached station map pages."""
+
+import io
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+from api_agent.tools.station_map import (
+    _STALE_PARTIAL_SECONDS, MAP_FIELDS, asset, evict_pages, render_station_map,
+    station_rows, write_station_data, write_station_map,
+)
+from conftest import station_dicts
+
+
+def touch(path, age=0.0, size=10):
+    with open(path, "wb") as file:
+        file.write(b"x" * size)
+    moment = time.time() - age
+    os.utime(path, (moment, moment))
+    return str(path)
+
+
+def script_json(page, element_id):
+    match = re.search(f'<script type="application/json" id="{element_id}">(.*?)</script>', page, re.S)
+    return json.loads(match.group(1))
+
+
+def test_station_data_is_written_in_blocks(make_snapshot):
+    store = make_snapshot(count=25).store
+    file = io.StringIO()
+    assert write_station_data(file, store, chunk_rows=7) == 25
+    assert json.loads(file.getvalue()) == station_rows(store, np.arange(25))
+    assert len(json.loads(file.getvalue())[0]) == len(MAP_FIELDS)
+
+
+def test_page_fills_every_slot(tmp_path, make_snapshot):
+    stations = station_dicts(30)
+    stations[0]["name"] = "Plaza </script><script>alert(1)</script>"
+    store = make_snapshot(stations).store
+    file = io.StringIO()
+    assert write_station_map(file, store, source={"version": 3, "events": "/events"}) == 30
+
+    page = file.getvalue()
+    assert "{{" not in page and "alert(1)</script>" not in page
+    rows = script_json(page, "stationRows")
+    assert len(rows) == 30 and rows[0][MAP_FIELDS.index("name")] == stations[0]["name"]
+    assert script_json(page, "stationFields") == list(MAP_FIELDS)
+    assert script_json(page, "mapSource") == {"version": 3, "events": "/events"}
+    assert script_json(page, "stationClusters")
+
+    # The CSS and JS live in content-hashed files next to the pages
+    render_station_map(store, str(tmp_path))
+    assets = re.findall(r'(?:href|src)="(assets/[^"]+)"', page)
+    assert len(assets) == 2
+    for relative in assets:
+        with open(tmp_path / relative, "rb") as written:
+            assert written.read() == asset(relative)
+
+
+def test_pages_are_reused_and_evicted(tmp_path, make_snapshot):
+    first = make_snapshot(seed=1).store
+    path, count, reused = render_station_map(first, str(tmp_path), max_files=1)
+    assert count == len(first) and not reused
+    assert render_station_map(first, str(tmp_path), max_files=1) == (path, count, True)
+
+    other, _, _ = render_station_map(make_snapshot(seed=2).store, str(tmp_path), max_files=1)
+    assert os.path.exists(other) and not os.path.exists(path)
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".partial_")]
+
+
+def test_eviction_removes_stale_partial_files(tmp_path):
+    stale = touch(tmp_path / ".partial_abc.html", age=_STALE_PARTIAL_SECONDS + 60)
+    fresh = touch(tmp_path / ".partial_def.html")
+    other_kind = touch(tmp_path / ".partial_ghi.png", age=_STALE_PARTIAL_SECONDS + 60)
+    pages = [touch(tmp_path / f"bicimad_stations_{index}.html", age=100 - index) for index in range(3)]
+
+    assert evict_pages(str(tmp_path), max_files=2) == 1
+    assert not os.path.exists(stale) and not os.path.exists(pages[0])
+    assert all(os.path.exists(path) for path in (fresh, other_kind, pages[1], pages[2]))
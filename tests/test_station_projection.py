@@ -0,0 +1,98 @@
+"""Tests for the station projection, ordering, summary and byte budget helpers."""
+
+import json
+
+import numpy as np
+import pytest
+
+from api_agent.tools.station_projection import (
+    BUDGET_HINT,
+    STATION_FIELDS,
+    fit_lists_to_budget,
+    fit_to_budget,
+    order_positions,
+    parse_fields,
+    project_record,
+    project_stations,
+    summarize_stations,
+)
+from api_agent.tools.station_store import StationStore
+
+from conftest import station_dicts
+
+
+@pytest.fixture
+def stations():
+    return station_dicts(100)
+
+
+@pytest.fixture
+def store(stations):
+    return StationStore.from_records(stations)
+
+
+def test_parse_fields():
+    assert parse_fields(None) is None and parse_fields("") is None and parse_fields([]) is None
+    assert parse_fields("id, name,id") == ["id", "name"]
+    with pytest.raises(ValueError, match="Unknown fields: colour"):
+        parse_fields(["id", "colour"])
+
+
+def test_project_stations_matches_the_raw_records(stations, store):
+    positions = [5, 0, 42]
+    projected = project_stations(store, positions, list(STATION_FIELDS))
+    for position, station in zip(positions, projected):
+        assert station == project_record(stations[position], STATION_FIELDS)
+    assert project_stations(store, positions, ["id"]) == [{"id": stations[p]["id"]} for p in positions]
+
+
+def test_order_positions(stations, store):
+    ordered = order_positions(store, None, "-dock_bikes", 10)
+    expected = sorted(stations, key=lambda station: (-station["dock_bikes"], station["id"]))[:10]
+    assert store.ids[ordered].tolist() == [station["id"] for station in expected]
+    assert len(order_positions(store, None, "occupancy")) == len(stations)
+    with pytest.raises(ValueError, match="Cannot sort by 'colour'"):
+        order_positions(store, None, "colour")
+
+
+def test_summarize_stations(stations, store):
+    summary = summarize_stations(store, top=3)
+    totals = summary["totals"]
+    assert totals["stations"] == totals["active_stations"] == len(stations)
+    assert totals["available_bikes"] == sum(station["dock_bikes"] for station in stations)
+    assert totals["empty_stations"] == sum(station["dock_bikes"] == 0 for station in stations)
+    most_bikes = summary["top_stations"]["most_bikes"]
+    assert [station["dock_bikes"] for station in most_bikes] == sorted(
+        (station["dock_bikes"] for station in stations), reverse=True)[:3]
+    assert all(station["dock_bikes"] == 0 for station in summary["top_stations"]["empty"])
+
+
+def test_fit_to_budget_keeps_a_prefix_under_the_budget():
+    items = [{"id": index, "name": "x" * 50} for index in range(200)]
+    result = {"status": "success"}
+    fit_to_budget(result, result, "items", items, 2000)
+    assert len(json.dumps(result)) <= 2000
+    assert result["items"] == items[:result["returned_count"]]
+    assert result["truncated"] and result["total_count"] == 200 and result["hint"] == BUDGET_HINT
+
+    small = {"status": "success"}
+    fit_to_budget(small, small, "items", items[:3], 2000)
+    assert small == {"status": "success", "items": items[:3]}
+
+
+def test_fit_lists_to_budget_cuts_to_a_common_length():
+    result = {"status": "success", "lists": {}}
+    long_list = [{"value": "y" * 40} for _ in range(100)]
+    short_list = long_list[:4]
+    lists = [(result["lists"], "long", long_list), (result["lists"], "short", short_list)]
+    fit_lists_to_budget(result, lists, 1500, hint="smaller please")
+    kept = len(result["lists"]["long"])
+    assert 4 < kept < 100 and len(result["lists"]["short"]) == 4
+    assert result["returned_count"] == kept + 4 and result["total_count"] == 104
+    assert len(json.dumps(result)) <= 1500
+
+
+def test_empty_lists_fit():
+    result = {"status": "success"}
+    fit_lists_to_budget(result, [(result, "a", []), (result, "b", [])], 100)
+    assert result == {"status": "success", "a": [], "b": []}
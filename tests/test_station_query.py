@@ -0,0 +1,80 @@
+"""Tests for the sorted-column station query index."""
+
+import pytest
+
+from api_agent.tools.station_query import StationQueryIndex, get_query_index, parse_bbox
+from api_agent.tools.station_store import StationStore
+
+from conftest import station_dicts
+
+
+@pytest.fixture
+def stations():
+    stations = station_dicts(300, seed=4)
+    for station in stations[::7]:
+        station["activate"] = 0
+    return stations
+
+
+@pytest.fixture
+def index(stations):
+    return StationQueryIndex(StationStore.from_records(stations))
+
+
+def brute_force(stations, min_bikes=None, max_docks=None, bbox=None, active=True):
+    south, west, north, east = bbox or (-90, -180, 90, 180)
+    return [
+        station for station in stations
+        if (min_bikes is None or station["dock_bikes"] >= min_bikes)
+        and (max_docks is None or station["free_bases"] <= max_docks)
+        and south <= station["geometry"]["coordinates"][1] <= north
+        and west <= station["geometry"]["coordinates"][0] <= east
+        and (active is None or station["activate"] == int(active))
+    ]
+
+
+@pytest.mark.parametrize("min_bikes,max_docks,bbox,active", [
+    (5, None, None, True),
+    (None, 0, None, None),
+    (3, 10, [40.40, -3.71, 40.45, -3.68], True),
+    (None, None, [40.40, -3.71, 40.45, -3.68], False),
+    (100, None, None, None),
+])
+def test_query_matches_a_brute_force_scan(stations, index, min_bikes, max_docks, bbox, active):
+    ranges = parse_bbox(bbox)
+    if min_bikes is not None:
+        ranges["dock_bikes"] = (min_bikes, None)
+    if max_docks is not None:
+        ranges["free_bases"] = (None, max_docks)
+    expected = brute_force(stations, min_bikes, max_docks, bbox, active)
+
+    positions, total = index.query(ranges, active)
+    assert total == len(expected)
+    assert index.store.ids[positions].tolist() == [station["id"] for station in expected]
+
+    positions, total = index.query(ranges, active, "-free_bases", 5)
+    assert total == len(expected)
+    ordered = sorted(expected, key=lambda station: (-station["free_bases"], station["id"]))[:5]
+    assert index.store.ids[positions].tolist() == [station["id"] for station in ordered]
+
+
+def test_limit_zero_and_unknown_keys(index):
+    positions, total = index.query({}, None, "dock_bikes", 0)
+    assert len(positions) == 0 and total == len(index)
+    with pytest.raises(ValueError, match="Cannot filter on colour"):
+        index.query({"colour": (1, 2)})
+    with pytest.raises(ValueError, match="Cannot sort by"):
+        index.query({}, None, "colour")
+
+
+@pytest.mark.parametrize("bbox", [[40.5, -3.7, 40.4, -3.6], [1, 2, 3], ["a", 1, 2, 3]])
+def test_invalid_bbox(bbox):
+    with pytest.raises(ValueError, match="bbox"):
+        parse_bbox(bbox)
+
+
+def test_index_is_built_once_per_store(make_snapshot):
+    snapshot, other = make_snapshot(), make_snapshot(seed=2)
+    first = get_query_index(snapshot)
+    assert get_query_index(snapshot) is first
+    assert get_query_index(other).store is other.store
@@ -0,0 +1,55 @@
+"""Tests for the folded-word station text index."""
+
+import pytest
+
+from api_agent.tools.station_search import TextIndex, fold, get_search_index
+
+from conftest import station_dicts
+
+NAMES = [
+    "Puerta del Sol A", "Puerta del Sol B", "Glorieta de Bilbao", "Atocha Renfe",
+    "Plaza de Castilla", "Sol y Sombra", "Paseo de la Castellana 200",
+]
+
+
+@pytest.fixture
+def index():
+    return TextIndex([(NAMES, 1.0), ([f"Calle {number}" for number in range(len(NAMES))], 0.5)], len(NAMES))
+
+
+def names(index, text, limit=5):
+    rows, _ = index.search(text, limit)
+    return [NAMES[row] for row in rows]
+
+
+def test_fold():
+    assert fold("  Glorieta de BILBAO, nº 3 ") == "glorieta de bilbao no 3"
+    assert fold("Atocha-Renfe (Estación)") == "atocha renfe estacion"
+
+
+def test_exact_prefix_and_typo_matches(index):
+    assert names(index, "glorieta bilbao")[0] == "Glorieta de Bilbao"
+    assert names(index, "atoch")[0] == "Atocha Renfe"
+    assert names(index, "castellanna")[0] == "Paseo de la Castellana 200"
+    assert names(index, "puerta del sol")[:2] == ["Puerta del Sol A", "Puerta del Sol B"]
+    rows, scores = index.search("Glorieta de Bilbao")
+    assert scores[0] == 1.0 and all(0 < score <= 1 for score in scores)
+
+
+def test_limits_and_misses(index):
+    assert len(index.search("sol", limit=1)[0]) == 1
+    assert len(index.search("sol", limit=0)[0]) == 0
+    assert len(index.search("zzzzqqq")[0]) == 0
+
+
+def test_index_follows_the_station_texts(make_snapshot):
+    stations = station_dicts(30)
+    snapshot = make_snapshot(stations)
+    index = get_search_index(snapshot)
+    # Same texts in a new snapshot: the index is reused
+    assert get_search_index(make_snapshot([dict(station, dock_bikes=0) for station in stations])) is index
+    renamed = [dict(station, name="Estación Nueva" if station["id"] == 7 else station["name"])
+               for station in stations]
+    snapshot = make_snapshot(renamed)
+    rows, _ = get_search_index(snapshot).search("nueva")
+    assert snapshot.store.ids[rows].tolist() == [7]
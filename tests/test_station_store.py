@@ -0,0 +1,68 @@
+"""Tests for the columnar station store."""
+
+import numpy as np
+
+from api_agent.tools.station_store import StationStore, StationStoreBuilder
+
+from conftest import station_dicts
+
+
+def test_round_trip_records():
+    stations = station_dicts(50)
+    store = StationStore.from_records(stations)
+    assert len(store) == 50
+    assert store.to_records() == stations
+    assert store.record(4) == stations[4]
+
+
+def test_id_lookup():
+    stations = station_dicts(30)
+    # Unsorted ids and a non-numeric one
+    stations.reverse()
+    stations.append(dict(stations[0], id="X-1"))
+    store = StationStore.from_records(stations)
+    assert store.position_of(30) == 0
+    assert store.position_of("1") == 29
+    assert store.position_of("X-1") == 30
+    assert store.position_of(999) is None
+    assert store.position_of("01") is None
+    assert store.ids[30] == -1
+
+
+def test_missing_fields_and_coordinates():
+    store = StationStore.from_records([{"id": 7, "dock_bikes": "n/a", "latitude": 40.4, "longitude": -3.7},
+                                       {"id": 8, "name": None}])
+    assert store.dock_bikes[0] == 0
+    assert store.lats[0] == 40.4 and store.lons[0] == -3.7
+    assert store.has_coordinates().tolist() == [True, False]
+    assert "geometry" not in store.record(1)
+    assert store.names[1] == "" and store.numbers[1] == "8"
+
+
+def test_builder_grows_and_matches_from_records():
+    stations = station_dicts(100)
+    builder = StationStoreBuilder(capacity=4)
+    for station in stations:
+        builder.append(station)
+    assert len(builder) == 100
+    built = builder.build()
+    expected = StationStore.from_records(stations)
+    assert len(built) == 100
+    assert built.to_records() == expected.to_records()
+    assert built.digest() == expected.digest()
+    assert built.position_of(57) == 56
+
+
+def test_digest_tracks_content():
+    stations = station_dicts(20)
+    first = StationStore.from_records(stations).digest()
+    assert StationStore.from_records(station_dicts(20)).digest() == first
+    stations[3]["dock_bikes"] += 1
+    assert StationStore.from_records(stations).digest() != first
+
+
+def test_string_columns_are_interned():
+    store = StationStore.from_records([{"id": 1, "name": "Sol"}, {"id": 2, "name": "".join(["S", "ol"])}])
+    assert store.names[0] is store.names[1]
+    assert store.nbytes() > 0
+    assert store.dock_bikes.dtype == np.int16
@@ -0,0 +1,89 @@
+"""Tests for the incremental station list parser."""
+
+import json
+
+import pytest
+
+from api_agent.tools.station_store import StationStore
+from api_agent.tools.station_stream import StationStreamParser
+
+from conftest import station_dicts
+
+
+def parse(body: bytes, chunk_size: int):
+    parser = StationStreamParser(capacity=4)
+    for start in range(0, len(body), chunk_size):
+        parser.feed(body[start:start + chunk_size])
+    return parser.finish()
+
+
+def payload(stations, **meta) -> bytes:
+    return json.dumps(dict(meta, data=stations), ensure_ascii=False, indent=1).encode("utf-8")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 20])
+def test_any_chunking_gives_the_same_store(chunk_size):
+    # Names with multi-byte characters get cut between their bytes by small chunks
+    stations = station_dicts(40)
+    body = payload(stations, code="00", description="Estaciones BiciMAD — ñandú", datetime=1.5e9)
+    meta, store = parse(body, chunk_size)
+    assert meta == {"code": "00", "description": "Estaciones BiciMAD — ñandú", "datetime": 1.5e9}
+    expected = StationStore.from_records(stations)
+    assert store.ids.tolist() == expected.ids.tolist()
+    assert store.names == expected.names == [station["name"] for station in stations]
+    assert store.addresses[0] == "Calle de Prueba nº 1"
+    assert store.to_records() == expected.to_records()
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 12))
+def test_numbers_split_across_chunks(chunk_size):
+    meta, _ = parse(b'{"count": 12345, "ratio": -12.5e-3, "data": [], "ok": true}', chunk_size)
+    assert meta == {"count": 12345, "ratio": -0.0125, "ok": True}
+
+
+def test_empty_payloads():
+    assert parse(b'{}', 1)[0] == {}
+    meta, store = parse(b' {"data": [ ] } ', 1)
+    assert meta == {} and len(store) == 0
+
+
+def test_digest_covers_every_byte():
+    body = payload(station_dicts(3), code="00")
+    whole, chunked = StationStreamParser(), StationStreamParser()
+    whole.feed(body)
+    for start in range(0, len(body), 5):
+        chunked.feed(body[start:start + 5])
+    assert whole.digest() == chunked.digest() and whole.bytes_read == len(body)
+
+
+@pytest.mark.parametrize("body", [
+    b'{"code": "00", "data": [{"id": 1}',
+    b'{"code": "00", "data": [{"id": 1}, {"id": 2}]',
+    b'{"code": ',
+    b'',
+])
+def test_truncated_payload(body):
+    with pytest.raises(ValueError):
+        parse(body, 3)
+
+
+@pytest.mark.parametrize("body", [
+    b'[{"id": 1}]',
+    b'{"code": "00" "data": []}',
+    b'{"code" "00"}',
+    b'{,"code": "00"}',
+    b'{"code": "00",}',
+    b'{"code": "00",, "data": []}',
+    b'{"data": [{"id": 1} {"id": 2}]}',
+    b'{"data": [,{"id": 1}]}',
+    b'{"data": [{"id": 1},]}',
+    b'{"data": [{"id": 1},, {"id": 2}]}',
+    b'{1: "00"}',
+    b'{"data": [{"id": tru}]}',
+    b'{"data": []} {"data": []}',
+    b'{"name": "\xff\xfe"}',
+])
+@pytest.mark.parametrize("chunk_size", [1, 1 << 20])
+def test_invalid_payload(body, chunk_size):
+    with pytest.raises(ValueError):
+        parse(body, chunk_size)
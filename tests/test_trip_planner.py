@@ -0,0 +1,52 @@
+"""Tests for the pickup / drop-off station choice of a bike trip."""
+
+import pytest
+
+from api_agent.tools.trip_planner import plan_trip
+
+ORIGIN = (40.4168, -3.7038)
+DESTINATION = (40.4153, -3.6845)
+
+
+def station(station_id, lat, lon, bikes, total=20, activate=1):
+    return {
+        "id": station_id, "number": str(station_id), "name": f"Estación {station_id}",
+        "address": "", "activate": activate, "no_available": 0, "dock_bikes": bikes,
+        "free_bases": total - bikes, "total_bases": total, "reservations_count": 0, "light": 0,
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+    }
+
+
+def test_a_nearly_empty_station_loses_to_a_slightly_further_one(make_snapshot):
+    snapshot = make_snapshot([
+        station(1, ORIGIN[0] + 0.0005, ORIGIN[1], bikes=1),          # ~55 m, one bike
+        station(2, ORIGIN[0] + 0.0015, ORIGIN[1], bikes=12),         # ~170 m
+        station(3, ORIGIN[0] - 0.0003, ORIGIN[1], bikes=9, activate=0),
+        station(4, DESTINATION[0], DESTINATION[1] + 0.0005, bikes=20),   # full
+        station(5, DESTINATION[0], DESTINATION[1] + 0.0010, bikes=5),
+    ])
+    plan = plan_trip(snapshot, ORIGIN, DESTINATION)
+    assert plan["pickup"]["id"] == 2 and plan["dropoff"]["id"] == 5
+    assert plan["alternatives"]["pickup"][0]["id"] == 1
+    assert plan["total_min"] > plan["ride_min"] > 0
+    assert plan["walk_only_min"] > plan["total_min"]
+
+
+def test_ties_go_to_the_lower_station_id(make_snapshot):
+    snapshot = make_snapshot([
+        station(8, ORIGIN[0] + 0.001, ORIGIN[1], bikes=10),
+        station(3, ORIGIN[0] - 0.001, ORIGIN[1], bikes=10),
+        station(5, *DESTINATION, bikes=5),
+    ])
+    assert plan_trip(snapshot, ORIGIN, DESTINATION)["pickup"]["id"] == 3
+
+
+@pytest.mark.parametrize("bikes", [0, 20])
+def test_no_plan_without_a_bike_or_a_dock(make_snapshot, bikes):
+    snapshot = make_snapshot([station(1, *ORIGIN, bikes=bikes), station(2, *DESTINATION, bikes=bikes)])
+    assert plan_trip(snapshot, ORIGIN, DESTINATION) is None
+
+
+def test_the_same_station_is_not_a_trip(make_snapshot):
+    snapshot = make_snapshot([station(1, *ORIGIN, bikes=10)])
+    assert plan_trip(snapshot, ORIGIN, ORIGIN) is None